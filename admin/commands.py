@@ -12,6 +12,15 @@ from config.settings import ADMIN_ID
 from database import db_manager
 from database.repository import AdminRepository, TntRepository
 from database.models import User, Transaction, ApiRequest, TntUsageTracking, TntPlan, Referral, Commission, ReferralSetting
+from services.user_cache_service import user_profile_cache
+from services.broadcast_service import broadcast_engine
+from services.stats_service import stats_service
+from services.maintenance_service import maintenance_service
+from services.plan_catalog_service import plan_catalog
+from services.ai_scheduler import ai_scheduler
+from services.analysis_cache_service import analysis_cache
+from services.executor_service import executor_service
+from services.openai_client import completion_client
 
 # ایمپورت‌ها در سطح ماژول فقط به موارد غیر پروژه‌ای محدود می‌شوند
 # تمام ایمپورت‌های مربوط به database به داخل توابع منتقل شده‌اند
@@ -86,14 +95,12 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            
-            # دریافت آمار از repository
-            stats = repo.get_user_statistics()
-            
-            # فرمت کردن پیام
-            stats_text = f"""
+        # دریافت آمار (کش کوتاه‌مدت؛ با /stats refresh به‌روز می‌شود)
+        force_refresh = bool(context.args) and context.args[0] == "refresh"
+        stats = stats_service.user_statistics(force_refresh=force_refresh)
+        
+        # فرمت کردن پیام
+        stats_text = f"""
 📊 آمار کلی ربات:
 
 👥 تعداد کل کاربران: {stats['total_users']:,}
@@ -102,10 +109,10 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 💰 درآمد ماه جاری: ${stats['monthly_revenue']:.2f}
 
 🤖 وضعیت ربات: فعال ✅
-🕐 آخرین بروزرسانی: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            """
-            
-            await update.message.reply_text(stats_text)
+🕐 آخرین بروزرسانی: {stats['timestamp'][:19].replace('T', ' ')}
+        """
+        
+        await update.message.reply_text(stats_text)
             
     except Exception as e:
         await update.message.reply_text(f"❌ خطا در دریافت آمار: {str(e)}")
@@ -128,40 +135,13 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         message = ' '.join(context.args)
         
-        # دریافت لیست کاربران فعال
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            user_ids = repo.get_all_active_user_ids()
-        
-        if not user_ids:
-            await update.message.reply_text("هیچ کاربر فعالی یافت نشد.")
-            return
-        
-        success_count = 0
-        fail_count = 0
-        
-        await update.message.reply_text(f"شروع ارسال پیام به {len(user_ids):,} کاربر...")
-        
-        # Rate limiting برای جلوگیری از spam detection
-        for user_id in user_ids:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 اطلاعیه:\n\n{message}"
-                )
-                success_count += 1
-                # Delay کوتاه برای rate limiting
-                await asyncio.sleep(0.1)  # 10 پیام در ثانیه
-                
-            except Exception as e:
-                fail_count += 1
-                logger.warning(f"Failed to send message to {user_id}: {e}")
-        
-        # گزارش نهایی
+        # ارسال در پس‌زمینه انجام می‌شود و پیشرفت در همین چت گزارش می‌شود
+        job_id = await broadcast_engine.start_job(
+            context.bot, message, update.effective_chat.id
+        )
         await update.message.reply_text(
-            f"✅ ارسال پیام کامل شد!\n"
-            f"موفق: {success_count:,}\n"
-            f"ناموفق: {fail_count:,}"
+            f"✅ ارسال همگانی #{job_id} شروع شد.\n"
+            f"برای لغو: /broadcastcancel {job_id}"
         )
         
     except Exception as e:
@@ -169,6 +149,31 @@ async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in admin_broadcast: {e}")
 
 
+async def admin_broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """لغو ارسال همگانی در حال اجرا"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    try:
+        if not context.args:
+            running = broadcast_engine.running_jobs()
+            await update.message.reply_text(
+                "فرمت صحیح: /broadcastcancel job_id\n"
+                f"jobهای در حال اجرا: {', '.join(map(str, running)) or 'ندارد'}"
+            )
+            return
+        
+        job_id = int(context.args[0])
+        if await broadcast_engine.cancel_job(job_id):
+            await update.message.reply_text(f"⏹️ ارسال همگانی #{job_id} لغو شد.")
+        else:
+            await update.message.reply_text(f"job #{job_id} در حال اجرا نیست.")
+    
+    except Exception as e:
+        await update.message.reply_text(f"❌ خطا در لغو ارسال: {str(e)}")
+        logger.error(f"Error in admin_broadcast_cancel: {e}")
+
+
 async def admin_activate_tnt(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """فعال‌سازی اشتراک TNT توسط ادمین"""
     from database.repository import TntRepository
@@ -183,19 +188,18 @@ async def admin_activate_tnt(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
             
         user_id, plan_name, duration = int(args[0]), args[1].upper(), int(args[2])
-        with db_manager.get_session() as session:   
-            tnt_repo = TntRepository(session)
-            result = tnt_repo.activate_tnt_subscription(user_id, plan_name, duration)
-            
-            # اگر موفق بود، is_active رو هم آپدیت کن
-            if result.get("success"):
-                user = session.query(User).filter_by(user_id=user_id).first()
-                if user:
-                    user.is_active = True
-                    session.commit()
-                    # محاسبه کمیسیون رفرال
-                    admin_repo = AdminRepository(session)
-                    admin_repo.calculate_referral_commission(user_id, plan_name, duration)
+        with db_manager.get_session() as session:
+            # فعال‌سازی، is_active و کمیسیون رفرال در یک تراکنش
+            bulk = TntRepository(session).bulk_activate_subscriptions([(user_id, plan_name, duration)])
+
+        if not bulk.get("success"):
+            result = bulk
+        elif bulk["invalid_plan"]:
+            result = {"success": False, "error": "پلن یافت نشد"}
+        elif bulk["not_found"]:
+            result = {"success": False, "error": "کاربر یافت نشد"}
+        else:
+            result = {"success": True, "end_date": bulk["activated"][0]["end_date"]}
 
         if result.get("success"):
             await update.message.reply_text(f"✅ اشتراک TNT کاربر {user_id} با پلن {plan_name} فعال شد.")
@@ -225,6 +229,83 @@ async def admin_activate_tnt(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(f"خطا: {e}")
 
 
+def _parse_activation_file(content: str, plan_name: str, duration: int) -> tuple:
+    """
+    هر خط: user_id یا user_id,plan_name,duration (جداکننده کاما، فاصله یا تب)
+    خطوط خالی و خطوطی که با # شروع می‌شوند نادیده گرفته می‌شوند.
+    """
+    entries, invalid_lines = [], []
+    for line_number, line in enumerate(content.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.replace(",", " ").replace(";", " ").split()
+        try:
+            if len(parts) == 1:
+                entries.append((int(parts[0]), plan_name, duration))
+            elif len(parts) == 3:
+                entries.append((int(parts[0]), parts[1].upper(), int(parts[2])))
+            else:
+                raise ValueError(line)
+        except ValueError:
+            invalid_lines.append(line_number)
+    return entries, invalid_lines
+
+
+async def admin_bulk_activate_tnt(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """فعال‌سازی گروهی اشتراک TNT از روی فایل شناسه‌ها (در پاسخ به فایل ارسال شود)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+
+    try:
+        args = context.args
+        replied = update.message.reply_to_message
+        document = replied.document if replied else None
+        if len(args) < 2 or document is None:
+            await update.message.reply_text(
+                "فرمت صحیح: در پاسخ به یک فایل متنی از شناسه‌ها\n"
+                "/bulkactivatetnt plan_name duration\n\n"
+                "هر خط فایل: user_id یا user_id,plan_name,duration"
+            )
+            return
+
+        plan_name, duration = args[0].upper(), int(args[1])
+        file = await document.get_file()
+        content = (await file.download_as_bytearray()).decode("utf-8-sig")
+        entries, invalid_lines = _parse_activation_file(content, plan_name, duration)
+        if not entries:
+            await update.message.reply_text("❌ هیچ شناسه معتبری در فایل پیدا نشد.")
+            return
+
+        await update.message.reply_text(f"⏳ فعال‌سازی {len(entries):,} اشتراک...")
+
+        def activate():
+            with db_manager.get_session() as session:
+                return TntRepository(session).bulk_activate_subscriptions(entries)
+
+        result = await asyncio.to_thread(activate)
+        if not result.get("success"):
+            await update.message.reply_text(f"❌ خطا در فعال‌سازی گروهی (هیچ تغییری اعمال نشد): {result.get('error')}")
+            return
+
+        message = "✅ **فعال‌سازی گروهی انجام شد**\n\n"
+        message += f"• فعال شده: {len(result['activated']):,}\n"
+        message += f"• کاربر یافت نشد: {len(result['not_found']):,}\n"
+        message += f"• پلن نامعتبر: {len(result['invalid_plan']):,}\n"
+        message += f"• کمیسیون‌های ثبت شده: {result['commissions']:,} (${result['commission_total']:.2f})\n"
+        if invalid_lines:
+            message += f"• خطوط نامعتبر فایل: {', '.join(map(str, invalid_lines[:20]))}"
+            message += " ...\n" if len(invalid_lines) > 20 else "\n"
+        if result["not_found"]:
+            message += f"\nشناسه‌های یافت نشده: {', '.join(map(str, result['not_found'][:20]))}"
+
+        await update.message.reply_text(message)
+
+    except Exception as e:
+        logger.error(f"Error in admin_bulk_activate_tnt: {e}", exc_info=True)
+        await update.message.reply_text(f"خطا: {e}")
+
+
 async def admin_tnt_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """نمایش آمار TNT برای ادمین - SQLAlchemy ORM Version"""
     if update.effective_user.id != ADMIN_ID:
@@ -233,10 +314,8 @@ async def admin_tnt_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await update.message.reply_text("🔄 در حال دریافت آمار TNT...")
         
-        # دریافت آمار TNT از repository
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            stats = repo.get_tnt_subscription_stats()
+        # دریافت آمار TNT
+        stats = stats_service.tnt_statistics()
         
         # ساخت پیام آمار
         stats_message = f"""📊 **آمار TNT سیستم**
@@ -291,45 +370,17 @@ async def admin_clean_database(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
 
-        await update.message.reply_text("🧹 شروع پاک‌سازی دیتابیس...")
+        if maintenance_service.is_running():
+            await update.message.reply_text("⏳ یک پاک‌سازی دیگر در حال اجراست.")
+            return
+
+        status_message = await update.message.reply_text("🧹 شروع پاک‌سازی دیتابیس...")
+
+        # پاک‌سازی دسته‌ای در پس‌زمینه اجرا می‌شود و پیشرفت در همین پیام گزارش می‌شود
+        maintenance_service.start_cleanup(
+            context.bot, update.effective_chat.id, status_message.message_id
+        )
 
-        # انجام cleanup با repository
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            
-            # دریافت آمار قبل از پاک‌سازی
-            stats_before = repo.get_user_statistics()
-            users_before = stats_before['total_users']
-            
-            # انجام cleanup
-            cleanup_results = repo.cleanup_database()
-            
-            # Reset sequences
-            sequences_reset = repo.reset_sequences()
-
-        # ساخت گزارش نتایج
-        result_message = f"🧹 **پاک‌سازی دیتابیس کامل شد**\n\n"
-        result_message += f"📊 **آمار کلی:**\n"
-        result_message += f"• کاربران قبل: {users_before:,}\n"
-        result_message += f"• Sequences Reset: {'✅' if sequences_reset else '❌'}\n\n"
-        result_message += f"📋 **جزئیات جداول:**\n"
-        
-        for table_name, results in cleanup_results.items():
-            result_message += f"• **{table_name}:** {results['deleted']:,} حذف شده\n"
-        
-        result_message += f"\n✨ **دیتابیس آماده تست‌های جدید است!**"
-        
-        await update.message.reply_text(result_message)
-        
-        # اطلاع‌رسانی عمومی
-        try:
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="🔄 دیتابیس بازنشانی شد. همه کاربران حالا می‌توانند با حساب تمیز شروع کنند."
-            )
-        except:
-            pass
-            
     except Exception as e:
         await update.message.reply_text(f"❌ خطا در پاک‌سازی دیتابیس: {str(e)}")
         logger.error(f"Error in admin_clean_database: {e}")
@@ -341,28 +392,11 @@ async def admin_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            
-            # دریافت آمار کلی
-            user_stats = repo.get_user_statistics()
-            
-            # شمارش جداول مختلف
-            tables_stats = {}
-            
-            # User related tables
-            tables_stats["users"] = session.query(User).count()
-            tables_stats["transactions"] = session.query(Transaction).count()
-            tables_stats["api_requests"] = session.query(ApiRequest).count()
-            
-            # TNT system tables
-            tables_stats["tnt_usage_tracking"] = session.query(TntUsageTracking).count()
-            tables_stats["tnt_plans"] = session.query(TntPlan).count()
-            
-            # Referral system tables
-            tables_stats["referrals"] = session.query(Referral).count()
-            tables_stats["commissions"] = session.query(Commission).count()
-            tables_stats["referral_settings"] = session.query(ReferralSetting).count()
+        force_refresh = bool(context.args) and context.args[0] == "refresh"
+        
+        # دریافت آمار کلی و شمارش جداول (هر کدام در یک کوئری)
+        user_stats = stats_service.user_statistics(force_refresh=force_refresh)
+        tables_stats = stats_service.table_counts(force_refresh=force_refresh)
         
         # ساخت پیام آمار
         stats_message = "📊 **آمار کامل دیتابیس**\n\n"
@@ -375,14 +409,25 @@ async def admin_db_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # آمار جداول
         stats_message += f"🗄️ **آمار جداول:**\n"
-        for table, count in tables_stats.items():
-            stats_message += f"• **{table}:** {count:,} رکورد\n"
+        for table, info in tables_stats.items():
+            approx = "~" if info['estimated'] else ""
+            stats_message += f"• **{table}:** {approx}{info['count']:,} رکورد\n"
         
         # اطلاعات سیستم
         stats_message += f"\n🔧 **اطلاعات سیستم:**\n"
-        stats_message += f"• نوع دیتابیس: {db_manager.health_check().get('database_type', 'unknown')}\n"
+        stats_message += f"• نوع دیتابیس: {db_manager.engine.dialect.name}\n"
         stats_message += f"• آخرین بروزرسانی: {user_stats['timestamp'][:19].replace('T', ' ')}\n"
         
+        # پرهزینه‌ترین متدهای repository از زمان راه‌اندازی
+        query_summary = db_manager.query_stats.summary(top=5)
+        stats_message += f"\n⏱️ **کوئری‌ها:** {query_summary['queries']:,} "
+        stats_message += f"(میانگین {query_summary['avg_ms']} ms، کند: {query_summary['slow_queries']:,})\n"
+        for item in query_summary['top_callers']:
+            stats_message += (
+                f"• {item['caller']}: {item['count']:,}× "
+                f"p95 {item['p95_ms']} ms، max {item['max_ms']} ms\n"
+            )
+        
         await update.message.reply_text(stats_message)
         
     except Exception as e:
@@ -395,9 +440,146 @@ async def admin_reset_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("این دستور با `cleandb` جایگزین شده است.")
 
 
+async def admin_retention(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """اجرای دستی retention یا پارتیشن‌بندی جداول مصرف"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+
+    try:
+        args = context.args
+        if args and args[0] == "partition":
+            if len(args) < 2:
+                await update.message.reply_text(
+                    "فرمت صحیح: /retention partition tnt_usage_tracking|api_requests"
+                )
+                return
+            converted = await maintenance_service.partition_table(args[1])
+            if converted:
+                await update.message.reply_text(f"✅ جدول {args[1]} به پارتیشن‌های ماهانه تبدیل شد.")
+            else:
+                await update.message.reply_text(f"ℹ️ جدول {args[1]} از قبل پارتیشن‌بندی شده است.")
+            return
+
+        await update.message.reply_text("🧹 اجرای retention...")
+        report = await maintenance_service.run_retention()
+
+        usage = report["tnt_usage_tracking"]
+        api = report["api_requests"]
+        message = "✅ **Retention کامل شد**\n\n"
+        message += f"• روزهای فشرده شده: {usage['days']:,}\n"
+        if usage["partitions_dropped"]:
+            message += f"• پارتیشن‌های فشرده و حذف شده: {', '.join(usage['partitions_dropped'])}\n"
+        message += f"• خلاصه‌های روزانه منقضی: {report['tnt_usage_daily']['deleted']:,}\n"
+        if "archived" in api:
+            message += f"• درخواست‌های API آرشیو شده: {api['archived']:,}\n"
+            message += f"• آرشیو منقضی حذف شده: {report['api_requests_archive']['deleted']:,}\n"
+        else:
+            message += f"• درخواست‌های API حذف شده: {api['deleted']:,}\n"
+            if api["partitions_dropped"]:
+                message += f"• پارتیشن‌های حذف شده: {', '.join(api['partitions_dropped'])}\n"
+        for table_name, created in report.get("partitions_created", {}).items():
+            message += f"• پارتیشن جدید {table_name}: {created}\n"
+
+        await update.message.reply_text(message)
+
+    except Exception as e:
+        await update.message.reply_text(f"❌ خطا در اجرای retention: {str(e)}")
+        logger.error(f"Error in admin_retention: {e}")
+
+
+async def admin_reload_plans(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """بارگذاری مجدد پلن‌ها و تنظیمات رفرال بعد از تغییر در دیتابیس (در همه پروسه‌ها)"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+
+    try:
+        snapshot = await asyncio.to_thread(plan_catalog.reload_and_publish)
+
+        message = "✅ **کاتالوگ پلن‌ها بارگذاری شد**\n\n"
+        for plan in snapshot.plans.values():
+            if not plan.is_active or plan.price_usd <= 0:
+                continue
+            rate, _ = plan_catalog.commission_terms(plan.plan_name)
+            message += (
+                f"• {plan.display_name}: ${plan.price_usd} | "
+                f"{plan.monthly_limit}/ماه، {plan.hourly_limit}/ساعت | کمیسیون {rate}%\n"
+            )
+        message += f"\n⚙️ تنظیمات رفرال: {len(snapshot.settings)}"
+        await update.message.reply_text(message)
+
+    except Exception as e:
+        await update.message.reply_text(f"❌ خطا در بارگذاری پلن‌ها: {str(e)}")
+        logger.error(f"Error in admin_reload_plans: {e}")
+
+
 async def admin_health_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """بررسی سلامت سیستم"""
-    await update.message.reply_text("✅ سیستم سالم است.")
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("✅ سیستم سالم است.")
+        return
+
+    health = await asyncio.to_thread(db_manager.health_check)
+    if health["status"] != "healthy":
+        await update.message.reply_text(f"❌ دیتابیس در دسترس نیست: {health.get('error')}")
+        return
+
+    message = "✅ سیستم سالم است.\n\n"
+    message += f"🗄️ دیتابیس: {health['database_type']}\n"
+    message += f"👥 کاربران: {health['user_count']:,}\n"
+
+    query_summary = health["query_stats"]
+    message += f"\n⏱️ کوئری‌ها: {query_summary['queries']:,} (میانگین {query_summary['avg_ms']} ms)\n"
+    message += f"🐢 کوئری‌های کند (≥{query_summary['slow_threshold_ms']:.0f} ms): {query_summary['slow_queries']:,}\n"
+    for slow in db_manager.query_stats.slow_queries(limit=3):
+        message += f"• {slow['caller']}: {slow['elapsed_ms']} ms\n"
+
+    replica = health["replica"]
+    if replica["configured"]:
+        if replica.get("status") == "healthy":
+            message += f"📖 Read replica: سالم (تاخیر {replica['lag_seconds']:.1f} ثانیه)\n"
+        else:
+            message += f"📖 Read replica: ❌ {replica.get('error')}\n"
+
+    pool_status = health["pool"]
+    message += f"\n🔌 Connection pool ({pool_status['pool_class']}"
+    message += f", profile: {pool_status['profile']})\n" if pool_status.get("profile") else ")\n"
+    if "size" in pool_status:
+        message += (
+            f"• در حال استفاده: {pool_status['checked_out']} از {pool_status['size']} "
+            f"(+{pool_status['overflow']}/{pool_status['max_overflow']} overflow)\n"
+            f"• بیشترین استفاده: {pool_status['peak_checked_out']} "
+            f"(overflow: {pool_status['peak_overflow']})\n"
+        )
+    wait = pool_status["acquire_wait"]
+    message += f"• انتظار برای اتصال: p95 {wait['p95_ms']} ms، max {wait['max_ms']} ms\n"
+    message += f"• timeout: {pool_status['timeouts']}، اتصال‌های جدید: {pool_status['connects']}\n"
+    if "recommendation" in pool_status:
+        recommendation = pool_status["recommendation"]
+        message += f"• pool_size پیشنهادی: {recommendation['pool_size']} ({recommendation['reason']})\n"
+
+    scheduler = ai_scheduler.stats()
+    client_stats = completion_client.stats()
+    prompt_cache = client_stats["prompt_cache"]
+    cache = analysis_cache.stats()
+    executors = executor_service.stats()
+    message += f"\n🤖 هوش مصنوعی ({' → '.join(client_stats['models'])})\n"
+    message += (
+        f"• صف: {scheduler['running']} در حال اجرا، {scheduler['queued']} در انتظار "
+        f"(بیشترین انتظار {scheduler['max_wait']:.1f} ثانیه)\n"
+        f"• توکن دقیقه اخیر: {scheduler['tokens_last_minute']:,} از {scheduler['tokens_per_minute']:,}\n"
+        f"• درخواست‌ها: {client_stats['requests']:,}، retry: {client_stats['retries']}، "
+        f"مدل جایگزین: {client_stats['fallbacks']}، ناموفق: {client_stats['failures']}\n"
+        f"• prompt cache: {prompt_cache['cached_tokens']:,} از {prompt_cache['prompt_tokens']:,} توکن "
+        f"({prompt_cache['cached_ratio']:.0%})، صرفه‌جویی ${prompt_cache['saved_usd']:.2f}\n"
+        f"• کش تحلیل: {cache['exact_hits'] + cache['near_hits']} پاسخ از کش ({cache['hit_ratio']:.0%})\n"
+    )
+    for name, pool in (("I/O", executors["io"]), ("CPU", executors["cpu"])):
+        message += (
+            f"• executor {name}: {pool['in_flight']} در حال اجرا، صف {pool['queue_depth']} "
+            f"(بیشترین {pool['peak_queue_depth']})، میانگین {pool['avg_ms']:.0f}ms، خطا: {pool['errors']}\n"
+        )
+
+    await update.message.reply_text(message)
 
 
 async def admin_referral_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -408,10 +590,8 @@ async def admin_referral_stats(update: Update, context: ContextTypes.DEFAULT_TYP
     try:
         await update.message.reply_text("🔄 در حال دریافت آمار رفرال...")
         
-        # دریافت آمار کامل از repository
-        with db_manager.get_session() as session:
-            repo = AdminRepository(session)
-            stats = repo.get_referral_overview()
+        # دریافت آمار کامل
+        stats = stats_service.referral_overview()
         
         if not stats.get('success'):
             await update.message.reply_text(f"❌ خطا: {stats.get('error')}")
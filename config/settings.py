@@ -42,3 +42,90 @@ BASE_URLS = {
     "CRYPTOCOMPARE": "https://min-api.cryptocompare.com/data",
     "HOLDERSCAN": "https://api.holderscan.com/v0/sol",  # جدید
 }
+
+# کش پروفایل کاربران (ثانیه)
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "3600"))
+USER_CACHE_LOCAL_TTL = int(os.getenv("USER_CACHE_LOCAL_TTL", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+
+# ثبت کاربران جدید به صورت دسته‌ای (write-behind)
+USER_REGISTRY_MAX_KNOWN = int(os.getenv("USER_REGISTRY_MAX_KNOWN", "200000"))
+USER_REGISTRY_BATCH_SIZE = int(os.getenv("USER_REGISTRY_BATCH_SIZE", "500"))
+USER_REGISTRY_FLUSH_INTERVAL = float(os.getenv("USER_REGISTRY_FLUSH_INTERVAL", "2.0"))
+
+# موتور ارسال پیام همگانی (محدودیت سراسری تلگرام حدود ۳۰ پیام در ثانیه است)
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "15"))
+
+# آمار داشبوردهای ادمین
+STATS_CACHE_TTL = int(os.getenv("STATS_CACHE_TTL", "60"))
+STATS_USE_ESTIMATES = os.getenv("STATS_USE_ESTIMATES", "true").lower() == "true"
+STATS_ESTIMATE_THRESHOLD = int(os.getenv("STATS_ESTIMATE_THRESHOLD", "100000"))
+
+# پاک‌سازی دیتابیس به صورت دسته‌ای
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "5000"))
+
+# نگهداری و پارتیشن‌بندی داده‌های مصرف (روز)
+USAGE_COMPACT_AFTER_DAYS = int(os.getenv("USAGE_COMPACT_AFTER_DAYS", "3"))
+USAGE_DAILY_RETENTION_DAYS = int(os.getenv("USAGE_DAILY_RETENTION_DAYS", "400"))
+API_REQUESTS_HOT_DAYS = int(os.getenv("API_REQUESTS_HOT_DAYS", "30"))
+API_REQUESTS_RETENTION_DAYS = int(os.getenv("API_REQUESTS_RETENTION_DAYS", "180"))
+RETENTION_PARTITION_MONTHS_AHEAD = int(os.getenv("RETENTION_PARTITION_MONTHS_AHEAD", "2"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "6"))
+
+# پیش‌پردازش تصاویر قبل از ارسال به مدل بینایی
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_DETAIL_CLASSIC = os.getenv("VISION_DETAIL_CLASSIC", "high")
+VISION_DETAIL_MODERN = os.getenv("VISION_DETAIL_MODERN", "high")
+VISION_DETAIL_COACH = os.getenv("VISION_DETAIL_COACH", "low")
+VISION_MAX_TILES_CLASSIC = int(os.getenv("VISION_MAX_TILES_CLASSIC", "4"))
+VISION_MAX_TILES_MODERN = int(os.getenv("VISION_MAX_TILES_MODERN", "6"))
+
+# نمایش تدریجی پاسخ‌های هوش مصنوعی (فاصله ویرایش پیام بر حسب ثانیه)
+STREAM_AI_RESPONSES = os.getenv("STREAM_AI_RESPONSES", "true").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# صف درخواست‌های OpenAI (بودجه توکن را با محدودیت TPM حساب OpenAI تنظیم کنید)
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_TOKENS_PER_MINUTE = int(os.getenv("AI_TOKENS_PER_MINUTE", "150000"))
+AI_QUEUE_MAX_SIZE = int(os.getenv("AI_QUEUE_MAX_SIZE", "200"))
+AI_PER_USER_CONCURRENCY = int(os.getenv("AI_PER_USER_CONCURRENCY", "1"))
+AI_QUEUE_NOTIFY_INTERVAL = float(os.getenv("AI_QUEUE_NOTIFY_INTERVAL", "3"))
+AI_RATE_LIMIT_RETRIES = int(os.getenv("AI_RATE_LIMIT_RETRIES", "1"))
+
+# پردازش همزمان آپدیت‌های کاربران مختلف (آپدیت‌های هر کاربر به ترتیب)
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
+
+# کلاینت OpenAI: مدل اصلی، زنجیره مدل‌های جایگزین، timeout و retry
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
+OPENAI_FALLBACK_MODELS = [model.strip() for model in os.getenv("OPENAI_FALLBACK_MODELS", "gpt-4o-mini").split(",") if model.strip()]
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "90"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "1.0"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+
+# کش پاسخ تحلیل نمودارهای تکراری (پیش‌فرض فقط تصاویر دقیقاً یکسان؛ MAX_DISTANCE بیشتر از ۰
+# تطبیق تقریبی dHash ۲۵۶ بیتی را فقط بین نمودارهای همان کاربر فعال می‌کند، حداکثر حدود ۶)
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+ANALYSIS_CACHE_MAX_DISTANCE = int(os.getenv("ANALYSIS_CACHE_MAX_DISTANCE", "0"))
+ANALYSIS_CACHE_DEFAULT_TTL = int(os.getenv("ANALYSIS_CACHE_DEFAULT_TTL", "900"))
+ANALYSIS_CACHE_VERSION = os.getenv("ANALYSIS_CACHE_VERSION", "1")
+
+# prompt caching سمت OpenAI و برآورد صرفه‌جویی (قیمت ورودی مدل اصلی به دلار برای هر میلیون توکن)
+OPENAI_PROMPT_CACHE_KEY = os.getenv("OPENAI_PROMPT_CACHE_KEY", "true").lower() == "true"
+OPENAI_INPUT_PRICE_PER_1M = float(os.getenv("OPENAI_INPUT_PRICE_PER_1M", "2.50"))
+OPENAI_CACHED_INPUT_PRICE_PER_1M = float(os.getenv("OPENAI_CACHED_INPUT_PRICE_PER_1M", "1.25"))
+
+# حافظه گفتگوی مربی ترید (بودجه توکن تاریخچه در هر درخواست؛ بدون مدل خلاصه‌ساز فقط قدیمی‌ها حذف می‌شوند)
+COACH_HISTORY_TTL = int(os.getenv("COACH_HISTORY_TTL", "21600"))
+COACH_HISTORY_MAX_TOKENS = int(os.getenv("COACH_HISTORY_MAX_TOKENS", "2000"))
+COACH_TURN_MAX_TOKENS = int(os.getenv("COACH_TURN_MAX_TOKENS", "500"))
+COACH_SUMMARY_MODEL = os.getenv("COACH_SUMMARY_MODEL", "gpt-4o-mini")
+COACH_SUMMARY_MAX_TOKENS = int(os.getenv("COACH_SUMMARY_MAX_TOKENS", "300"))
+
+# executor مشترک کارهای مسدودکننده (CPU_WORKERS=0 یعنی پردازش تصویر در thread pool به جای پروسه جدا)
+EXECUTOR_IO_WORKERS = int(os.getenv("EXECUTOR_IO_WORKERS", "8"))
+EXECUTOR_CPU_WORKERS = int(os.getenv("EXECUTOR_CPU_WORKERS", str(min(2, os.cpu_count() or 1))))
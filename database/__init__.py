@@ -2,8 +2,11 @@
 Database package initialization - SQLAlchemy ORM Version with New Repositories
 """
 from .connection import db_manager, init_db, get_connection, get_session
-from .models import Base, User, Transaction, ApiRequest, TntUsageTracking, TntPlan, Referral, Commission, ReferralSetting
-from .repository import AdminRepository, TntRepository
+from .models import (
+    Base, User, Transaction, ApiRequest, TntUsageTracking, TntPlan, Referral, Commission,
+    ReferralSetting, BroadcastJob, TntUsageDaily, ApiRequestArchive
+)
+from .repository import AdminRepository, TntRepository, UserRepository, BroadcastRepository
 
 __all__ = [
     # Core components
@@ -11,8 +14,9 @@ __all__ = [
     
     # Models
     'Base', 'User', 'Transaction', 'ApiRequest', 'TntUsageTracking', 
-    'TntPlan', 'Referral', 'Commission', 'ReferralSetting',
+    'TntPlan', 'Referral', 'Commission', 'ReferralSetting', 'BroadcastJob',
+    'TntUsageDaily', 'ApiRequestArchive',
     
     # New Repositories
-    'AdminRepository', 'TntRepository'
+    'AdminRepository', 'TntRepository', 'UserRepository', 'BroadcastRepository'
 ]
@@ -4,20 +4,73 @@ Database Connection Management with SQLAlchemy
 import os
 import logging
 from typing import Optional
-from sqlalchemy import create_engine, pool
-from sqlalchemy import text
+from sqlalchemy import create_engine, event, pool
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
 from contextlib import contextmanager
 from .models import Base, DEFAULT_TNT_PLANS, DEFAULT_REFERRAL_SETTINGS, TntPlan, ReferralSetting
+from .instrumentation import InstrumentedQueuePool, PoolTelemetry, QueryStats
 
 logger = logging.getLogger(__name__)
 
+# Connection pool profiles (DB_POOL_PROFILE); DB_POOL_SIZE / DB_MAX_OVERFLOW /
+# DB_POOL_TIMEOUT override individual values
+POOL_PROFILES = {
+    "small": {"pool_size": 5, "max_overflow": 5, "pool_timeout": 10},      # single worker / staging
+    "default": {"pool_size": 10, "max_overflow": 20, "pool_timeout": 30},
+    "large": {"pool_size": 20, "max_overflow": 30, "pool_timeout": 30},    # many concurrent updates
+}
+
+# Per-connection SQLite tuning for single-node deployments and load tests.
+# WAL lets readers run alongside the single writer; synchronous=NORMAL is
+# durable in WAL mode except for the last transactions on power loss.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")) * -1,  # negative = KiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Engine 'connect' hook: run the tuning pragmas on every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def get_pool_settings() -> dict:
+    """Pool settings from the selected profile plus environment overrides"""
+    profile_name = os.getenv("DB_POOL_PROFILE", "default")
+    if profile_name not in POOL_PROFILES:
+        logger.warning(f"Unknown DB_POOL_PROFILE '{profile_name}', using default")
+        profile_name = "default"
+    
+    settings = dict(POOL_PROFILES[profile_name])
+    for key, env_name in (("pool_size", "DB_POOL_SIZE"), ("max_overflow", "DB_MAX_OVERFLOW"),
+                          ("pool_timeout", "DB_POOL_TIMEOUT")):
+        if os.getenv(env_name):
+            settings[key] = int(os.getenv(env_name))
+    settings["profile"] = profile_name
+    return settings
+
 class DatabaseManager:
     def __init__(self):
         self.engine = None
         self.SessionLocal = None
+        self.query_stats = QueryStats(slow_query_ms=float(os.getenv("DB_SLOW_QUERY_MS", "200")))
+        self.pool_telemetry = PoolTelemetry()
+        self.pool_settings = {}
+        # Optional read replica for analytical (reporting) queries
+        self.read_engine = None
+        self.ReadSessionLocal = None
+        self.replica_telemetry = PoolTelemetry()
         self._initialize_engine()
+        self._initialize_read_engine()
     
     def _initialize_engine(self):
         """Initialize database engine based on environment"""
@@ -31,33 +84,63 @@ class DatabaseManager:
             if database_url.startswith("postgres://"):
                 database_url = database_url.replace("postgres://", "postgresql://", 1)
             
+            self.pool_settings = get_pool_settings()
             self.engine = create_engine(
                 database_url,
-                poolclass=pool.QueuePool,
-                pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
-                max_overflow=20,
+                poolclass=InstrumentedQueuePool,
+                pool_size=self.pool_settings["pool_size"],
+                max_overflow=self.pool_settings["max_overflow"],
+                pool_timeout=self.pool_settings["pool_timeout"],
                 pool_pre_ping=True,
                 pool_recycle=3600,  # 1 hour
                 echo=os.getenv("DB_ECHO", "false").lower() == "true"
             )
-            logger.info("✅ PostgreSQL engine initialized")
+            self.engine.pool.telemetry = self.pool_telemetry
+            logger.info(f"✅ PostgreSQL engine initialized (pool profile: {self.pool_settings})")
             
         else:
-            # Development: SQLite
+            # Development / single node: SQLite
             logger.info("🗄️ Initializing SQLite connection...")
             sqlite_path = os.getenv("SQLITE_PATH", "bot_database.db")
+            connect_args = {
+                "check_same_thread": False,
+                "timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000
+            }
             
-            self.engine = create_engine(
-                f"sqlite:///{sqlite_path}",
-                poolclass=pool.StaticPool,
-                connect_args={
-                    "check_same_thread": False,
-                    "timeout": 30
-                },
-                echo=os.getenv("DB_ECHO", "false").lower() == "true"
-            )
+            if sqlite_path in ("", ":memory:"):
+                # An in-memory database only exists on a single connection
+                self.engine = create_engine(
+                    "sqlite://",
+                    poolclass=pool.StaticPool,
+                    connect_args=connect_args,
+                    echo=os.getenv("DB_ECHO", "false").lower() == "true"
+                )
+            else:
+                # One connection per thread so WAL readers don't queue behind the writer
+                self.pool_settings = {
+                    "profile": "sqlite",
+                    "pool_size": int(os.getenv("SQLITE_POOL_SIZE", "5")),
+                    "max_overflow": int(os.getenv("SQLITE_MAX_OVERFLOW", "10")),
+                    "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+                }
+                self.engine = create_engine(
+                    f"sqlite:///{sqlite_path}",
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=self.pool_settings["pool_size"],
+                    max_overflow=self.pool_settings["max_overflow"],
+                    pool_timeout=self.pool_settings["pool_timeout"],
+                    connect_args=connect_args,
+                    echo=os.getenv("DB_ECHO", "false").lower() == "true"
+                )
+                self.engine.pool.telemetry = self.pool_telemetry
+                event.listen(self.engine, "connect", apply_sqlite_pragmas)
             logger.info("✅ SQLite engine initialized")
         
+        # Per-statement latency / caller statistics
+        if os.getenv("DB_QUERY_STATS", "true").lower() == "true":
+            self.query_stats.attach(self.engine)
+        self.pool_telemetry.attach(self.engine)
+        
         # Create session factory
         self.SessionLocal = sessionmaker(
             autocommit=False,
@@ -65,12 +148,67 @@ class DatabaseManager:
             bind=self.engine
         )
     
+    def _initialize_read_engine(self):
+        """
+        Read-only sessions go to DATABASE_REPLICA_URL when it is set and to
+        the primary otherwise. On PostgreSQL they are opened READ ONLY either way.
+        """
+        replica_url = os.getenv("DATABASE_REPLICA_URL")
+        is_postgres = self.engine.dialect.name == "postgresql"
+        
+        if replica_url and is_postgres:
+            if replica_url.startswith("postgres://"):
+                replica_url = replica_url.replace("postgres://", "postgresql://", 1)
+            
+            logger.info("🐘 Initializing PostgreSQL read replica...")
+            self.read_engine = create_engine(
+                replica_url,
+                poolclass=InstrumentedQueuePool,
+                pool_size=int(os.getenv("DB_REPLICA_POOL_SIZE", "5")),
+                max_overflow=int(os.getenv("DB_REPLICA_MAX_OVERFLOW", "5")),
+                pool_timeout=self.pool_settings["pool_timeout"],
+                pool_pre_ping=True,
+                pool_recycle=3600,
+                execution_options={"postgresql_readonly": True},
+                echo=os.getenv("DB_ECHO", "false").lower() == "true"
+            )
+            self.read_engine.pool.telemetry = self.replica_telemetry
+            self.replica_telemetry.attach(self.read_engine)
+            if os.getenv("DB_QUERY_STATS", "true").lower() == "true":
+                self.query_stats.attach(self.read_engine)
+            logger.info("✅ Read replica engine initialized")
+            read_bind = self.read_engine
+        elif replica_url:
+            logger.warning("⚠️ DATABASE_REPLICA_URL is only supported with PostgreSQL, ignoring it")
+            read_bind = self.engine
+        elif is_postgres:
+            read_bind = self.engine.execution_options(postgresql_readonly=True)
+        else:
+            read_bind = self.engine
+        
+        self.ReadSessionLocal = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=read_bind
+        )
+    
     def create_tables(self):
-        """Create all tables if they don't exist"""
+        """Create all tables if they don't exist (local/dev; production uses migrations)"""
         try:
-            logger.info("🔨 Creating database tables...")
-            Base.metadata.create_all(bind=self.engine)
-            logger.info("✅ Database tables created successfully")
+            from .migration import get_current_revision, run_migrations, stamp_head
+            unversioned = get_current_revision() is None
+            if unversioned and inspect(self.engine).has_table("users"):
+                # created by create_all before migrations existed: create_all would not
+                # add the new indexes/seed data, so stamp the baseline and upgrade instead
+                run_migrations()
+            else:
+                logger.info("🔨 Creating database tables...")
+                Base.metadata.create_all(bind=self.engine)
+                logger.info("✅ Database tables created successfully")
+                
+                # create_all on an empty database builds the latest schema, so mark it as fully migrated
+                if unversioned:
+                    stamp_head()
             
             # Initialize default data
             self._initialize_default_data()
@@ -112,7 +250,27 @@ class DatabaseManager:
     @contextmanager
     def get_session(self) -> Session:
         """Get database session with automatic cleanup"""
-        session = self.SessionLocal()
+        with self._session_scope(self.SessionLocal) as session:
+            yield session
+    
+    @contextmanager
+    def get_read_session(self) -> Session:
+        """Read-only session on the replica (or the primary when none is configured)"""
+        with self._session_scope(self.ReadSessionLocal) as session:
+            yield session
+    
+    def session_for(self, repository_class):
+        """
+        Session routed for a repository: classes marked `analytical = True`
+        only read and get a replica session, everything else the primary.
+        """
+        if getattr(repository_class, "analytical", False):
+            return self.get_read_session()
+        return self.get_session()
+    
+    @contextmanager
+    def _session_scope(self, session_factory) -> Session:
+        session = session_factory()
         try:
             yield session
         except SQLAlchemyError as e:
@@ -143,8 +301,11 @@ class DatabaseManager:
                     "status": "healthy",
                     "database_type": "postgresql" if "postgresql" in str(self.engine.url) else "sqlite",
                     "connection_pool_size": self.engine.pool.size() if hasattr(self.engine.pool, 'size') else "N/A",
+                    "pool": self.pool_status(),
                     "user_count": user_count,
                     "transaction_count": transaction_count,
+                    "query_stats": self.query_stats.summary(),
+                    "replica": self.replica_status(),
                     "url": str(self.engine.url).split('@')[0] + "@****"  # Hide credentials
                 }
                 
@@ -155,11 +316,65 @@ class DatabaseManager:
                 "database_type": "postgresql" if "postgresql" in str(self.engine.url) else "sqlite"
             }
     
+    def pool_status(self) -> dict:
+        """Connection pool state and telemetry"""
+        status = self.pool_telemetry.status(self.engine.pool)
+        if self.pool_settings:
+            status["profile"] = self.pool_settings["profile"]
+        return status
+    
+    def replica_status(self) -> dict:
+        """Read replica connectivity and pool telemetry"""
+        if self.read_engine is None:
+            return {"configured": False}
+        
+        status = {"configured": True, "pool": self.replica_telemetry.status(self.read_engine.pool)}
+        try:
+            with self.get_read_session() as session:
+                session.execute(text("SELECT 1"))
+                status["status"] = "healthy"
+                # replication lag as seen by the replica
+                status["lag_seconds"] = session.execute(text(
+                    "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                )).scalar()
+        except SQLAlchemyError as e:
+            status.update({"status": "unhealthy", "error": str(e)})
+        return status
+    
+    def warm_up_pool(self, connections: Optional[int] = None) -> int:
+        """
+        Open pool connections ahead of the first requests.
+        Connections are held together so each one is a separate DB connection.
+        """
+        if not isinstance(self.engine.pool, pool.QueuePool):
+            return 0
+        
+        count = connections if connections is not None else int(
+            os.getenv("DB_POOL_WARMUP", str(self.engine.pool.size()))
+        )
+        count = min(count, self.engine.pool.size())
+        opened = []
+        try:
+            for _ in range(count):
+                connection = self.engine.connect()
+                connection.execute(text("SELECT 1"))
+                opened.append(connection)
+        except SQLAlchemyError as e:
+            logger.warning(f"⚠️ Pool warm-up stopped after {len(opened)} connections: {e}")
+        finally:
+            for connection in opened:
+                connection.close()
+        
+        logger.info(f"🔥 Connection pool warmed with {len(opened)} connections")
+        return len(opened)
+    
     def close(self):
         """Close database connections"""
         if self.engine:
             logger.info("🔒 Closing database connections...")
             self.engine.dispose()
+            if self.read_engine:
+                self.read_engine.dispose()
             logger.info("✅ Database connections closed")
 
 # Global database manager instance
@@ -0,0 +1,311 @@
+"""
+Query-level and connection-pool instrumentation for the SQLAlchemy engine
+
+Engine events time every statement and attribute it to the repository
+method that issued it. Aggregates are kept per caller as a fixed-bucket
+latency histogram; statements slower than the threshold are logged with
+their parameters redacted.
+
+InstrumentedQueuePool measures how long sessions wait for a connection
+and how close the pool runs to its limits.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List
+
+from sqlalchemy import event, exc, pool
+
+logger = logging.getLogger(__name__)
+
+# upper bounds of the latency buckets in milliseconds (last bucket is open)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# frames from these modules are never reported as the caller
+_SKIPPED_MODULES = ("sqlalchemy", "alembic", "contextlib", "database.instrumentation", "database.connection")
+
+
+def find_caller(max_depth: int = 60) -> str:
+    """Name of the first application frame (e.g. TntRepository.check_analysis_limit)"""
+    frame = sys._getframe(2)
+    fallback = None
+    depth = 0
+    while frame is not None and depth < max_depth:
+        module = frame.f_globals.get("__name__", "")
+        if not module.startswith(_SKIPPED_MODULES):
+            name = getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+            if module.startswith("database."):
+                return name
+            if fallback is None:
+                fallback = f"{module}.{name}"
+        frame = frame.f_back
+        depth += 1
+    return fallback or "unknown"
+
+
+def redact_parameters(parameters: Any) -> Any:
+    """Replace parameter values with their type names"""
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            # executemany
+            return f"<{len(parameters)} parameter sets>"
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return "<redacted>"
+
+
+class CallerStats:
+    __slots__ = ("count", "total_ms", "max_ms", "rows", "slow", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms: float, rows: int, slow: bool):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        self.slow += slow
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given percentile"""
+        target = self.count * fraction
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= target and bucket:
+                if i < len(LATENCY_BUCKETS_MS):
+                    return min(LATENCY_BUCKETS_MS[i], round(self.max_ms, 2))
+                return round(self.max_ms, 2)
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": round(self.max_ms, 2),
+            "total_ms": round(self.total_ms, 2),
+            "rows": self.rows,
+            "slow": self.slow,
+        }
+
+
+class QueryStats:
+    """Per-caller query statistics collected from engine events"""
+
+    def __init__(self, slow_query_ms: float = 200.0, slow_log_size: int = 50):
+        self.slow_query_ms = slow_query_ms
+        self._callers: Dict[str, CallerStats] = {}
+        self._slow_queries = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+
+    # === Engine hooks ===
+    def attach(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start_time")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        self.record(find_caller(), statement, parameters, elapsed_ms, rows)
+
+    def _handle_error(self, exception_context):
+        # keep the per-connection timer stack balanced when a statement fails
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_time"):
+            conn.info["query_start_time"].pop()
+
+    # === Aggregation ===
+    def record(self, caller: str, statement: str, parameters: Any, elapsed_ms: float, rows: int = 0):
+        slow = elapsed_ms >= self.slow_query_ms
+        with self._lock:
+            stats = self._callers.get(caller)
+            if stats is None:
+                stats = self._callers[caller] = CallerStats()
+            stats.add(elapsed_ms, rows, slow)
+            if slow:
+                self._slow_queries.append({
+                    "caller": caller,
+                    "elapsed_ms": round(elapsed_ms, 2),
+                    "statement": " ".join(statement.split())[:500],
+                    "parameters": redact_parameters(parameters),
+                    "at": time.time(),
+                })
+
+        if slow:
+            logger.warning(
+                f"🐢 Slow query ({elapsed_ms:.0f} ms) from {caller}: "
+                f"{' '.join(statement.split())[:300]} params={redact_parameters(parameters)}"
+            )
+
+    def top_callers(self, limit: int = 10, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [{"caller": caller, **stats.to_dict()} for caller, stats in self._callers.items()]
+        return sorted(items, key=lambda item: item[order_by], reverse=True)[:limit]
+
+    def slow_queries(self, limit: int = 10) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._slow_queries)[-limit:]
+
+    def summary(self, top: int = 5) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(stats.count for stats in self._callers.values())
+            total_ms = sum(stats.total_ms for stats in self._callers.values())
+            slow = sum(stats.slow for stats in self._callers.values())
+        return {
+            "queries": total,
+            "avg_ms": round(total_ms / total, 2) if total else 0.0,
+            "slow_queries": slow,
+            "slow_threshold_ms": self.slow_query_ms,
+            "since": self._started_at,
+            "top_callers": self.top_callers(top),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._callers.clear()
+            self._slow_queries.clear()
+            self._started_at = time.time()
+
+
+class PoolTelemetry:
+    """Wait times, timeouts and peak usage of a connection pool"""
+
+    def __init__(self):
+        self.waits = CallerStats()
+        self.timeouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.peak_checked_out = 0
+        self.peak_overflow = 0
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def attach(self, engine):
+        self._engine = engine
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        engine_pool = self._engine.pool
+        if not isinstance(engine_pool, pool.QueuePool):
+            return
+        with self._lock:
+            self.peak_checked_out = max(self.peak_checked_out, engine_pool.checkedout())
+            self.peak_overflow = max(self.peak_overflow, engine_pool.overflow())
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_wait(self, elapsed_ms: float):
+        with self._lock:
+            self.waits.add(elapsed_ms, 0, False)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def status(self, engine_pool) -> Dict[str, Any]:
+        """Current pool state plus telemetry and a sizing recommendation"""
+        with self._lock:
+            data = {
+                "pool_class": type(engine_pool).__name__,
+                "acquire_wait": self.waits.to_dict(),
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "peak_checked_out": self.peak_checked_out,
+                "peak_overflow": self.peak_overflow,
+            }
+
+        if isinstance(engine_pool, pool.QueuePool):
+            data.update({
+                "size": engine_pool.size(),
+                "max_overflow": engine_pool._max_overflow,
+                "timeout": engine_pool.timeout(),
+                "checked_out": engine_pool.checkedout(),
+                "checked_in": engine_pool.checkedin(),
+                "overflow": max(0, engine_pool.overflow()),
+            })
+            data["recommendation"] = self.recommend(engine_pool.size(), engine_pool._max_overflow)
+        return data
+
+    def recommend(self, pool_size: int, max_overflow: int) -> Dict[str, Any]:
+        """
+        Suggest a pool size from observed concurrency: enough persistent
+        connections for the peak plus 25% headroom, grow when sessions time
+        out or routinely wait.
+        """
+        with self._lock:
+            peak = self.peak_checked_out
+            timeouts = self.timeouts
+            p95_wait = self.waits.percentile(0.95) if self.waits.count else 0
+
+        if timeouts or (p95_wait >= 100 and peak >= pool_size + max_overflow):
+            suggested = pool_size + max(2, pool_size // 2)
+            reason = "sessions time out waiting for connections" if timeouts else "pool is saturated"
+        elif peak and peak * 1.25 < pool_size / 2:
+            suggested = max(2, int(peak * 1.25 + 0.5))
+            reason = "peak usage is well below pool size"
+        else:
+            suggested = pool_size
+            reason = "pool size matches observed concurrency"
+        return {"pool_size": suggested, "reason": reason}
+
+
+class InstrumentedQueuePool(pool.QueuePool):
+    """QueuePool that reports acquire wait times and timeouts to PoolTelemetry"""
+
+    telemetry: PoolTelemetry = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.telemetry:
+                self.telemetry.record_timeout()
+            logger.warning(
+                f"⏳ Connection pool exhausted: {self.checkedout()} checked out, "
+                f"size {self.size()}, overflow {self.overflow()}"
+            )
+            raise
+        if self.telemetry:
+            self.telemetry.record_wait((time.perf_counter() - started) * 1000)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; keep collecting into the same telemetry
+        new_pool = super().recreate()
+        new_pool.telemetry = self.telemetry
+        return new_pool
@@ -1,20 +1,295 @@
-from sqlalchemy import text
+"""
+Schema migrations with Alembic
+
+Migrations live in database/migrations and are applied outside the bot
+process (release phase / CLI):
+
+    python -m database.migration upgrade
+    python -m database.migration verify
+    python -m database.migration stamp [revision]
+
+At startup the bot only calls verify_schema(), which reads the current
+revision and table list but never runs DDL.
+
+Migration scripts use the helpers below for changes that must not block
+writes on large production tables.
+"""
+import logging
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+from alembic import command, op
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect, text
+
 from .connection import db_manager
+from .models import Base
 
-def run_migration():
-    """Legacy migration - SQLAlchemy handles table creation automatically"""
-    print("ℹ️ Database tables are created automatically by SQLAlchemy")
-    print("ℹ️ See database/connection.py -> create_tables()")
-    return True
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_REVISION = '0001'
+
+
+def get_alembic_config() -> Config:
+    config = Config(os.path.join(PROJECT_ROOT, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(PROJECT_ROOT, "database", "migrations"))
+    # keep the application's logging setup
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def get_current_revision() -> Optional[str]:
+    with db_manager.engine.connect() as connection:
+        return MigrationContext.configure(connection).get_current_revision()
+
+
+def get_head_revision() -> Optional[str]:
+    return ScriptDirectory.from_config(get_alembic_config()).get_current_head()
 
-def manual_schema_update():
-    """Manual schema updates if needed in future"""
+
+# === RUNNING MIGRATIONS ===
+def run_migrations(revision: str = "head") -> str:
+    """
+    Upgrade the database to the given revision.
+
+    Databases created with create_all before migrations existed have tables
+    but no alembic_version; they are stamped with the baseline first.
+    """
+    config = get_alembic_config()
+
+    if get_current_revision() is None and inspect(db_manager.engine).has_table("users"):
+        logger.info(f"📌 Existing schema without revision, stamping baseline {BASELINE_REVISION}")
+        command.stamp(config, BASELINE_REVISION)
+
+    command.upgrade(config, revision)
+    current = get_current_revision()
+    logger.info(f"✅ Database schema at revision {current}")
+    return current
+
+
+def stamp_head():
+    """Mark a database created by create_all as fully migrated"""
+    command.stamp(get_alembic_config(), "head")
+
+
+def verify_schema() -> Dict[str, Any]:
+    """
+    Compare the database with the migration scripts without changing it.
+    Returns current/head revisions and the model tables missing from the database.
+    """
     try:
-        with db_manager.get_session() as session:
-            # Add manual schema updates here if needed
-            print("🔧 No manual updates needed")
-            session.commit()
-            return True
+        current = get_current_revision()
+        head = get_head_revision()
+        existing = set(inspect(db_manager.engine).get_table_names())
+        missing = sorted(set(Base.metadata.tables) - existing)
+
+        return {
+            "ok": current == head and not missing,
+            "current": current,
+            "head": head,
+            "missing_tables": missing,
+        }
+
     except Exception as e:
-        print(f"❌ Manual update failed: {e}")
-        return False
+        logger.error(f"Error verifying schema: {e}")
+        return {"ok": False, "error": str(e)}
+
+
+def run_migration():
+    """Legacy entry point - kept for backward compatibility"""
+    return run_migrations()
+
+
+# === HELPERS FOR MIGRATION SCRIPTS ===
+def _is_postgresql() -> bool:
+    return op.get_context().dialect.name == 'postgresql'
+
+
+def _drop_invalid_index(index_name: str):
+    """A failed CREATE INDEX CONCURRENTLY leaves an INVALID index behind"""
+    if op.get_context().as_sql:
+        return
+    invalid = op.get_bind().execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": index_name}
+    ).scalar()
+    if invalid:
+        logger.warning(f"Dropping invalid index {index_name} left by an earlier attempt")
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+
+def _relkind(name: str) -> Optional[str]:
+    """pg_class.relkind of a table or index ('p' partitioned table, 'I' partitioned index)"""
+    if op.get_context().as_sql:
+        return None
+    return op.get_bind().execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": name}
+    ).scalar()
+
+
+def _index_sql(index_name: str, table_sql: str, columns: List[str], unique: bool,
+               concurrently: bool, include=None, where=None) -> str:
+    return (
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}"
+        f"IF NOT EXISTS {index_name} ON {table_sql} ({', '.join(columns)})"
+        + (f" INCLUDE ({', '.join(include)})" if include else "")
+        + (f" WHERE {where}" if where is not None else "")
+    )
+
+
+def _create_partitioned_index(index_name: str, table_name: str, columns: List[str], unique: bool, **kw):
+    """
+    CREATE INDEX CONCURRENTLY is not allowed on a partitioned table: create the
+    parent index ON ONLY the parent, build each partition's index concurrently
+    and attach it. The parent index becomes valid once every partition is attached.
+    """
+    include = kw.get('postgresql_include')
+    where = kw.get('postgresql_where')
+    bind = op.get_bind()
+
+    op.execute(_index_sql(index_name, f"ONLY {table_name}", columns, unique, False, include, where))
+    partitions = bind.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ),
+        {"name": table_name}
+    ).scalars().all()
+
+    for partition in partitions:
+        child_index = f"{partition}_{index_name}"[:63]
+        with op.get_context().autocommit_block():
+            _drop_invalid_index(child_index)
+            op.execute(_index_sql(child_index, partition, columns, unique, True, include, where))
+        attached = bind.execute(
+            text("SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:name)"), {"name": child_index}
+        ).scalar()
+        if not attached:
+            op.execute(f"ALTER INDEX {index_name} ATTACH PARTITION {child_index}")
+
+
+def create_index_concurrently(index_name: str, table_name: str, columns: List[str],
+                              unique: bool = False, **kw):
+    """
+    Create an index without blocking writes.
+
+    On PostgreSQL this runs CREATE INDEX CONCURRENTLY outside the migration
+    transaction (partition by partition for partitioned tables); elsewhere it
+    is a plain CREATE INDEX IF NOT EXISTS. Extra keyword arguments
+    (postgresql_where, postgresql_include, sqlite_where, ...) are passed
+    through to op.create_index.
+    """
+    if _is_postgresql():
+        if _relkind(table_name) == 'p':
+            _create_partitioned_index(index_name, table_name, columns, unique, **kw)
+            return
+        with op.get_context().autocommit_block():
+            _drop_invalid_index(index_name)
+            op.create_index(
+                index_name, table_name, columns, unique=unique,
+                postgresql_concurrently=True, if_not_exists=True, **kw
+            )
+    else:
+        kw = {k: v for k, v in kw.items() if not k.startswith('postgresql_')}
+        op.create_index(index_name, table_name, columns, unique=unique, if_not_exists=True, **kw)
+
+
+def drop_index_concurrently(index_name: str, table_name: str):
+    """Drop an index without blocking writes (PostgreSQL), IF EXISTS elsewhere"""
+    if _is_postgresql():
+        if _relkind(index_name) == 'I':
+            # indexes of partitioned tables cannot be dropped concurrently
+            op.drop_index(index_name, table_name=table_name, if_exists=True)
+            return
+        with op.get_context().autocommit_block():
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True, if_exists=True)
+    else:
+        op.drop_index(index_name, table_name=table_name, if_exists=True)
+
+
+def drop_unique_constraint_if_exists(constraint_name: str, table_name: str):
+    """
+    Drop a UNIQUE constraint (and its index). On PostgreSQL this only needs a
+    short lock; SQLite rebuilds the table through batch mode.
+    """
+    if _is_postgresql():
+        op.execute(f"ALTER TABLE {table_name} DROP CONSTRAINT IF EXISTS {constraint_name}")
+        return
+    if op.get_context().as_sql:
+        return
+    existing = {
+        constraint['name']
+        for constraint in inspect(op.get_bind()).get_unique_constraints(table_name)
+    }
+    if constraint_name in existing:
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_constraint(constraint_name, type_='unique')
+
+
+def batched_backfill(table_name: str, set_clause: str, where_clause: str = "TRUE",
+                     batch_size: int = 5000, pk: str = "id") -> int:
+    """
+    Run UPDATE <table> SET <set_clause> in primary-key ranges of batch_size,
+    committing every batch so row locks and WAL stay bounded.
+
+    where_clause should exclude rows that are already done (e.g. "col IS NULL")
+    so an interrupted backfill can simply be run again.
+    """
+    if op.get_context().as_sql:
+        op.execute(f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}")
+        return 0
+
+    updated = 0
+    last_pk = None
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        while True:
+            after_last = "TRUE" if last_pk is None else f"{pk} > :last_pk"
+            upper_pk = bind.execute(
+                text(
+                    f"SELECT {pk} FROM {table_name} WHERE {after_last} "
+                    f"ORDER BY {pk} LIMIT 1 OFFSET :offset"
+                ),
+                {"last_pk": last_pk, "offset": batch_size - 1}
+            ).scalar()
+
+            up_to_upper = "TRUE" if upper_pk is None else f"{pk} <= :upper_pk"
+            result = bind.execute(
+                text(
+                    f"UPDATE {table_name} SET {set_clause} "
+                    f"WHERE {after_last} AND {up_to_upper} AND ({where_clause})"
+                ),
+                {"last_pk": last_pk, "upper_pk": upper_pk}
+            )
+            updated += result.rowcount or 0
+            logger.info(f"Backfill {table_name}: {updated} rows updated")
+
+            if upper_pk is None:
+                break
+            last_pk = upper_pk
+
+    return updated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    action = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+
+    if action == "upgrade":
+        run_migrations(sys.argv[2] if len(sys.argv) > 2 else "head")
+    elif action == "verify":
+        status = verify_schema()
+        print(status)
+        sys.exit(0 if status.get("ok") else 1)
+    elif action == "stamp":
+        command.stamp(get_alembic_config(), sys.argv[2] if len(sys.argv) > 2 else "head")
+    else:
+        print("Usage: python -m database.migration [upgrade [revision] | verify | stamp [revision]]")
+        sys.exit(2)
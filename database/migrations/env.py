@@ -0,0 +1,56 @@
+"""
+Alembic environment for the Narmoon bot
+
+Migrations run on the bot's own engine. Every migration gets its own
+transaction so scripts can leave it with op.get_context().autocommit_block()
+for CREATE INDEX CONCURRENTLY and batched backfills.
+"""
+import logging
+from logging.config import fileConfig
+
+from alembic import context
+
+from database.connection import db_manager
+from database.models import Base
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+logger = logging.getLogger("alembic.env")
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of running it (alembic upgrade --sql)"""
+    context.configure(
+        url=str(db_manager.engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with db_manager.engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            compare_type=True,
+            transaction_per_migration=True,
+            # SQLite cannot ALTER most things in place
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
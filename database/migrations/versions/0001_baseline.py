@@ -0,0 +1,169 @@
+"""baseline schema
+
+The schema as it was created by Base.metadata.create_all before migrations
+were introduced. Existing databases are stamped with this revision instead
+of running it (see database/migration.py).
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('user_id', sa.BigInteger(), primary_key=True),
+        sa.Column('username', sa.String(255)),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('subscription_end', sa.Date()),
+        sa.Column('subscription_type', sa.String(100)),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('tnt_plan_type', sa.String(50)),
+        sa.Column('tnt_monthly_limit', sa.Integer()),
+        sa.Column('tnt_hourly_limit', sa.Integer()),
+        sa.Column('tnt_plan_start', sa.DateTime()),
+        sa.Column('tnt_plan_end', sa.DateTime()),
+        sa.Column('referral_code', sa.String(50), unique=True),
+        sa.Column('custom_commission_rate', sa.Numeric(5, 2)),
+        sa.Column('total_earned', sa.Numeric(10, 2)),
+        sa.Column('total_paid', sa.Numeric(10, 2)),
+    )
+    op.create_index('idx_users_subscription', 'users', ['subscription_end', 'is_active'])
+    op.create_index('idx_users_tnt_plan', 'users', ['tnt_plan_type', 'tnt_plan_end'])
+    op.create_index('idx_users_referral_code', 'users', ['referral_code'])
+
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('txid', sa.String(255)),
+        sa.Column('wallet_address', sa.String(255)),
+        sa.Column('amount', sa.Numeric(10, 2)),
+        sa.Column('subscription_type', sa.String(100)),
+        sa.Column('status', sa.String(50)),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('idx_transactions_user_id', 'transactions', ['user_id'])
+    op.create_index('idx_transactions_status', 'transactions', ['status'])
+    op.create_index('idx_transactions_created_at', 'transactions', ['created_at'])
+
+    op.create_table(
+        'api_requests',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('endpoint', sa.String(255)),
+        sa.Column('request_date', sa.Date()),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('idx_api_requests_date', 'api_requests', ['user_id', 'request_date'])
+
+    op.create_table(
+        'tnt_usage_tracking',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('usage_date', sa.Date(), nullable=False),
+        sa.Column('usage_hour', sa.Integer(), nullable=False),
+        sa.Column('analysis_count', sa.Integer()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.UniqueConstraint('user_id', 'usage_date', 'usage_hour', name='unique_user_hour_usage'),
+    )
+    op.create_index('idx_usage_tracking_user_date', 'tnt_usage_tracking', ['user_id', 'usage_date'])
+    op.create_index('idx_usage_tracking_user_hour', 'tnt_usage_tracking', ['user_id', 'usage_date', 'usage_hour'])
+
+    tnt_plans = op.create_table(
+        'tnt_plans',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('plan_name', sa.String(50), unique=True, nullable=False),
+        sa.Column('plan_display_name', sa.String(100), nullable=False),
+        sa.Column('price_usd', sa.Numeric(10, 2), nullable=False),
+        sa.Column('monthly_limit', sa.Integer(), nullable=False),
+        sa.Column('hourly_limit', sa.Integer(), nullable=False),
+        sa.Column('vip_access', sa.Boolean()),
+        sa.Column('is_active', sa.Boolean()),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+    op.create_index('idx_tnt_plans_active', 'tnt_plans', ['plan_name', 'is_active'])
+
+    op.create_table(
+        'referrals',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('referrer_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('referred_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('status', sa.String(50)),
+        sa.UniqueConstraint('referrer_id', 'referred_id', name='unique_referral_relationship'),
+    )
+    op.create_index('idx_referrals_referrer', 'referrals', ['referrer_id'])
+    op.create_index('idx_referrals_referred', 'referrals', ['referred_id'])
+
+    op.create_table(
+        'commissions',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('referrer_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('referred_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE')),
+        sa.Column('transaction_id', sa.Integer(), sa.ForeignKey('transactions.id', ondelete='SET NULL')),
+        sa.Column('plan_type', sa.String(100), nullable=False),
+        sa.Column('commission_amount', sa.Numeric(10, 2), nullable=False),
+        sa.Column('bonus_amount', sa.Numeric(10, 2)),
+        sa.Column('total_amount', sa.Numeric(10, 2), nullable=False),
+        sa.Column('status', sa.String(50)),
+        sa.Column('created_at', sa.DateTime()),
+        sa.Column('paid_at', sa.DateTime()),
+    )
+    op.create_index('idx_commissions_referrer', 'commissions', ['referrer_id', 'status'])
+    op.create_index('idx_commissions_status', 'commissions', ['status'])
+
+    referral_settings = op.create_table(
+        'referral_settings',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('setting_key', sa.String(100), unique=True, nullable=False),
+        sa.Column('setting_value', sa.Text(), nullable=False),
+        sa.Column('updated_at', sa.DateTime()),
+    )
+
+    op.create_table(
+        'coach_usage',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id'), nullable=False),
+        sa.Column('usage_date', sa.Date(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.UniqueConstraint('user_id', 'usage_date', name='_user_date_uc'),
+    )
+    op.create_index('ix_coach_usage_id', 'coach_usage', ['id'])
+
+    # Default data (a copy of DEFAULT_TNT_PLANS / DEFAULT_REFERRAL_SETTINGS at
+    # the time of this revision; later changes belong in new revisions)
+    op.bulk_insert(tnt_plans, [
+        {'plan_name': 'FREE', 'plan_display_name': 'رایگان', 'price_usd': 0.00,
+         'monthly_limit': 0, 'hourly_limit': 0, 'vip_access': False, 'is_active': True},
+        {'plan_name': 'TNT_MINI', 'plan_display_name': 'TNT MINI', 'price_usd': 6.00,
+         'monthly_limit': 60, 'hourly_limit': 2, 'vip_access': False, 'is_active': True},
+        {'plan_name': 'TNT_PLUS', 'plan_display_name': 'TNT PLUS+', 'price_usd': 10.00,
+         'monthly_limit': 150, 'hourly_limit': 4, 'vip_access': False, 'is_active': True},
+        {'plan_name': 'TNT_MAX', 'plan_display_name': 'TNT MAX', 'price_usd': 22.00,
+         'monthly_limit': 400, 'hourly_limit': 8, 'vip_access': True, 'is_active': True},
+    ])
+    op.bulk_insert(referral_settings, [
+        {'setting_key': 'min_withdrawal_amount', 'setting_value': '20.00'},
+        {'setting_key': 'default_commission_rate', 'setting_value': '35.00'},
+        {'setting_key': 'bonus_threshold_5', 'setting_value': '2.00'},
+        {'setting_key': 'bonus_threshold_10', 'setting_value': '5.00'},
+    ])
+
+
+def downgrade():
+    for table_name in (
+        'coach_usage', 'referral_settings', 'commissions', 'referrals', 'tnt_plans',
+        'tnt_usage_tracking', 'api_requests', 'transactions', 'users'
+    ):
+        op.drop_table(table_name)
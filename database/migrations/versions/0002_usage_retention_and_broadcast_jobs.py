@@ -0,0 +1,74 @@
+"""usage retention tables and broadcast jobs
+
+Tables added after the baseline: broadcast_jobs (resumable /broadcast),
+tnt_usage_daily and api_requests_archive (retention). Databases that got
+them from create_all already are left untouched.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from database.migration import create_index_concurrently
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table_name):
+    if op.get_context().as_sql:
+        return False
+    return sa.inspect(op.get_bind()).has_table(table_name)
+
+
+def upgrade():
+    if not _has_table('broadcast_jobs'):
+        op.create_table(
+            'broadcast_jobs',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('message', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(20)),
+            sa.Column('admin_chat_id', sa.BigInteger(), nullable=False),
+            sa.Column('status_message_id', sa.Integer()),
+            sa.Column('last_user_id', sa.BigInteger()),
+            sa.Column('sent_count', sa.Integer()),
+            sa.Column('failed_count', sa.Integer()),
+            sa.Column('blocked_count', sa.Integer()),
+            sa.Column('created_at', sa.DateTime()),
+            sa.Column('updated_at', sa.DateTime()),
+            sa.Column('finished_at', sa.DateTime()),
+        )
+        op.create_index('idx_broadcast_jobs_status', 'broadcast_jobs', ['status'])
+
+    if not _has_table('tnt_usage_daily'):
+        op.create_table(
+            'tnt_usage_daily',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False),
+            sa.Column('usage_date', sa.Date(), nullable=False),
+            sa.Column('analysis_count', sa.Integer(), nullable=False),
+            sa.UniqueConstraint('user_id', 'usage_date', name='unique_user_daily_usage'),
+        )
+
+    if not _has_table('api_requests_archive'):
+        op.create_table(
+            'api_requests_archive',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.BigInteger()),
+            sa.Column('endpoint', sa.String(255)),
+            sa.Column('request_date', sa.Date()),
+            sa.Column('created_at', sa.DateTime()),
+        )
+    # the archive can already be large when it was created by create_all
+    create_index_concurrently('idx_api_requests_archive_date', 'api_requests_archive', ['request_date'])
+
+
+def downgrade():
+    op.drop_table('api_requests_archive')
+    op.drop_table('tnt_usage_daily')
+    op.drop_table('broadcast_jobs')
@@ -0,0 +1,92 @@
+"""covering indexes for hot paths, drop redundant ones
+
+- tnt_usage_tracking: one unique (user_id, usage_date, usage_hour)
+  INCLUDE (analysis_count) index replaces the unique constraint and the two
+  overlapping indexes; the hourly lookup and the monthly sum become
+  index-only scans and every usage write maintains one index instead of three.
+- tnt_usage_daily: same for (user_id, usage_date).
+- commissions: (referrer_id, status) INCLUDE (total_amount, referred_id)
+  for the referral panel aggregate.
+- users: partial index for broadcast paging, created_at for dashboards;
+  idx_users_referral_code duplicated the UNIQUE constraint's index.
+
+All indexes are built before the old ones are dropped, concurrently on
+PostgreSQL.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from database.migration import (
+    create_index_concurrently, drop_index_concurrently, drop_unique_constraint_if_exists
+)
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tnt_usage_tracking
+    create_index_concurrently(
+        'uq_usage_tracking_user_hour', 'tnt_usage_tracking',
+        ['user_id', 'usage_date', 'usage_hour'], unique=True,
+        postgresql_include=['analysis_count']
+    )
+    drop_unique_constraint_if_exists('unique_user_hour_usage', 'tnt_usage_tracking')
+    drop_index_concurrently('idx_usage_tracking_user_date', 'tnt_usage_tracking')
+    drop_index_concurrently('idx_usage_tracking_user_hour', 'tnt_usage_tracking')
+    # parent indexes created by /retention partition (database/retention.py)
+    if op.get_context().dialect.name == 'postgresql':
+        drop_unique_constraint_if_exists('tnt_usage_tracking_p_user_hour', 'tnt_usage_tracking')
+        drop_index_concurrently('tnt_usage_tracking_p_user_date', 'tnt_usage_tracking')
+
+    # tnt_usage_daily
+    create_index_concurrently(
+        'uq_usage_daily_user_date', 'tnt_usage_daily', ['user_id', 'usage_date'], unique=True,
+        postgresql_include=['analysis_count']
+    )
+    drop_unique_constraint_if_exists('unique_user_daily_usage', 'tnt_usage_daily')
+
+    # commissions
+    create_index_concurrently(
+        'idx_commissions_referrer_cov', 'commissions', ['referrer_id', 'status'],
+        postgresql_include=['total_amount', 'referred_id']
+    )
+    drop_index_concurrently('idx_commissions_referrer', 'commissions')
+
+    # users
+    create_index_concurrently(
+        'idx_users_active_id', 'users', ['user_id'],
+        postgresql_where=sa.text('is_active = true'), sqlite_where=sa.text('is_active = 1')
+    )
+    create_index_concurrently('idx_users_created_at', 'users', ['created_at'])
+    drop_index_concurrently('idx_users_referral_code', 'users')
+
+
+def downgrade():
+    create_index_concurrently('idx_users_referral_code', 'users', ['referral_code'])
+    drop_index_concurrently('idx_users_created_at', 'users')
+    drop_index_concurrently('idx_users_active_id', 'users')
+
+    create_index_concurrently('idx_commissions_referrer', 'commissions', ['referrer_id', 'status'])
+    drop_index_concurrently('idx_commissions_referrer_cov', 'commissions')
+
+    with op.batch_alter_table('tnt_usage_daily') as batch_op:
+        batch_op.create_unique_constraint('unique_user_daily_usage', ['user_id', 'usage_date'])
+    drop_index_concurrently('uq_usage_daily_user_date', 'tnt_usage_daily')
+
+    create_index_concurrently('idx_usage_tracking_user_date', 'tnt_usage_tracking', ['user_id', 'usage_date'])
+    create_index_concurrently(
+        'idx_usage_tracking_user_hour', 'tnt_usage_tracking', ['user_id', 'usage_date', 'usage_hour']
+    )
+    with op.batch_alter_table('tnt_usage_tracking') as batch_op:
+        batch_op.create_unique_constraint(
+            'unique_user_hour_usage', ['user_id', 'usage_date', 'usage_hour']
+        )
+    drop_index_concurrently('uq_usage_tracking_user_hour', 'tnt_usage_tracking')
@@ -0,0 +1,56 @@
+"""per-plan commission rates in referral_settings
+
+Commission rates used to be hard-coded in calculate_referral_commission;
+they are now read from referral_settings through the in-memory plan
+catalog. Existing keys are left untouched.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+COMMISSION_SETTINGS = {
+    'commission_rate_TNT_MINI': '20.00',
+    'commission_rate_TNT_PLUS': '25.00',
+    'commission_rate_TNT_MAX': '30.00',
+}
+
+referral_settings = sa.table(
+    'referral_settings',
+    sa.column('setting_key', sa.String),
+    sa.column('setting_value', sa.Text),
+    sa.column('updated_at', sa.DateTime),
+)
+
+
+def upgrade():
+    existing = set()
+    if not op.get_context().as_sql:
+        existing = set(op.get_bind().execute(
+            sa.select(referral_settings.c.setting_key).where(
+                referral_settings.c.setting_key.in_(list(COMMISSION_SETTINGS))
+            )
+        ).scalars())
+
+    rows = [
+        {'setting_key': key, 'setting_value': value}
+        for key, value in COMMISSION_SETTINGS.items() if key not in existing
+    ]
+    if rows:
+        op.bulk_insert(referral_settings, rows)
+
+
+def downgrade():
+    op.execute(
+        referral_settings.delete().where(
+            referral_settings.c.setting_key.in_(list(COMMISSION_SETTINGS))
+        )
+    )
@@ -54,7 +54,11 @@ class User(Base):
     __table_args__ = (
         Index('idx_users_subscription', 'subscription_end', 'is_active'),
         Index('idx_users_tnt_plan', 'tnt_plan_type', 'tnt_plan_end'),
-        Index('idx_users_referral_code', 'referral_code'),
+        Index('idx_users_created_at', 'created_at'),
+        # broadcast recipients (keyset on user_id over active users only)
+        Index('idx_users_active_id', 'user_id',
+              postgresql_where=text('is_active = true'), sqlite_where=text('is_active = 1')),
+        # referral_code lookups use the index of its UNIQUE constraint
     )
     
     def __repr__(self):
@@ -139,16 +143,53 @@ class TntUsageTracking(Base):
     # Relationships
     user = relationship("User", back_populates="tnt_usage")
     
-    # Constraints
+    # One covering index serves the hourly lookup, the monthly sum
+    # (user_id, usage_date >= x) and the uniqueness rule; INCLUDE makes
+    # both limit checks index-only scans on PostgreSQL
     __table_args__ = (
-        UniqueConstraint('user_id', 'usage_date', 'usage_hour', name='unique_user_hour_usage'),
-        Index('idx_usage_tracking_user_date', 'user_id', 'usage_date'),
-        Index('idx_usage_tracking_user_hour', 'user_id', 'usage_date', 'usage_hour'),
+        Index('uq_usage_tracking_user_hour', 'user_id', 'usage_date', 'usage_hour',
+              unique=True, postgresql_include=['analysis_count']),
     )
     
     def __repr__(self):
         return f"<TntUsageTracking(user_id={self.user_id}, date={self.usage_date}, hour={self.usage_hour})>"
 
+class TntUsageDaily(Base):
+    """Daily summary of compacted hourly usage rows (see database/retention.py)"""
+    __tablename__ = 'tnt_usage_daily'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False)
+    usage_date = Column(Date, nullable=False)
+    analysis_count = Column(Integer, default=0, nullable=False)
+    
+    # Constraints
+    __table_args__ = (
+        Index('uq_usage_daily_user_date', 'user_id', 'usage_date',
+              unique=True, postgresql_include=['analysis_count']),
+    )
+    
+    def __repr__(self):
+        return f"<TntUsageDaily(user_id={self.user_id}, date={self.usage_date}, count={self.analysis_count})>"
+
+class ApiRequestArchive(Base):
+    """Cold storage for old api_requests rows when the table is not partitioned"""
+    __tablename__ = 'api_requests_archive'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger)
+    endpoint = Column(String(255))
+    request_date = Column(Date)
+    created_at = Column(DateTime)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_api_requests_archive_date', 'request_date'),
+    )
+    
+    def __repr__(self):
+        return f"<ApiRequestArchive(id={self.id}, user_id={self.user_id}, endpoint={self.endpoint})>"
+
 class TntPlan(Base):
     __tablename__ = 'tnt_plans'
     
@@ -215,7 +256,8 @@ class Commission(Base):
     
     # Indexes
     __table_args__ = (
-        Index('idx_commissions_referrer', 'referrer_id', 'status'),
+        Index('idx_commissions_referrer_cov', 'referrer_id', 'status',
+              postgresql_include=['total_amount', 'referred_id']),
         Index('idx_commissions_status', 'status'),
     )
     
@@ -233,6 +275,30 @@ class ReferralSetting(Base):
     def __repr__(self):
         return f"<ReferralSetting(key={self.setting_key}, value={self.setting_value})>"
 
+class BroadcastJob(Base):
+    __tablename__ = 'broadcast_jobs'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message = Column(Text, nullable=False)
+    status = Column(String(20), default='pending')  # pending, running, completed, cancelled, failed
+    admin_chat_id = Column(BigInteger, nullable=False)
+    status_message_id = Column(Integer)
+    last_user_id = Column(BigInteger, default=0)  # keyset checkpoint for resume
+    sent_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    blocked_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime)
+    
+    # Indexes
+    __table_args__ = (
+        Index('idx_broadcast_jobs_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f"<BroadcastJob(id={self.id}, status={self.status}, sent={self.sent_count})>"
+
 # Default data initialization
 DEFAULT_TNT_PLANS = [
     {
@@ -274,6 +340,10 @@ DEFAULT_REFERRAL_SETTINGS = [
     {'setting_key': 'default_commission_rate', 'setting_value': '35.00'},
     {'setting_key': 'bonus_threshold_5', 'setting_value': '2.00'},
     {'setting_key': 'bonus_threshold_10', 'setting_value': '5.00'},
+    # نرخ کمیسیون هر پلن (درصد)
+    {'setting_key': 'commission_rate_TNT_MINI', 'setting_value': '20.00'},
+    {'setting_key': 'commission_rate_TNT_PLUS', 'setting_value': '25.00'},
+    {'setting_key': 'commission_rate_TNT_MAX', 'setting_value': '30.00'},
 ]
 
 class CoachUsage(Base):
@@ -0,0 +1,155 @@
+"""
+EXPLAIN-based regression check for the hot repository queries
+
+Each hot query is built by the same helper the repository uses and must be
+answered from its covering index:
+
+- PostgreSQL: every scan of the listed tables is an Index Only Scan
+  (seq/bitmap scans are disabled for the check so a tiny table does not
+  hide a missing index)
+- SQLite: EXPLAIN QUERY PLAN searches the expected index (SQLite has no
+  INCLUDE columns, so only the lookup itself is checked)
+
+Run after migrations, e.g. in CI or the release phase:
+
+    python -m database.query_plans
+"""
+import json
+import logging
+import sys
+from datetime import date
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .connection import db_manager
+from .repository import AdminRepository, BroadcastRepository, TntRepository
+
+logger = logging.getLogger(__name__)
+
+
+SAMPLE_DATE = date(2026, 1, 1)
+
+# name -> statement builder, tables that must be read index-only, expected index
+HOT_QUERIES: List[Dict[str, Any]] = [
+    {
+        'name': 'hourly_usage',
+        'build': lambda: TntRepository.hourly_usage_query(1, SAMPLE_DATE, 10),
+        'tables': ['tnt_usage_tracking'],
+        'index': 'uq_usage_tracking_user_hour',
+    },
+    {
+        'name': 'usage_since',
+        'build': lambda: TntRepository.usage_since_query(1, SAMPLE_DATE),
+        'tables': ['tnt_usage_tracking', 'tnt_usage_daily'],
+        'index': 'uq_usage_',
+    },
+    {
+        'name': 'broadcast_active_page',
+        'build': lambda: BroadcastRepository.active_user_ids_page_query(0, 500),
+        'tables': ['users'],
+        'index': 'idx_users_active_id',
+    },
+    {
+        'name': 'referral_totals',
+        'build': lambda: AdminRepository.referral_totals_query(1),
+        'tables': ['commissions'],
+        'index': 'idx_commissions_referrer_cov',
+    },
+]
+
+
+def _compile(session: Session, statement) -> str:
+    return str(statement.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={"literal_binds": True}
+    ))
+
+
+def _walk(plan: Dict[str, Any]):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _walk(child)
+
+
+def _owning_table(relation: str, tables: List[str]):
+    """Map a partition (<table>_pYYYYMM, <table>_legacy) to its parent table"""
+    for table in tables:
+        if relation == table or relation.startswith(f"{table}_p") or relation == f"{table}_legacy":
+            return table
+    return None
+
+
+def _check_postgresql(session: Session, query: Dict[str, Any]) -> List[str]:
+    # SET LOCAL: only for this transaction
+    session.execute(select(func.set_config('enable_seqscan', 'off', True)))
+    session.execute(select(func.set_config('enable_bitmapscan', 'off', True)))
+    raw = session.connection().exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {_compile(session, query['build']())}"
+    ).scalar()
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+
+    problems = []
+    scanned = set()
+    for node in _walk(plan):
+        table = _owning_table(node.get('Relation Name', ''), query['tables'])
+        if table is None:
+            continue
+        scanned.add(table)
+        if node['Node Type'] != 'Index Only Scan':
+            problems.append(f"{node['Relation Name']}: {node['Node Type']}")
+    problems.extend(f"{table}: not in plan" for table in query['tables'] if table not in scanned)
+    return problems
+
+
+def _check_sqlite(session: Session, query: Dict[str, Any]) -> List[str]:
+    rows = session.connection().exec_driver_sql(
+        f"EXPLAIN QUERY PLAN {_compile(session, query['build']())}"
+    ).fetchall()
+    details = [row[-1] for row in rows]
+
+    problems = []
+    for table in query['tables']:
+        table_steps = [d for d in details if f" {table} " in f"{d} "]
+        if not table_steps:
+            problems.append(f"{table}: not in plan")
+        for step in table_steps:
+            if 'INDEX' not in step or query['index'] not in step:
+                problems.append(f"{table}: {step}")
+    return problems
+
+
+def check_query_plans(session: Session) -> Dict[str, List[str]]:
+    """
+    EXPLAIN every hot query; returns {query name: problems}.
+    An empty list means the plan uses the expected index.
+    """
+    dialect = session.get_bind().dialect.name
+    checker: Callable = _check_postgresql if dialect == 'postgresql' else _check_sqlite
+
+    results = {}
+    for query in HOT_QUERIES:
+        try:
+            results[query['name']] = checker(session, query)
+        except Exception as e:
+            results[query['name']] = [f"EXPLAIN failed: {e}"]
+        finally:
+            # SET LOCAL settings end with the transaction
+            session.rollback()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with db_manager.get_session() as session:
+        results = check_query_plans(session)
+
+    failed = False
+    for name, problems in results.items():
+        if problems:
+            failed = True
+            print(f"❌ {name}: {'; '.join(problems)}")
+        else:
+            print(f"✅ {name}")
+    sys.exit(1 if failed else 0)
@@ -7,16 +7,22 @@ from datetime import datetime, date, timedelta
 from typing import Optional, List, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import func, and_, or_, desc, case, text
+from sqlalchemy import (
+    func, and_, or_, desc, case, text, select, literal, union_all, true,
+    insert, update, values, column, BigInteger, Integer, String, DateTime
+)
 
 from .connection import db_manager
 from .models import (
     User, Transaction, ApiRequest, TntUsageTracking, TntPlan,
-    Referral, Commission, ReferralSetting
+    Referral, Commission, ReferralSetting, BroadcastJob, TntUsageDaily, ApiRequestArchive
 )
+from services.plan_catalog_service import plan_catalog
+from services.user_cache_service import user_profile_cache
 
 logger = logging.getLogger(__name__)
 
+
 class AdminRepository:
     """Repository for admin operations with clean SQLAlchemy ORM"""
     
@@ -26,210 +32,113 @@ class AdminRepository:
     # === USER STATISTICS ===
     def get_user_statistics(self) -> Dict[str, Any]:
         """Get comprehensive user statistics"""
-        try:
-            today = date.today()
-            
-            # Basic counts
-            total_users = self.db_session.query(User).count()
-            active_users = self.db_session.query(User).filter(User.is_active == True).count()
-            
-            # Today's new users
-            new_users_today = self.db_session.query(User).filter(
-                func.date(User.created_at) == today
-            ).count()
-            
-            # Monthly revenue
-            first_day = today.replace(day=1)
-            monthly_revenue = self.db_session.query(func.sum(Transaction.amount)).filter(
-                Transaction.status == 'completed',
-                func.date(Transaction.created_at) >= first_day
-            ).scalar() or 0
-            
-            return {
-                "total_users": total_users,
-                "active_users": active_users,
-                "new_users_today": new_users_today,
-                "monthly_revenue": float(monthly_revenue),
-                "timestamp": datetime.now().isoformat()
-            }
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Error getting user statistics: {e}")
-            raise
+        return StatsRepository(self.db_session).get_user_statistics()
     
-    # === BROADCAST SUPPORT ===
-    def get_all_active_user_ids(self) -> List[int]:
-        """Get list of all active user IDs for broadcast"""
-        try:
-            user_ids = self.db_session.query(User.user_id).filter(
-                User.is_active == True
-            ).all()
-            
-            return [user_id[0] for user_id in user_ids]
-            
-        except SQLAlchemyError as e:
-            logger.error(f"Error getting active user IDs: {e}")
-            raise
-      
     # === TNT SUBSCRIPTION STATISTICS ===
     def get_tnt_subscription_stats(self) -> Dict[str, Any]:
         """Get TNT subscription statistics"""
-        try:
-            # Count by plan type
-            plan_stats = self.db_session.query(
-                User.tnt_plan_type,
-                func.count(User.user_id).label('count')
-            ).filter(
-                User.tnt_plan_type.isnot(None),
-                User.tnt_plan_type != 'FREE'
-            ).group_by(User.tnt_plan_type).all()
-
-            # Active TNT users
-            active_tnt_users = self.db_session.query(User).filter(
-                User.tnt_plan_type != 'FREE',
-                User.tnt_plan_end > datetime.now()
-            ).count()
-
-            # Today's usage
-            today = date.today()
-            today_usage = self.db_session.query(
-                func.count(func.distinct(TntUsageTracking.user_id)).label('active_users'),
-                func.sum(TntUsageTracking.analysis_count).label('total_analyses')
-            ).filter(
-                TntUsageTracking.usage_date == today
-            ).first()
+        return StatsRepository(self.db_session).get_tnt_subscription_stats()
 
-            return {
-                "plan_distribution": [
-                    {"plan_type": plan_type, "count": count}
-                    for plan_type, count in plan_stats
-                ],
-                "active_tnt_users": active_tnt_users,
-                "today_stats": {
-                    "active_users": today_usage.active_users or 0,
-                    "total_analyses": today_usage.total_analyses or 0
-                },
-                "timestamp": datetime.now().isoformat()
-            }
+    # === REFERRAL SYSTEM OVERVIEW ===
+    def get_referral_overview(self) -> Dict[str, Any]:
+        """Get comprehensive referral system overview"""
+        return StatsRepository(self.db_session).get_referral_overview()
 
-        except SQLAlchemyError as e:
-            logger.error(f"Error getting TNT statistics: {e}")
-            raise
+    # === DATABASE CLEANUP ===
+    # Tables in deletion order (foreign key dependencies)
+    CLEANUP_TABLES = [
+        TntUsageTracking, TntUsageDaily, ApiRequest, ApiRequestArchive,
+        Transaction, Commission, Referral, User
+    ]
 
+    def cleanup_database(self, batch_size: int = 5000, use_truncate: Optional[bool] = None,
+                         progress_callback=None) -> Dict[str, Dict[str, Any]]:
+        """
+        Clean database tables in correct order (respecting foreign keys).
 
-    # === REFERRAL SYSTEM OVERVIEW ===
-    def get_referral_overview(self) -> Dict[str, Any]:
-        """Get comprehensive referral system overview - REWRITTEN"""
-        try:
-            # System totals
-            total_referrers = self.db_session.query(
-                func.count(func.distinct(Commission.referrer_id))
-            ).scalar() or 0
+        On PostgreSQL the tables are emptied with a single TRUNCATE ... CASCADE
+        (unless use_truncate is False). Otherwise rows are deleted in primary-key
+        ranges of batch_size with a commit per batch, so locks and WAL stay bounded.
+        progress_callback(table_name, deleted_so_far, finished) is called after
+        every batch.
+        """
+        if use_truncate is None:
+            use_truncate = self.db_session.bind.dialect.name == 'postgresql'
 
-            total_commissions = self.db_session.query(Commission).count()
-            
-            total_amount = self.db_session.query(
-                func.sum(Commission.total_amount)
-            ).scalar() or 0
+        if use_truncate:
+            return self._truncate_tables(progress_callback)
 
-            pending_amount = self.db_session.query(
-                func.sum(Commission.total_amount)
-            ).filter(
-                Commission.status == 'pending'
-            ).scalar() or 0
+        cleanup_results = {}
+        for model_class in self.CLEANUP_TABLES:
+            table_name = model_class.__tablename__
+            deleted = self.delete_in_batches(
+                model_class, batch_size,
+                progress_callback=(
+                    (lambda count, name=table_name: progress_callback(name, count, False))
+                    if progress_callback else None
+                )
+            )
+            cleanup_results[table_name] = {"deleted": deleted, "method": "batched"}
+            if progress_callback:
+                progress_callback(table_name, deleted, True)
 
-            paid_amount = self.db_session.query(
-                func.sum(Commission.total_amount)
-            ).filter(
-                Commission.status == 'paid'
-            ).scalar() or 0
+        return cleanup_results
 
-            # Top referrers
-            top_referrers = self.db_session.query(
-                User.user_id,
-                User.username,
-                User.referral_code,
-                func.count(Commission.id).label('total_referrals'),
-                func.sum(Commission.total_amount).label('total_earned'),
-                func.sum(
-                    case((Commission.status == 'pending', Commission.total_amount), else_=0)
-                ).label('pending_amount')
-            ).join(
-                Commission, User.user_id == Commission.referrer_id
-            ).group_by(
-                User.user_id, User.username, User.referral_code
-            ).order_by(
-                desc('total_earned')
-            ).limit(10).all()
+    def delete_in_batches(self, model_class, batch_size: int = 5000, where=None, progress_callback=None) -> int:
+        """
+        Delete rows of a table in ascending primary-key ranges, committing each batch.
+        The upper bound of every batch is looked up through the primary-key index,
+        so no full-table COUNT(*) is needed.
+        """
+        pk = model_class.__mapper__.primary_key[0]
+        filters = [where] if where is not None else []
+        deleted_total = 0
 
-            return {
-                "success": True,
-                "system_stats": {
-                    "total_referrers": total_referrers,
-                    "total_commissions": total_commissions,
-                    "total_commissions_amount": float(total_amount),
-                    "pending_payments": float(pending_amount),
-                    "paid_amount": float(paid_amount)
-                },
-                "referrers": [
-                    {
-                        "user_id": ref.user_id,
-                        "username": ref.username or f"User_{ref.user_id}",
-                        "referral_code": ref.referral_code,
-                        "total_referrals": ref.total_referrals,
-                        "total_earned": float(ref.total_earned),
-                        "pending_amount": float(ref.pending_amount)
-                    }
-                    for ref in top_referrers
-                ],
-                "timestamp": datetime.now().isoformat()
-            }
+        try:
+            while True:
+                boundary = self.db_session.query(pk).filter(*filters).order_by(pk).offset(
+                    batch_size - 1
+                ).limit(1).scalar()
+
+                delete_query = self.db_session.query(model_class).filter(*filters)
+                if boundary is not None:
+                    delete_query = delete_query.filter(pk <= boundary)
+
+                deleted = delete_query.delete(synchronize_session=False)
+                self.db_session.commit()
+                deleted_total += deleted
+
+                if progress_callback:
+                    progress_callback(deleted_total)
+                if boundary is None or deleted == 0:
+                    break
+
+            return deleted_total
 
         except SQLAlchemyError as e:
-            logger.error(f"Error getting referral overview: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
+            self.db_session.rollback()
+            logger.error(f"Error deleting from {model_class.__tablename__} after {deleted_total} rows: {e}")
+            raise
 
-    # === DATABASE CLEANUP ===
-    def cleanup_database(self) -> Dict[str, int]:
-        """Clean database tables in correct order (respecting foreign keys)"""
+    def _truncate_tables(self, progress_callback=None) -> Dict[str, Dict[str, Any]]:
+        """TRUNCATE all cleanup tables at once (PostgreSQL only)"""
+        table_names = [model.__tablename__ for model in self.CLEANUP_TABLES]
         try:
-            # Tables in deletion order (foreign key dependencies)
-            tables_to_clean = [
-                (TntUsageTracking, "tnt_usage_tracking"),
-                (ApiRequest, "api_requests"),
-                (Transaction, "transactions"),
-                (Commission, "commissions"),
-                (Referral, "referrals"),
-                (User, "users")
-            ]
-            
-            cleanup_results = {}
-            
-            for model_class, table_name in tables_to_clean:
-                # Count before deletion
-                before_count = self.db_session.query(model_class).count()
-                
-                # Delete all records
-                deleted_count = self.db_session.query(model_class).delete()
-                
-                cleanup_results[table_name] = {
-                    "before": before_count,
-                    "deleted": deleted_count,
-                    "remaining": before_count - deleted_count
-                }
-            
-            # Commit all deletions
+            self.db_session.execute(
+                text(f"TRUNCATE TABLE {', '.join(table_names)} RESTART IDENTITY CASCADE")
+            )
             self.db_session.commit()
-            
-            return cleanup_results
+
+            results = {}
+            for table_name in table_names:
+                results[table_name] = {"deleted": None, "method": "truncate"}
+                if progress_callback:
+                    progress_callback(table_name, None, True)
+            return results
 
         except SQLAlchemyError as e:
             self.db_session.rollback()
-            logger.error(f"Error cleaning database: {e}")
+            logger.error(f"Error truncating tables: {e}")
             raise
 
     # === SEQUENCE RESET ===
@@ -268,10 +177,10 @@ class AdminRepository:
             logger.error(f"Error resetting sequences: {e}")
             return False
 
-    def get_user_referral_details(self, user_id: int) -> dict:
+    def get_user_referral_details(self, user_id: int, limit: Optional[int] = None, offset: int = 0) -> dict:
         """دریافت جزئیات رفرال کاربر"""
         try:
-            return self.get_user_referral_stats(user_id)
+            return self.get_user_referral_stats(user_id, limit=limit, offset=offset)
         except Exception as e:
             return {"success": False, "error": str(e)}
 
@@ -322,49 +231,90 @@ class AdminRepository:
             self.db_session.rollback()
             return {"success": False, "error": str(e)}  
 
-    def get_user_referral_stats(self, user_id: int) -> dict:
-        """دریافت آمار شخصی رفرال کاربر"""
+    @staticmethod
+    def referral_totals_query(user_id: int):
+        """
+        آمار تجمیعی کمیسیون‌های یک معرف (همیشه دقیقاً یک ردیف)؛
+        database/query_plans.py همین کوئری را روی idx_commissions_referrer_cov بررسی می‌کند
+        """
+        # تعداد رفرال‌ها به صورت زیرکوئری اسکالر
+        total_referrals = select(
+            func.count(Referral.id)
+        ).where(
+            Referral.referrer_id == user_id
+        ).scalar_subquery()
+
+        return select(
+            total_referrals.label('total_referrals'),
+            func.count(User.user_id).label('total_buyers'),
+            func.coalesce(func.sum(Commission.total_amount), 0).label('total_earned'),
+            func.coalesce(func.sum(
+                case((Commission.status == 'pending', Commission.total_amount), else_=0)
+            ), 0).label('pending_amount'),
+            func.coalesce(func.sum(
+                case((Commission.status == 'paid', Commission.total_amount), else_=0)
+            ), 0).label('paid_amount')
+        ).select_from(Commission).outerjoin(
+            User, User.user_id == Commission.referred_id
+        ).where(
+            Commission.referrer_id == user_id
+        )
+
+    def get_user_referral_stats(self, user_id: int, limit: Optional[int] = None, offset: int = 0) -> dict:
+        """
+        دریافت آمار شخصی رفرال کاربر
+        آمار تجمیعی و یک صفحه از خریداران در یک کوئری (یک رفت و برگشت) خوانده می‌شوند.
+        """
         try:
-            # پیدا کردن تمام رفرال‌های این کاربر
-            referrals = self.db_session.query(Referral).filter_by(
-                referrer_id=user_id
-            ).all()
-            
-            # پیدا کردن کمیسیون‌های این کاربر
-            commissions = self.db_session.query(Commission).filter_by(
-                referrer_id=user_id
+            agg = self.referral_totals_query(user_id).subquery('agg')
+
+            # یک صفحه از خریداران همراه با نام کاربری
+            page_query = select(
+                Commission.id.label('commission_id'),
+                User.user_id.label('buyer_id'),
+                User.username,
+                Commission.plan_type,
+                Commission.total_amount.label('amount'),
+                Commission.created_at,
+                Commission.status
+            ).join(
+                User, User.user_id == Commission.referred_id
+            ).where(
+                Commission.referrer_id == user_id
+            ).order_by(Commission.id)
+            if limit is not None:
+                page_query = page_query.limit(limit)
+            if offset:
+                page_query = page_query.offset(offset)
+            page = page_query.subquery('page')
+
+            rows = self.db_session.execute(
+                select(agg, page).select_from(
+                    agg.outerjoin(page, true())
+                ).order_by(page.c.commission_id)
             ).all()
-            
-            # محاسبه آمار
-            total_referrals = len(referrals)
-            total_earned = sum(c.total_amount for c in commissions)
-            pending_amount = sum(c.total_amount for c in commissions if c.status == 'pending')
-            paid_amount = sum(c.total_amount for c in commissions if c.status == 'paid')
-            
-            # لیست خریداران
-            buyers = []
-            for commission in commissions:
-                # پیدا کردن کاربر خریدار
-                buyer = self.db_session.query(User).filter_by(
-                    user_id=commission.referred_id
-                ).first()
-                
-                if buyer:
-                    buyers.append({
-                        "username": buyer.username or f"User_{buyer.user_id}",
-                        "plan_type": commission.plan_type,
-                        "amount": float(commission.total_amount),
-                        "date": commission.created_at.strftime('%Y-%m-%d'),
-                        "status": commission.status
-                    })
+
+            totals = rows[0]
+            buyers = [
+                {
+                    "user_id": row.buyer_id,
+                    "username": row.username or f"User_{row.buyer_id}",
+                    "plan_type": row.plan_type,
+                    "amount": float(row.amount),
+                    "date": row.created_at.strftime('%Y-%m-%d') if row.created_at else 'N/A',
+                    "status": row.status
+                }
+                for row in rows if row.commission_id is not None
+            ]
             
             return {
                 "success": True,
                 "referral_code": f"REF{user_id}TEMP",
-                "total_referrals": total_referrals,
-                "total_earned": float(total_earned),
-                "pending_amount": float(pending_amount),
-                "paid_amount": float(paid_amount),
+                "total_referrals": int(totals.total_referrals or 0),
+                "total_buyers": int(totals.total_buyers or 0),
+                "total_earned": float(totals.total_earned),
+                "pending_amount": float(totals.pending_amount),
+                "paid_amount": float(totals.paid_amount),
                 "buyers": buyers
             }
             
@@ -383,17 +333,10 @@ class AdminRepository:
                 return {"success": False, "error": "رفرال یافت نشد"}
             
             # محاسبه مبلغ کمیسیون بر اساس پلن
-            commission_rates = {
-                "TMT_MINI": {"rate": 0.20, "base_price": 6},    # 20% از 6$
-                "TNT_PLUS": {"rate": 0.25, "base_price": 10},   # 25% از 10$
-                "TNT_MAX": {"rate": 0.30, "base_price": 22}     # 30% از 22$
-            }
-            
-            plan_info = commission_rates.get(plan_name, {"rate": 0.20, "base_price": 6})
-            base_amount = plan_info["base_price"] * (duration / 30)  # قیمت ماهانه * تعداد ماه
-            commission_amount = base_amount * plan_info["rate"]
-            bonus_amount = 0  # در آینده می‌تونیم بونوس اضافه کنیم
-            total_amount = commission_amount + bonus_amount
+            amounts = plan_catalog.compute_commission(plan_name, duration)
+            commission_amount = amounts["commission_amount"]
+            bonus_amount = amounts["bonus_amount"]
+            total_amount = amounts["total_amount"]
             
             # ثبت کمیسیون در دیتابیس
             commission = Commission(
@@ -420,28 +363,390 @@ class AdminRepository:
             self.db_session.rollback()
             return {"success": False, "error": str(e)}
 
+class StatsRepository:
+    """
+    Read-only aggregate queries for admin dashboards.
+    Each dashboard is computed in one or two grouped queries, and date filters
+    use half-open datetime ranges instead of func.date() so indexes stay usable.
+    """
+
+    # Routed to the read replica by db_manager.session_for()
+    analytical = True
+
+    # Tables reported by /dbstats
+    COUNTED_TABLES = [
+        User, Transaction, ApiRequest, TntUsageTracking, TntPlan,
+        Referral, Commission, ReferralSetting
+    ]
+
+    def __init__(self, db_session: Session):
+        self.db_session = db_session
+
+    @staticmethod
+    def _day_range(day: date):
+        start = datetime.combine(day, datetime.min.time())
+        return start, start + timedelta(days=1)
+
+    def get_user_statistics(self) -> Dict[str, Any]:
+        """User counts and monthly revenue in a single round-trip"""
+        try:
+            today_start, tomorrow_start = self._day_range(date.today())
+            month_start = today_start.replace(day=1)
+
+            monthly_revenue = select(
+                func.coalesce(func.sum(Transaction.amount), 0)
+            ).where(
+                Transaction.status == 'completed',
+                Transaction.created_at >= month_start
+            ).scalar_subquery()
+
+            row = self.db_session.execute(
+                select(
+                    func.count(User.user_id).label('total_users'),
+                    func.coalesce(func.sum(case((User.is_active == True, 1), else_=0)), 0).label('active_users'),
+                    func.coalesce(func.sum(case((and_(
+                        User.created_at >= today_start,
+                        User.created_at < tomorrow_start
+                    ), 1), else_=0)), 0).label('new_users_today'),
+                    monthly_revenue.label('monthly_revenue')
+                ).select_from(User)
+            ).one()
+
+            return {
+                "total_users": int(row.total_users),
+                "active_users": int(row.active_users),
+                "new_users_today": int(row.new_users_today),
+                "monthly_revenue": float(row.monthly_revenue or 0),
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting user statistics: {e}")
+            raise
+
+    def get_tnt_subscription_stats(self) -> Dict[str, Any]:
+        """Plan distribution (with active counts) plus today's usage: two queries"""
+        try:
+            now = datetime.now()
+            plan_stats = self.db_session.execute(
+                select(
+                    User.tnt_plan_type,
+                    func.count(User.user_id).label('count'),
+                    func.coalesce(func.sum(case((User.tnt_plan_end > now, 1), else_=0)), 0).label('active')
+                ).where(
+                    User.tnt_plan_type.isnot(None),
+                    User.tnt_plan_type != 'FREE'
+                ).group_by(User.tnt_plan_type)
+            ).all()
+
+            today_usage = self.db_session.execute(
+                select(
+                    func.count(func.distinct(TntUsageTracking.user_id)).label('active_users'),
+                    func.sum(TntUsageTracking.analysis_count).label('total_analyses')
+                ).where(
+                    TntUsageTracking.usage_date == date.today()
+                )
+            ).one()
+
+            return {
+                "plan_distribution": [
+                    {"plan_type": row.tnt_plan_type, "count": row.count}
+                    for row in plan_stats
+                ],
+                "active_tnt_users": sum(int(row.active) for row in plan_stats),
+                "today_stats": {
+                    "active_users": today_usage.active_users or 0,
+                    "total_analyses": today_usage.total_analyses or 0
+                },
+                "timestamp": now.isoformat()
+            }
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting TNT statistics: {e}")
+            raise
+
+    def get_referral_overview(self, top_limit: int = 10) -> Dict[str, Any]:
+        """Commission totals in one aggregate query plus the top referrers query"""
+        try:
+            totals = self.db_session.execute(
+                select(
+                    func.count(func.distinct(Commission.referrer_id)).label('total_referrers'),
+                    func.count(Commission.id).label('total_commissions'),
+                    func.coalesce(func.sum(Commission.total_amount), 0).label('total_amount'),
+                    func.coalesce(func.sum(
+                        case((Commission.status == 'pending', Commission.total_amount), else_=0)
+                    ), 0).label('pending_amount'),
+                    func.coalesce(func.sum(
+                        case((Commission.status == 'paid', Commission.total_amount), else_=0)
+                    ), 0).label('paid_amount')
+                )
+            ).one()
+
+            top_referrers = self.db_session.execute(
+                select(
+                    User.user_id,
+                    User.username,
+                    User.referral_code,
+                    func.count(Commission.id).label('total_referrals'),
+                    func.sum(Commission.total_amount).label('total_earned'),
+                    func.sum(
+                        case((Commission.status == 'pending', Commission.total_amount), else_=0)
+                    ).label('pending_amount')
+                ).join(
+                    Commission, User.user_id == Commission.referrer_id
+                ).group_by(
+                    User.user_id, User.username, User.referral_code
+                ).order_by(
+                    desc('total_earned')
+                ).limit(top_limit)
+            ).all()
+
+            return {
+                "success": True,
+                "system_stats": {
+                    "total_referrers": totals.total_referrers,
+                    "total_commissions": totals.total_commissions,
+                    "total_commissions_amount": float(totals.total_amount),
+                    "pending_payments": float(totals.pending_amount),
+                    "paid_amount": float(totals.paid_amount)
+                },
+                "referrers": [
+                    {
+                        "user_id": ref.user_id,
+                        "username": ref.username or f"User_{ref.user_id}",
+                        "referral_code": ref.referral_code,
+                        "total_referrals": ref.total_referrals,
+                        "total_earned": float(ref.total_earned),
+                        "pending_amount": float(ref.pending_amount)
+                    }
+                    for ref in top_referrers
+                ],
+                "timestamp": datetime.now().isoformat()
+            }
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting referral overview: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "timestamp": datetime.now().isoformat()
+            }
+
+    def get_table_counts(self, use_estimates: bool = False, estimate_threshold: int = 100000) -> Dict[str, Dict[str, Any]]:
+        """
+        Row counts of all dashboard tables in one UNION ALL query.
+        On PostgreSQL, tables whose planner estimate (pg_class.reltuples) is above
+        estimate_threshold are reported from the estimate instead of a full count.
+        """
+        try:
+            tables = [model.__tablename__ for model in self.COUNTED_TABLES]
+            estimates = {}
+            if use_estimates and self.db_session.bind.dialect.name == 'postgresql':
+                rows = self.db_session.execute(
+                    text(
+                        "SELECT relname, reltuples::bigint AS estimate FROM pg_class "
+                        "WHERE relname = ANY(:tables) AND relkind IN ('r', 'p')"
+                    ),
+                    {"tables": tables}
+                ).all()
+                estimates = {
+                    row.relname: int(row.estimate)
+                    for row in rows if row.estimate is not None and row.estimate >= estimate_threshold
+                }
+
+            exact_models = [m for m in self.COUNTED_TABLES if m.__tablename__ not in estimates]
+            counts = {}
+            if exact_models:
+                count_query = union_all(*[
+                    select(literal(model.__tablename__).label('table_name'), func.count().label('row_count')).select_from(model)
+                    for model in exact_models
+                ])
+                counts = {row.table_name: int(row.row_count) for row in self.db_session.execute(count_query)}
+
+            return {
+                table: {
+                    "count": estimates[table] if table in estimates else counts.get(table, 0),
+                    "estimated": table in estimates
+                }
+                for table in tables
+            }
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting table counts: {e}")
+            raise
+
+class UserRepository:
+    """Repository for user registration and bulk user lookups"""
+
+    def __init__(self, db_session: Session):
+        self.db_session = db_session
+
+    def get_user_ids(self, limit: Optional[int] = None) -> List[int]:
+        """Get the most recently created user IDs (used to warm membership caches)"""
+        try:
+            query = self.db_session.query(User.user_id).order_by(desc(User.created_at))
+            if limit:
+                query = query.limit(limit)
+            return [row[0] for row in query.all()]
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error getting user IDs: {e}")
+            raise
+
+    def bulk_register_users(self, users: List[Dict[str, Any]]) -> int:
+        """
+        Insert new users in one statement, skipping ids that already exist.
+        Returns the number of rows actually inserted.
+        """
+        if not users:
+            return 0
+
+        try:
+            if self.db_session.bind.dialect.name == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+
+            rows = [
+                {
+                    "user_id": user["user_id"],
+                    "username": user.get("username"),
+                    "created_at": user.get("created_at") or datetime.now(),
+                    "tnt_plan_type": 'FREE',
+                    "is_active": False,
+                }
+                for user in users
+            ]
+            stmt = insert(User).values(rows).on_conflict_do_nothing(index_elements=['user_id'])
+            result = self.db_session.execute(stmt)
+            self.db_session.commit()
+            return max(result.rowcount or 0, 0)
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error in bulk_register_users: {e}")
+            raise
+
+class BroadcastRepository:
+    """Repository for persisted broadcast jobs and recipient paging"""
+
+    def __init__(self, db_session: Session):
+        self.db_session = db_session
+
+    def create_job(self, message: str, admin_chat_id: int) -> BroadcastJob:
+        """Create a new broadcast job"""
+        try:
+            job = BroadcastJob(
+                message=message,
+                admin_chat_id=admin_chat_id,
+                status='pending',
+                last_user_id=0
+            )
+            self.db_session.add(job)
+            self.db_session.commit()
+            return job
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error creating broadcast job: {e}")
+            raise
+
+    def get_job(self, job_id: int) -> Optional[BroadcastJob]:
+        return self.db_session.query(BroadcastJob).filter_by(id=job_id).first()
+
+    def get_unfinished_jobs(self) -> List[BroadcastJob]:
+        """Jobs interrupted by a restart (pending or running)"""
+        return self.db_session.query(BroadcastJob).filter(
+            BroadcastJob.status.in_(['pending', 'running'])
+        ).order_by(BroadcastJob.id).all()
+
+    @staticmethod
+    def active_user_ids_page_query(after_user_id: int, page_size: int):
+        """Keyset page over the partial index idx_users_active_id"""
+        return select(User.user_id).where(
+            User.is_active == True,
+            User.user_id > after_user_id
+        ).order_by(User.user_id).limit(page_size)
+
+    def get_active_user_ids_page(self, after_user_id: int, page_size: int) -> List[int]:
+        """
+        Next page of active user ids using keyset pagination on the primary key.
+        Each page is a short, index-ordered query, so no transaction stays open
+        while messages are being sent and after_user_id doubles as the resume point.
+        """
+        try:
+            return list(self.db_session.execute(
+                self.active_user_ids_page_query(after_user_id, page_size)
+            ).scalars())
+
+        except SQLAlchemyError as e:
+            logger.error(f"Error paging active user IDs: {e}")
+            raise
+
+    def save_progress(self, job_id: int, **fields) -> None:
+        """Persist checkpoint/counters of a job"""
+        try:
+            self.db_session.query(BroadcastJob).filter_by(id=job_id).update(
+                {**fields, BroadcastJob.updated_at: datetime.now()},
+                synchronize_session=False
+            )
+            self.db_session.commit()
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error saving broadcast progress for job {job_id}: {e}")
+            raise
+
 class TntRepository:
     """Repository for TNT-related operations for users."""
 
     def __init__(self, db_session: Session):
         self.db_session = db_session
 
+    def get_user_profile(self, user_id: int) -> Optional[dict]:
+        """
+        Returns the cached plan/profile fields of a user.
+        Falls back to the users table on a cache miss and populates the cache.
+        """
+        profile = user_profile_cache.get(user_id)
+        if profile is not None:
+            return profile
+
+        user = self.db_session.query(User).filter_by(user_id=user_id).first()
+        if not user:
+            return None
+
+        profile = {
+            "user_id": user.user_id,
+            "username": user.username,
+            "is_active": bool(user.is_active),
+            "tnt_plan_type": user.tnt_plan_type,
+            "tnt_monthly_limit": user.tnt_monthly_limit or 0,
+            "tnt_hourly_limit": user.tnt_hourly_limit or 0,
+            "tnt_plan_start": user.tnt_plan_start,
+            "tnt_plan_end": user.tnt_plan_end,
+        }
+        user_profile_cache.set(user_id, profile)
+        return profile
+
     def check_analysis_limit(self, user_id: int) -> dict:
         """
         Checks if a user has reached their daily TNT analysis limit.
         Returns dict with allowed status and details
         """
         try:
-            user = self.db_session.query(User).filter_by(user_id=user_id).first()
-            if not user or not user.tnt_plan_type or user.tnt_plan_type == 'FREE':
+            profile = self.get_user_profile(user_id)
+            if not profile or not profile["tnt_plan_type"] or profile["tnt_plan_type"] == 'FREE':
                 return {
                     "allowed": False,
                     "reason": "plan_required",
                     "message": "برای استفاده از تحلیل TNT نیاز به اشتراک دارید"
                 }
+            hourly_limit = profile["tnt_hourly_limit"]
+            monthly_limit = profile["tnt_monthly_limit"]
             
             # بررسی انقضای پلن
-            if user.tnt_plan_end and datetime.now() > user.tnt_plan_end:
+            if profile["tnt_plan_end"] and datetime.now() > profile["tnt_plan_end"]:
                 return {
                     "allowed": False,
                     "reason": "plan_expired",
@@ -455,47 +760,37 @@ class TntRepository:
             current_hour = now.hour
             
             # محاسبه استفاده ساعتی (ساعت جاری)
-            hourly_usage = self.db_session.query(TntUsageTracking).filter_by(
-                user_id=user_id,
-                usage_date=today,
-                usage_hour=current_hour
-            ).first()
-            
-            current_hour_count = hourly_usage.analysis_count if hourly_usage else 0
+            current_hour_count = self.db_session.execute(
+                self.hourly_usage_query(user_id, today, current_hour)
+            ).scalar() or 0
             
             # محاسبه استفاده ماهانه (30 روز گذشته)
-            month_ago = today - timedelta(days=30)
-            monthly_usage = self.db_session.query(
-                func.sum(TntUsageTracking.analysis_count)
-            ).filter(
-                TntUsageTracking.user_id == user_id,
-                TntUsageTracking.usage_date >= month_ago
-            ).scalar() or 0
+            monthly_usage = self.get_usage_since(user_id, today - timedelta(days=30))
             
             # بررسی محدودیت‌ها
-            if current_hour_count >= user.tnt_hourly_limit:
+            if current_hour_count >= hourly_limit:
                 return {
                     "allowed": False,
                     "reason": "hourly_limit",
                     "message": "سقف ساعتی به پایان رسیده است",
                     "usage": current_hour_count,
-                    "limit": user.tnt_hourly_limit
+                    "limit": hourly_limit
                 }
             
-            if monthly_usage >= user.tnt_monthly_limit:
+            if monthly_usage >= monthly_limit:
                 return {
                     "allowed": False,
                     "reason": "monthly_limit", 
                     "message": "سقف ماهانه به پایان رسیده است",
                     "usage": monthly_usage,
-                    "limit": user.tnt_monthly_limit
+                    "limit": monthly_limit
                 }
             
             # اجازه داده شد
             return {
                 "allowed": True,
-                "remaining_monthly": max(0, user.tnt_monthly_limit - monthly_usage),
-                "remaining_hourly": max(0, user.tnt_hourly_limit - current_hour_count)
+                "remaining_monthly": max(0, monthly_limit - monthly_usage),
+                "remaining_hourly": max(0, hourly_limit - current_hour_count)
             }
             
         except Exception as e:
@@ -506,6 +801,39 @@ class TntRepository:
                 "message": "خطا در بررسی محدودیت"
             }
 
+    # Hot-path queries are built by these helpers so database/query_plans.py
+    # can EXPLAIN exactly what runs in production
+    @staticmethod
+    def hourly_usage_query(user_id: int, usage_date: date, usage_hour: int):
+        """Analyses in one hour; index-only on uq_usage_tracking_user_hour"""
+        return select(TntUsageTracking.analysis_count).where(
+            TntUsageTracking.user_id == user_id,
+            TntUsageTracking.usage_date == usage_date,
+            TntUsageTracking.usage_hour == usage_hour
+        )
+
+    @staticmethod
+    def usage_since_query(user_id: int, since: Optional[date] = None):
+        """Hourly plus compacted daily analyses since a date, in one statement"""
+        hourly = select(func.coalesce(func.sum(TntUsageTracking.analysis_count), 0)).where(
+            TntUsageTracking.user_id == user_id
+        )
+        daily = select(func.coalesce(func.sum(TntUsageDaily.analysis_count), 0)).where(
+            TntUsageDaily.user_id == user_id
+        )
+        if since is not None:
+            hourly = hourly.where(TntUsageTracking.usage_date >= since)
+            daily = daily.where(TntUsageDaily.usage_date >= since)
+        return select(hourly.scalar_subquery() + daily.scalar_subquery())
+
+    def get_usage_since(self, user_id: int, since: Optional[date] = None) -> int:
+        """
+        Total analyses since a date (all time when since is None).
+        Hourly rows older than a few days are compacted into tnt_usage_daily,
+        so both tables are summed in one query.
+        """
+        return int(self.db_session.execute(self.usage_since_query(user_id, since)).scalar() or 0)
+
     def record_analysis_usage(self, user_id: int):
         """
         Records or updates an analysis usage record in the TntUsageTracking table.
@@ -551,24 +879,24 @@ class TntRepository:
     def get_user_plan(self, user_id: int) -> dict:
         """دریافت اطلاعات پلن فعال کاربر"""
         try:
-            user = self.db_session.query(User).filter_by(user_id=user_id).first()
-            if not user:
+            profile = self.get_user_profile(user_id)
+            if not profile:
                 return {"plan_active": False, "plan_type": "FREE"}
             
             # بررسی وضعیت پلن TNT
             plan_active = False
-            if user.tnt_plan_type and user.tnt_plan_type != 'FREE':
-                if user.tnt_plan_end:
-                    plan_active = datetime.now() <= user.tnt_plan_end
+            if profile["tnt_plan_type"] and profile["tnt_plan_type"] != 'FREE':
+                if profile["tnt_plan_end"]:
+                    plan_active = datetime.now() <= profile["tnt_plan_end"]
                 else:
                     plan_active = True  # پلن دائمی
             
             return {
                 "plan_active": plan_active,
-                "plan_type": user.tnt_plan_type or "FREE",
-                "plan_end": user.tnt_plan_end,
-                "monthly_limit": user.tnt_monthly_limit or 0,
-                "hourly_limit": user.tnt_hourly_limit or 0
+                "plan_type": profile["tnt_plan_type"] or "FREE",
+                "plan_end": profile["tnt_plan_end"],
+                "monthly_limit": profile["tnt_monthly_limit"],
+                "hourly_limit": profile["tnt_hourly_limit"]
             }
             
         except Exception as e:
@@ -582,10 +910,8 @@ class TntRepository:
             if not user:
                 return {"success": False, "error": "کاربر یافت نشد"}
             
-            # دریافت اطلاعات پلن از جدول TntPlan
-            plan = self.db_session.query(TntPlan).filter_by(
-                plan_name=plan_name, is_active=True
-            ).first()
+            # اطلاعات پلن از کاتالوگ در حافظه
+            plan = plan_catalog.get_plan(plan_name)
             
             if not plan:
                 return {"success": False, "error": "پلن یافت نشد"}
@@ -598,6 +924,7 @@ class TntRepository:
             user.tnt_plan_end = datetime.now() + timedelta(days=duration_days)
             
             self.db_session.commit()
+            user_profile_cache.invalidate(user_id)
             
             return {
                 "success": True,
@@ -609,3 +936,150 @@ class TntRepository:
             self.db_session.rollback()
             logger.error(f"Error in activate_tnt_subscription: {e}")
             return {"success": False, "error": str(e)}
+
+    # Rows per UPDATE ... FROM (VALUES ...) statement (5 bind parameters per row)
+    BULK_CHUNK_SIZE = 1000
+
+    def bulk_activate_subscriptions(self, entries: List[tuple], with_commission: bool = True) -> dict:
+        """
+        فعال‌سازی گروهی اشتراک TNT در یک تراکنش
+
+        entries: لیست (user_id, plan_name, duration_days). پلن‌ها از کاتالوگ در
+        حافظه خوانده می‌شوند، کاربران در هر chunk با یک UPDATE ... FROM (VALUES ...) به‌روز
+        می‌شوند و کمیسیون‌های رفرال با یک INSERT چندردیفی ثبت می‌شوند.
+        در صورت خطا هیچ تغییری اعمال نمی‌شود.
+        """
+        # آخرین ردیف هر کاربر معتبر است
+        requested = {}
+        for user_id, plan_name, duration_days in entries:
+            requested[int(user_id)] = (plan_name.upper(), int(duration_days))
+
+        result = {
+            "success": True, "activated": [], "not_found": [], "invalid_plan": [],
+            "commissions": 0, "commission_total": 0.0
+        }
+        if not requested:
+            return result
+
+        try:
+            now = datetime.now()
+            rows = []
+            for user_id, (plan_name, duration_days) in requested.items():
+                plan = plan_catalog.get_plan(plan_name)
+                if plan is None:
+                    result["invalid_plan"].append(user_id)
+                    continue
+                rows.append({
+                    "user_id": user_id,
+                    "tnt_plan_type": plan_name,
+                    "tnt_monthly_limit": plan.monthly_limit,
+                    "tnt_hourly_limit": plan.hourly_limit,
+                    "tnt_plan_end": now + timedelta(days=duration_days),
+                    "duration_days": duration_days
+                })
+
+            for start in range(0, len(rows), self.BULK_CHUNK_SIZE):
+                chunk = rows[start:start + self.BULK_CHUNK_SIZE]
+                updated = set(self._bulk_update_plans(chunk, now))
+
+                activated = [row for row in chunk if row["user_id"] in updated]
+                result["not_found"].extend(row["user_id"] for row in chunk if row["user_id"] not in updated)
+                result["activated"].extend(
+                    {"user_id": row["user_id"], "plan_name": row["tnt_plan_type"], "end_date": row["tnt_plan_end"]}
+                    for row in activated
+                )
+
+                if with_commission and activated:
+                    count, total = self._bulk_insert_commissions(activated)
+                    result["commissions"] += count
+                    result["commission_total"] += total
+
+            self.db_session.commit()
+
+        except Exception as e:
+            self.db_session.rollback()
+            logger.error(f"Error in bulk_activate_subscriptions: {e}")
+            return {"success": False, "error": str(e)}
+
+        for item in result["activated"]:
+            user_profile_cache.invalidate(item["user_id"])
+
+        logger.info(
+            f"✅ Bulk TNT activation: {len(result['activated'])} activated, "
+            f"{len(result['not_found'])} not found, {len(result['invalid_plan'])} invalid plan, "
+            f"{result['commissions']} commissions"
+        )
+        return result
+
+    def _bulk_update_plans(self, rows: List[dict], plan_start: datetime) -> List[int]:
+        """به‌روزرسانی پلن یک chunk از کاربران؛ شناسه کاربران به‌روز شده را برمی‌گرداند"""
+        if self.db_session.get_bind().dialect.name == 'postgresql':
+            data = values(
+                column('user_id', BigInteger),
+                column('tnt_plan_type', String),
+                column('tnt_monthly_limit', Integer),
+                column('tnt_hourly_limit', Integer),
+                column('tnt_plan_end', DateTime),
+                name='v'
+            ).data([
+                (row["user_id"], row["tnt_plan_type"], row["tnt_monthly_limit"],
+                 row["tnt_hourly_limit"], row["tnt_plan_end"])
+                for row in rows
+            ])
+            return list(self.db_session.execute(
+                update(User).where(User.user_id == data.c.user_id).values(
+                    tnt_plan_type=data.c.tnt_plan_type,
+                    tnt_monthly_limit=data.c.tnt_monthly_limit,
+                    tnt_hourly_limit=data.c.tnt_hourly_limit,
+                    tnt_plan_start=plan_start,
+                    tnt_plan_end=data.c.tnt_plan_end,
+                    is_active=True
+                ).returning(User.user_id),
+                execution_options={"synchronize_session": False}
+            ).scalars())
+
+        # SQLite: VALUES با نام ستون در FROM پشتیبانی نمی‌شود؛ bulk UPDATE بر اساس کلید اصلی
+        existing = list(self.db_session.execute(
+            select(User.user_id).where(User.user_id.in_([row["user_id"] for row in rows]))
+        ).scalars())
+        existing_set = set(existing)
+        if existing:
+            self.db_session.execute(update(User), [
+                {
+                    "user_id": row["user_id"],
+                    "tnt_plan_type": row["tnt_plan_type"],
+                    "tnt_monthly_limit": row["tnt_monthly_limit"],
+                    "tnt_hourly_limit": row["tnt_hourly_limit"],
+                    "tnt_plan_start": plan_start,
+                    "tnt_plan_end": row["tnt_plan_end"],
+                    "is_active": True
+                }
+                for row in rows if row["user_id"] in existing_set
+            ])
+        return existing
+
+    def _bulk_insert_commissions(self, rows: List[dict]) -> tuple:
+        """ثبت کمیسیون رفرال برای کاربرانی که معرف دارند؛ (تعداد، مجموع مبلغ)"""
+        referrers = dict(self.db_session.execute(
+            select(Referral.referred_id, Referral.referrer_id).where(
+                Referral.referred_id.in_([row["user_id"] for row in rows])
+            )
+        ).all())
+
+        commissions = []
+        for row in rows:
+            referrer_id = referrers.get(row["user_id"])
+            if referrer_id is None:
+                continue
+            amounts = plan_catalog.compute_commission(row["tnt_plan_type"], row["duration_days"])
+            commissions.append({
+                "referrer_id": referrer_id,
+                "referred_id": row["user_id"],
+                "plan_type": row["tnt_plan_type"],
+                "status": "pending",
+                **amounts
+            })
+
+        if commissions:
+            self.db_session.execute(insert(Commission), commissions)
+        return len(commissions), float(sum(c["total_amount"] for c in commissions))
@@ -0,0 +1,388 @@
+"""
+Retention and partitioning for the append-only usage tables
+
+- tnt_usage_tracking: hourly rows older than USAGE_COMPACT_AFTER_DAYS are
+  folded into tnt_usage_daily; daily summaries expire after
+  USAGE_DAILY_RETENTION_DAYS.
+- api_requests: rows expire after API_REQUESTS_RETENTION_DAYS.
+
+On PostgreSQL both tables can be converted (once, by an admin) to tables
+partitioned by month. Expired data is then removed by dropping whole
+partitions instead of deleting rows. The pre-existing table is kept as the
+DEFAULT partition and is drained with batched deletes as its rows expire.
+
+On SQLite (or an unpartitioned PostgreSQL table), old api_requests rows are
+moved to api_requests_archive so the hot table and its indexes stay small.
+"""
+import logging
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from config.settings import (
+    API_REQUESTS_HOT_DAYS, API_REQUESTS_RETENTION_DAYS, CLEANUP_BATCH_SIZE,
+    RETENTION_PARTITION_MONTHS_AHEAD, USAGE_COMPACT_AFTER_DAYS, USAGE_DAILY_RETENTION_DAYS
+)
+from .models import ApiRequest, ApiRequestArchive, TntUsageDaily, TntUsageTracking
+from .repository import AdminRepository
+
+logger = logging.getLogger(__name__)
+
+# table -> partition key column and the indexes the partitioned parent needs
+# as (name, unique, columns, include). They mirror the model indexes but are
+# named differently because index names are schema-wide and the legacy table
+# keeps its own; attaching the legacy table reuses its matching indexes.
+PARTITIONED_TABLES = {
+    'tnt_usage_tracking': {
+        'key': 'usage_date',
+        'indexes': [
+            ('tnt_usage_tracking_p_user_hour', True, 'user_id, usage_date, usage_hour', 'analysis_count'),
+        ],
+    },
+    'api_requests': {
+        'key': 'request_date',
+        'indexes': [
+            ('api_requests_p_user_date', False, 'user_id, request_date', None),
+        ],
+    },
+}
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.year * 12 + day.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+class RetentionManager:
+    """Runs compaction, partition maintenance and expiry on one session"""
+
+    def __init__(self, db_session: Session, batch_size: int = CLEANUP_BATCH_SIZE):
+        self.db_session = db_session
+        self.batch_size = batch_size
+        self.dialect = db_session.bind.dialect.name
+
+    # === PARTITION INSPECTION (PostgreSQL) ===
+    def is_partitioned(self, table_name: str) -> bool:
+        if self.dialect != 'postgresql':
+            return False
+        relkind = self.db_session.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": table_name}
+        ).scalar()
+        return relkind == 'p'
+
+    def list_partitions(self, table_name: str) -> List[Tuple[str, date, date]]:
+        """Monthly partitions of a table as (name, lower bound, upper bound)"""
+        rows = self.db_session.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:name)"
+            ),
+            {"name": table_name}
+        ).scalars().all()
+
+        partitions = []
+        for name in rows:
+            match = PARTITION_NAME_RE.search(name)
+            if not match:
+                continue  # the DEFAULT (legacy) partition
+            lower = date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((name, lower, add_months(lower, 1)))
+        return sorted(partitions, key=lambda p: p[1])
+
+    # === PARTITION MANAGEMENT (PostgreSQL) ===
+    def convert_to_partitioned(self, table_name: str) -> bool:
+        """
+        Turn an existing table into a table partitioned by month.
+
+        The existing table is renamed to <table>_legacy and attached as the
+        DEFAULT partition, so no rows are copied. Monthly partitions start
+        from next month; rows of the current month keep landing in the
+        legacy partition until it rolls over.
+
+        Everything that scans the table runs before the ACCESS EXCLUSIVE lock:
+        the CHECK constraints are added NOT VALID and validated separately
+        (writes continue), and the unique index backing the new primary key
+        (id, partition key) is built concurrently. Inside the lock the
+        indexes are created ON ONLY the parent and the legacy table's
+        matching indexes are attached, so nothing is built or scanned there.
+        Run it well before the end of the month: the range CHECK rejects
+        rows of the next month.
+        """
+        if self.dialect != 'postgresql':
+            raise ValueError("Partitioning is only supported on PostgreSQL")
+        if table_name not in PARTITIONED_TABLES:
+            raise ValueError(f"No partition spec for {table_name}")
+        if self.is_partitioned(table_name):
+            return False
+
+        spec = PARTITIONED_TABLES[table_name]
+        key = spec['key']
+        legacy = f"{table_name}_legacy"
+        id_key_index = f"{legacy}_id_key"
+        first_partition = add_months(month_start(date.today()), 1)
+
+        try:
+            sequence = self.db_session.execute(
+                text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": table_name}
+            ).scalar()
+
+            # the partition key is part of the primary key, so it must be NOT NULL
+            self.db_session.execute(text(
+                f"UPDATE {table_name} SET {key} = COALESCE(created_at::date, CURRENT_DATE) WHERE {key} IS NULL"
+            ))
+            checks = {
+                f"{legacy}_key_not_null": f"{key} IS NOT NULL",
+                # lets PostgreSQL skip scanning the default partition when
+                # attaching monthly partitions
+                f"{legacy}_range": f"{key} < DATE '{first_partition.isoformat()}'",
+            }
+            for name, condition in checks.items():
+                self.db_session.execute(text(f"ALTER TABLE {table_name} DROP CONSTRAINT IF EXISTS {name}"))
+                self.db_session.execute(text(
+                    f"ALTER TABLE {table_name} ADD CONSTRAINT {name} CHECK ({condition}) NOT VALID"
+                ))
+            self.db_session.commit()
+            for name in checks:
+                self.db_session.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {name}"))
+                self.db_session.commit()
+
+            with self.db_session.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                # a leftover (possibly invalid) index from an interrupted run is rebuilt
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {id_key_index}"))
+                conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {id_key_index} ON {table_name} (id, {key})"))
+
+            statements = [
+                f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE",
+                # no scan: the validated CHECK already proves it
+                f"ALTER TABLE {table_name} ALTER COLUMN {key} SET NOT NULL",
+                f"ALTER TABLE {table_name} DROP CONSTRAINT {legacy}_key_not_null",
+                # ATTACH PARTITION needs a constraint-backed index for the parent primary key
+                f"ALTER TABLE {table_name} ADD CONSTRAINT {id_key_index} UNIQUE USING INDEX {id_key_index}",
+                f"ALTER TABLE {table_name} RENAME TO {legacy}",
+                f"CREATE TABLE {table_name} (LIKE {legacy} INCLUDING DEFAULTS) "
+                f"PARTITION BY RANGE ({key})",
+                f"ALTER TABLE ONLY {table_name} ADD CONSTRAINT {table_name}_p_pkey PRIMARY KEY (id, {key})",
+            ]
+            if sequence:
+                # keep the id sequence alive when the legacy partition is dropped later
+                statements.append(f"ALTER SEQUENCE {sequence} OWNED BY {table_name}.id")
+            for name, unique, columns, include in spec['indexes']:
+                statements.append(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX {name} ON ONLY {table_name} ({columns})"
+                    + (f" INCLUDE ({include})" if include else "")
+                )
+            statements += [
+                f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_p_user_fk "
+                f"FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE",
+                # attaches the legacy indexes that match the parent's and marks them valid
+                f"ALTER TABLE {table_name} ATTACH PARTITION {legacy} DEFAULT",
+            ]
+            for statement in statements:
+                self.db_session.execute(text(statement))
+
+            self._create_partitions(table_name, first_partition, RETENTION_PARTITION_MONTHS_AHEAD)
+            self.db_session.commit()
+            logger.info(f"✅ {table_name} converted to monthly partitions")
+            return True
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error partitioning {table_name}: {e}")
+            raise
+
+    def ensure_partitions(self, table_name: str, months_ahead: int = RETENTION_PARTITION_MONTHS_AHEAD) -> int:
+        """Create the monthly partitions for the coming months"""
+        if not self.is_partitioned(table_name):
+            return 0
+        created = self._create_partitions(
+            table_name, add_months(month_start(date.today()), 1), months_ahead
+        )
+        self.db_session.commit()
+        return created
+
+    def _create_partitions(self, table_name: str, first_month: date, count: int) -> int:
+        existing = {name for name, _, _ in self.list_partitions(table_name)}
+        created = 0
+        for i in range(count):
+            lower = add_months(first_month, i)
+            name = f"{table_name}_p{lower.year:04d}{lower.month:02d}"
+            if name in existing:
+                continue
+            self.db_session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table_name} "
+                f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{add_months(lower, 1).isoformat()}')"
+            ))
+            created += 1
+        return created
+
+    def _drop_partition(self, table_name: str, partition_name: str):
+        self.db_session.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {partition_name}"))
+        self.db_session.execute(text(f"DROP TABLE {partition_name}"))
+
+    def drop_expired_partitions(self, table_name: str, cutoff: date) -> List[str]:
+        """Drop monthly partitions that only contain rows older than cutoff"""
+        if not self.is_partitioned(table_name):
+            return []
+        dropped = []
+        for name, _, upper in self.list_partitions(table_name):
+            if upper <= cutoff:
+                self._drop_partition(table_name, name)
+                self.db_session.commit()
+                dropped.append(name)
+                logger.info(f"🗑️ Dropped expired partition {name}")
+        return dropped
+
+    # === USAGE COMPACTION ===
+    def _upsert_daily(self, source_filter):
+        """Fold hourly rows matching source_filter into tnt_usage_daily"""
+        insert = pg_insert if self.dialect == 'postgresql' else sqlite_insert
+        aggregated = select(
+            TntUsageTracking.user_id,
+            TntUsageTracking.usage_date,
+            func.sum(TntUsageTracking.analysis_count)
+        ).where(source_filter).group_by(TntUsageTracking.user_id, TntUsageTracking.usage_date)
+
+        statement = insert(TntUsageDaily).from_select(
+            ['user_id', 'usage_date', 'analysis_count'], aggregated
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['user_id', 'usage_date'],
+            set_={'analysis_count': TntUsageDaily.analysis_count + statement.excluded.analysis_count}
+        )
+        self.db_session.execute(statement)
+
+    def compact_usage(self, cutoff: date) -> Dict[str, Any]:
+        """
+        Replace hourly usage rows older than cutoff with daily summaries.
+        Whole monthly partitions are summarised and dropped; remaining rows are
+        processed one day per transaction.
+        """
+        result = {"days": 0, "partitions_dropped": []}
+        try:
+            if self.is_partitioned('tnt_usage_tracking'):
+                for name, lower, upper in self.list_partitions('tnt_usage_tracking'):
+                    if upper > cutoff:
+                        continue
+                    self._upsert_daily(and_(
+                        TntUsageTracking.usage_date >= lower,
+                        TntUsageTracking.usage_date < upper
+                    ))
+                    self._drop_partition('tnt_usage_tracking', name)
+                    self.db_session.commit()
+                    result["partitions_dropped"].append(name)
+
+            while True:
+                day = self.db_session.query(func.min(TntUsageTracking.usage_date)).filter(
+                    TntUsageTracking.usage_date < cutoff
+                ).scalar()
+                if day is None:
+                    break
+                day_filter = TntUsageTracking.usage_date == day
+                self._upsert_daily(day_filter)
+                self.db_session.query(TntUsageTracking).filter(day_filter).delete(
+                    synchronize_session=False
+                )
+                self.db_session.commit()
+                result["days"] += 1
+
+            return result
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error compacting usage rows: {e}")
+            raise
+
+    # === API REQUESTS ===
+    def archive_api_requests(self, cutoff: date) -> int:
+        """Move api_requests rows older than cutoff to api_requests_archive in batches"""
+        moved = 0
+        columns = ['id', 'user_id', 'endpoint', 'request_date', 'created_at']
+        try:
+            while True:
+                boundary = self.db_session.query(ApiRequest.id).filter(
+                    ApiRequest.request_date < cutoff
+                ).order_by(ApiRequest.id).offset(self.batch_size - 1).limit(1).scalar()
+
+                batch_filter = [ApiRequest.request_date < cutoff]
+                if boundary is not None:
+                    batch_filter.append(ApiRequest.id <= boundary)
+
+                self.db_session.execute(
+                    ApiRequestArchive.__table__.insert().from_select(
+                        columns,
+                        select(*(getattr(ApiRequest, c) for c in columns)).where(*batch_filter)
+                    )
+                )
+                deleted = self.db_session.query(ApiRequest).filter(*batch_filter).delete(
+                    synchronize_session=False
+                )
+                self.db_session.commit()
+                moved += deleted
+                if boundary is None or deleted == 0:
+                    break
+            return moved
+
+        except SQLAlchemyError as e:
+            self.db_session.rollback()
+            logger.error(f"Error archiving api_requests: {e}")
+            raise
+
+    # === ENTRY POINT ===
+    def run(self, today: Optional[date] = None) -> Dict[str, Any]:
+        """One full retention pass; returns a report per table"""
+        today = today or date.today()
+        admin_repo = AdminRepository(self.db_session)
+        report: Dict[str, Any] = {}
+
+        for table_name in PARTITIONED_TABLES:
+            created = self.ensure_partitions(table_name)
+            if created:
+                report.setdefault("partitions_created", {})[table_name] = created
+
+        # tnt_usage_tracking -> tnt_usage_daily
+        report["tnt_usage_tracking"] = self.compact_usage(
+            today - timedelta(days=USAGE_COMPACT_AFTER_DAYS)
+        )
+        daily_cutoff = today - timedelta(days=USAGE_DAILY_RETENTION_DAYS)
+        report["tnt_usage_daily"] = {
+            "deleted": admin_repo.delete_in_batches(
+                TntUsageDaily, self.batch_size, where=TntUsageDaily.usage_date < daily_cutoff
+            )
+        }
+
+        # api_requests
+        expiry_cutoff = today - timedelta(days=API_REQUESTS_RETENTION_DAYS)
+        if self.is_partitioned('api_requests'):
+            dropped = self.drop_expired_partitions('api_requests', expiry_cutoff)
+            # the DEFAULT (legacy) partition drains row by row
+            deleted = admin_repo.delete_in_batches(
+                ApiRequest, self.batch_size, where=ApiRequest.request_date < expiry_cutoff
+            )
+            report["api_requests"] = {"partitions_dropped": dropped, "deleted": deleted}
+        else:
+            report["api_requests"] = {
+                "archived": self.archive_api_requests(today - timedelta(days=API_REQUESTS_HOT_DAYS)),
+            }
+            report["api_requests_archive"] = {
+                "deleted": admin_repo.delete_in_batches(
+                    ApiRequestArchive, self.batch_size,
+                    where=ApiRequestArchive.request_date < expiry_cutoff
+                )
+            }
+
+        logger.info(f"🧹 Retention pass finished: {report}")
+        return report
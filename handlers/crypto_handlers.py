@@ -1,10 +1,10 @@
 import random
 import asyncio
-import os
 from .ui_helpers import enhanced_back_navigation, main_menu_button
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
+from config.settings import STREAM_AI_RESPONSES
 from config.constants import (
     MAIN_MENU, CRYPTO_MENU, DEX_MENU, COIN_MENU, DEX_SUBMENU, COIN_SUBMENU,
     TRADE_COACH_AWAITING_INPUT  # <-- اضافه شده
@@ -12,15 +12,18 @@ from config.constants import (
 from database import db_manager
 from database.repository import AdminRepository, TntRepository
 from services import ai_service  # <-- اضافه شده
+from services.coach_memory_service import coach_memory
 from services.coinstats_service import coinstats_service
 from services.direct_api_service import direct_api_service
+from services.executor_service import executor_service
 from services.holderscan_service import holderscan_service
 from utils.crypto_formatter import (
     format_market_overview, format_error_message,
     format_token_info, format_trending_tokens, format_holders_info
 )
 from utils.helpers import format_token_price
-from utils.media_handler import download_photo  # <-- اضافه شده
+from utils.media_handler import download_photo_bytes
+from utils.telegram_stream import TelegramStreamWriter, queue_status_callback
 import logging
 logger = logging.getLogger(__name__)
 
@@ -1614,6 +1617,10 @@ async def trade_coach_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     """شروع مربی ترید با UI یکپارچه"""
     from .ui_helpers import main_menu_only, STANDARD_MESSAGES
     
+    # ورود دوباره از منو گفتگوی جدید است؛ «سوال جدید» ادامه همان گفتگو
+    if not (update.callback_query and update.callback_query.data == "continue_coach"):
+        await executor_service.run_io(coach_memory.clear, update.effective_user.id)
+
     message_text = (
         "🧠 **مربی هوش مصنوعی ترید نارموون** در خدمت شماست!\n\n"
         "از مدیریت سرمایه و کنترل ریسک تا روانشناسی بازار و استراتژی‌های حرفه‌ای، "
@@ -1645,26 +1652,48 @@ async def trade_coach_prompt_handler(update: Update, context: ContextTypes.DEFAU
     
     processing_message = await update.message.reply_text(STANDARD_MESSAGES["PROCESSING"])
     
-    photo_path = None  # مقداردهی اولیه مسیر عکس
+    photo_bytes = None
     try:
-        # بررسی وجود عکس و دانلود آن
+        writer = None
+        # بررسی وجود عکس و دانلود آن در حافظه
         photo_file_id = update.message.photo[-1].file_id if update.message.photo else None
         if photo_file_id:
-            photo_path = await download_photo(photo_file_id, context)
+            photo_bytes = await download_photo_bytes(photo_file_id, context)
+
+        # در حالت stream پاسخ به تدریج در همان پیام "در حال پردازش" نوشته می‌شود
+        if STREAM_AI_RESPONSES:
+            writer = TelegramStreamWriter(
+                context.bot, update.effective_chat.id,
+                message_id=processing_message.message_id, parse_mode=None
+            )
 
         # دریافت پاسخ از سرویس هوش مصنوعی
-        result = await ai_service.get_trade_coach_response(user_id=user_id, text_prompt=prompt_text, photo_path=photo_path)
-        
-        # حذف پیام "در حال پردازش"
-        await context.bot.delete_message(
-            chat_id=update.effective_chat.id, 
-            message_id=processing_message.message_id
+        result = await ai_service.get_trade_coach_response(
+            user_id=user_id, text_prompt=prompt_text,
+            image=memoryview(photo_bytes) if photo_bytes else None,
+            on_delta=writer.append if writer else None,
+            on_queue=queue_status_callback(processing_message, STANDARD_MESSAGES["PROCESSING"])
         )
         
-        if result.get("success"):
-            await update.message.reply_text(result["response"])
+        if writer:
+            if result.get("success"):
+                await writer.finish(result["response"])
+            elif writer.started:
+                # بخشی از پاسخ نمایش داده شده؛ خطا به انتهای آن اضافه می‌شود
+                await writer.finish(f"{writer.text}\n\n{STANDARD_MESSAGES['ERROR']}")
+            else:
+                await writer.finish(STANDARD_MESSAGES["ERROR"])
         else:
-            await update.message.reply_text(STANDARD_MESSAGES["ERROR"])
+            # حذف پیام "در حال پردازش"
+            await context.bot.delete_message(
+                chat_id=update.effective_chat.id, 
+                message_id=processing_message.message_id
+            )
+            
+            if result.get("success"):
+                await update.message.reply_text(result["response"])
+            else:
+                await update.message.reply_text(STANDARD_MESSAGES["ERROR"])
         
         # ✅ ارسال دکمه‌های ادامه در پیام جداگانه
         await update.message.reply_text(
@@ -1676,19 +1705,18 @@ async def trade_coach_prompt_handler(update: Update, context: ContextTypes.DEFAU
         )
         
     except Exception as e:
-        await context.bot.delete_message(
-            chat_id=update.effective_chat.id, 
-            message_id=processing_message.message_id
-        )
-        await update.message.reply_text(
-            STANDARD_MESSAGES["ERROR"],
-            reply_markup=main_menu_only()
-        )
-    
-    finally:
-        # این بلوک همیشه اجرا می‌شود و فایل موقت را پاک می‌کند
-        if photo_path and os.path.exists(photo_path):
-            os.remove(photo_path)
-            print(f"🧹 Cleaned up temporary file: {photo_path}")
+        if writer and writer.started:
+            # پاسخ نیمه‌کاره حذف نمی‌شود؛ خطا به انتهای آن اضافه می‌شود
+            await writer.finish(f"{writer.text}\n\n{STANDARD_MESSAGES['ERROR']}")
+            await update.message.reply_text("🏠", reply_markup=main_menu_only())
+        else:
+            await context.bot.delete_message(
+                chat_id=update.effective_chat.id, 
+                message_id=processing_message.message_id
+            )
+            await update.message.reply_text(
+                STANDARD_MESSAGES["ERROR"],
+                reply_markup=main_menu_only()
+            )
     
     return TRADE_COACH_AWAITING_INPUT
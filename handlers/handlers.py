@@ -1,10 +1,8 @@
 import random
 import logging
-import os
 import asyncio
-import tempfile
 from services.ai_service import generate_tnt_analaysis
-from utils.media_handler import download_photo
+from utils.telegram_stream import TelegramStreamWriter, queue_status_callback
 import re
 from datetime import datetime
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
@@ -17,7 +15,7 @@ from telegram.ext import (
 )
 
 from config import constants as c
-from config.settings import SOLANA_WALLETS, TUTORIAL_VIDEO_LINK
+from config.settings import SOLANA_WALLETS, TUTORIAL_VIDEO_LINK, STREAM_AI_RESPONSES
 from config.constants import (
     MAIN_MENU, SELECTING_MARKET, SELECTING_ANALYSIS_TYPE, SELECTING_TIMEFRAME,
     SELECTING_STRATEGY, WAITING_IMAGES, PROCESSING_ANALYSIS,
@@ -31,10 +29,13 @@ from . import crypto_handlers  # <-- اضافه شده و بسیار مهم
 from database import db_manager
 from database.models import User
 from database.repository import AdminRepository, TntRepository
+from services.user_registry_service import user_registry
 from utils.helpers import load_static_texts
 
 # راه‌اندازی لاگر
 logger = logging.getLogger(__name__)
+# تعداد خریداران نمایش داده شده در پنل رفرال
+REFERRAL_PANEL_BUYERS = 5
 # بارگزاری متن‌های ثابت
 STATIC_TEXTS = load_static_texts()
 async def send_long_message(update, context, message, max_length=3500):
@@ -81,26 +82,20 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
     
     # ثبت کاربر در دیتابیس
+    # کاربران شناخته شده به دیتابیس دسترسی ندارند؛ کاربران جدید دسته‌ای درج می‌شوند
     user_id = update.effective_user.id
     username = update.effective_user.username
-    with db_manager.get_session() as session:
-        user = session.query(User).filter_by(user_id=user_id).first()
-        if not user:
-            user = User(
-                user_id=user_id,
-                username=username,
-                created_at=datetime.now(),
-                tnt_plan_type='FREE'
-            )
-            session.add(user)
-            session.commit()
-            logger.info(f"New user registered: {user_id} - @{username}")
+    if user_registry.register(user_id, username):
+        logger.info(f"New user queued for registration: {user_id} - @{username}")
     
     # پردازش کد رفرال اگر وجود داشته باشد
     if context.args and len(context.args) > 0:
         referral_param = context.args[0]
         print(f"🎯 DEBUG: Referral param received: {referral_param}")
         if referral_param.startswith("REF"):
+            # رابطه رفرال به ردیف users نیاز دارد
+            await user_registry.ensure_registered(user_id, username)
+
             # پردازش رفرال
             with db_manager.get_session() as session:
                 admin_repo = AdminRepository(session)
@@ -594,9 +589,10 @@ async def receive_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # پیام تحلیل بر اساس نوع
     if analysis_type == 'modern':
-        await update.message.reply_text("🔬 در حال تحلیل مدرن نمودار شما... ⏳")
+        status_text = "🔬 در حال تحلیل مدرن نمودار شما... ⏳"
     else:
-        await update.message.reply_text("🔥 در حال تحلیل چند تایم‌فریمی نمودارها... ⏳")
+        status_text = "🔥 در حال تحلیل چند تایم‌فریمی نمودارها... ⏳"
+    status_message = await update.message.reply_text(status_text)
     
     try:
         # ثبت استفاده قبل از تحلیل
@@ -610,43 +606,9 @@ async def receive_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # استفاده از پرامپت اختصاصی استراتژی انتخابی
         strategy_prompt = context.user_data.get('strategy_prompt')
 
-        # Process images and call AI service
-        try:
-            # Save first image to temporary file for AI analysis
-            if context.user_data['received_images']:
-                first_image_data, ext = context.user_data['received_images'][0]
-        
-                # Create temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{ext}') as temp_file:
-                    temp_file.write(first_image_data)
-                    temp_file_path = temp_file.name
-        
-                # Get AI analysis
-                selected_strategy = context.user_data.get('selected_strategy', 'narmoon_ai')
-                ai_response = await generate_tnt_analaysis(user_id, selected_strategy, temp_file_path)
-        
-                # Clean up temporary file
-                os.unlink(temp_file_path)
-        
-                if ai_response.get("success"):
-                    result = ai_response["response"]
-                else:
-                    result = "❌ خطا در تحلیل توسط هوش مصنوعی. لطفاً دوباره تلاش کنید."
-            else:
-                result = "❌ هیچ تصویری دریافت نشد."
-        
-        except Exception as e:
-            print(f"Error in AI analysis: {e}")
-            result = "❌ خطا در پردازش تصویر. لطفاً دوباره تلاش کنید."
-        
-        # دکمه بازگشت به منوی اصلی
-        menu_button = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]])
-        
-        # نمایش خلاصه انتخاب‌ها و نتیجه
-        # بررسی نوع تحلیل برای تعیین نمایش header
-        analysis_type = context.user_data.get('selected_analysis_type', 'classic')
-
-        # فقط برای تحلیل کلاسیک هدر را بساز
+        # نمایش خلاصه انتخاب‌ها قبل از نتیجه
+        # فقط برای تحلیل کلاسیک هدر را بساز (استفاده این تحلیل از قبل ثبت شده است)
+        summary = ""
         if analysis_type == 'classic':
             selected_market = context.user_data.get('selected_market', 'نامشخص')
             selected_timeframe = context.user_data.get('selected_timeframe', 'نامشخص')
@@ -668,13 +630,62 @@ async def receive_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 summary += f"⏱️ باقی‌مانده ساعتی: {updated_limit_check.get('remaining_hourly', 'نامشخص')} تحلیل\n"
             
             summary += f"{'═' * 30}\n\n"
-            full_message = summary + result
 
-        else:  # برای تحلیل مدرن و سایر انواع تحلیل
-            full_message = result
+        # در حالت stream پاسخ به تدریج در همان پیام وضعیت نوشته می‌شود
+        writer = None
+        if STREAM_AI_RESPONSES:
+            writer = TelegramStreamWriter(
+                context.bot, update.effective_chat.id,
+                prefix=summary, message_id=status_message.message_id
+            )
+
+        # Process images and call AI service
+        success = False
+        try:
+            # همه تصاویر (تایم‌فریم‌ها) در یک درخواست و مستقیم از حافظه ارسال می‌شوند
+            if context.user_data['received_images']:
+                images = [
+                    (memoryview(image_data), f"image/{ext}")
+                    for image_data, ext in context.user_data['received_images']
+                ]
+                # برچسب هر تصویر به ترتیب ارسال (فقط تحلیل کلاسیک چند تایم‌فریمی است)
+                timeframes = context.user_data.get('expected_frames') if analysis_type == 'classic' else None
+
+                # Get AI analysis
+                selected_strategy = context.user_data.get('selected_strategy', 'narmoon_ai')
+                ai_response = await generate_tnt_analaysis(
+                    user_id, selected_strategy,
+                    images=images, timeframes=timeframes,
+                    analysis_type=analysis_type,
+                    on_delta=writer.append if writer else None,
+                    on_queue=queue_status_callback(status_message, status_text)
+                )
+
+                if ai_response.get("success"):
+                    result = ai_response["response"]
+                    success = True
+                elif ai_response.get("error") == "QUEUE_FULL":
+                    result = "⏳ در حال حاضر درخواست‌های زیادی در صف تحلیل است. لطفاً چند دقیقه دیگر دوباره تلاش کنید."
+                else:
+                    result = "❌ خطا در تحلیل توسط هوش مصنوعی. لطفاً دوباره تلاش کنید."
+            else:
+                result = "❌ هیچ تصویری دریافت نشد."
+        
+        except Exception as e:
+            print(f"Error in AI analysis: {e}")
+            result = "❌ خطا در پردازش تصویر. لطفاً دوباره تلاش کنید."
+        
+        # دکمه بازگشت به منوی اصلی
+        menu_button = InlineKeyboardMarkup([[InlineKeyboardButton("🏠 منوی اصلی", callback_data="main_menu")]])
 
         # ارسال پیام نهایی
-        await send_long_message(update, context, full_message)
+        if writer:
+            if not success and writer.started:
+                # بخشی از پاسخ نمایش داده شده؛ خطا به انتهای آن اضافه می‌شود
+                result = f"{writer.text}\n\n{result}"
+            await writer.finish(result)
+        else:
+            await send_long_message(update, context, summary + result)
 
         # ارسال دکمه منو در پیام جداگانه
         await update.message.reply_text(
@@ -1094,7 +1105,7 @@ async def show_referral_panel(update: Update, context: ContextTypes.DEFAULT_TYPE
         # دریافت آمار رفرال کاربر با Repository
         with db_manager.get_session() as session:
             repo = AdminRepository(session)
-            stats = repo.get_user_referral_stats(user_id)
+            stats = repo.get_user_referral_stats(user_id, limit=REFERRAL_PANEL_BUYERS)
         
         if not stats.get('success'):
             await query.edit_message_text(
@@ -1129,14 +1140,15 @@ async def show_referral_panel(update: Update, context: ContextTypes.DEFAULT_TYPE
         buyers = stats.get('buyers', [])
         if buyers:
             message += "👥 جزئیات خریداران:\n"
-            for i, buyer in enumerate(buyers[:5], 1):  # فقط 5 تای اول
+            for i, buyer in enumerate(buyers, 1):  # فقط چند خریدار اول
                 plan_emoji = "📅"
                 status_emoji = "💰" if buyer.get('status') == 'paid' else "⏳"
                 message += f"{i}. {status_emoji} {buyer.get('username', 'کاربر')}\n"
                 message += f"   {plan_emoji} {buyer.get('plan_type')} - ${buyer.get('amount', 0):.2f}\n"
 
-            if len(buyers) > 5:
-                message += f"... و {len(buyers) - 5} نفر دیگر\n"
+            total_buyers = stats.get('total_buyers', len(buyers))
+            if total_buyers > len(buyers):
+                message += f"... و {total_buyers - len(buyers)} نفر دیگر\n"
         
         message += f"""
 📞 برای دریافت پول:
@@ -1207,11 +1219,23 @@ async def handle_referral_details(update: Update, context: ContextTypes.DEFAULT_
         except (ValueError, IndexError):
             page = 1
             
-    # This assumes get_referral_stats is in database/operations.py
-    #from database import get_referral_stats
+    BUYERS_PER_PAGE = 8
+    page = max(1, page)
+
+    # فقط خریداران همین صفحه از دیتابیس خوانده می‌شوند
     with db_manager.get_session() as session:
         admin_repo = AdminRepository(session)
-        stats = admin_repo.get_user_referral_details(user_id)
+        stats = admin_repo.get_user_referral_details(
+            user_id, limit=BUYERS_PER_PAGE, offset=(page - 1) * BUYERS_PER_PAGE
+        )
+        total_buyers = stats.get("total_buyers", 0)
+        total_pages = max(1, (total_buyers + BUYERS_PER_PAGE - 1) // BUYERS_PER_PAGE)
+        if stats.get("success") and page > total_pages:
+            # صفحه درخواستی دیگر وجود ندارد؛ آخرین صفحه نمایش داده می‌شود
+            page = total_pages
+            stats = admin_repo.get_user_referral_details(
+                user_id, limit=BUYERS_PER_PAGE, offset=(page - 1) * BUYERS_PER_PAGE
+            )
     
     if not stats.get("success"):
         await query.edit_message_text(
@@ -1231,14 +1255,8 @@ async def handle_referral_details(update: Update, context: ContextTypes.DEFAULT_
         )
         return
     
-    BUYERS_PER_PAGE = 8
-    total_buyers = len(buyers)
-    total_pages = (total_buyers + BUYERS_PER_PAGE - 1) // BUYERS_PER_PAGE
-    page = max(1, min(page, total_pages))
-    
     start_idx = (page - 1) * BUYERS_PER_PAGE
-    end_idx = start_idx + BUYERS_PER_PAGE
-    current_buyers = buyers[start_idx:end_idx]
+    current_buyers = buyers
     
     text_lines = [f"📊 <b>جزئیات کامل رفرال (صفحه {page} از {total_pages})</b>\n"]
     
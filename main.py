@@ -8,7 +8,7 @@ from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler, ContextTypes
 from telegram.error import Conflict
 
-from config.settings import TELEGRAM_TOKEN
+from config.settings import TELEGRAM_TOKEN, BOT_CONCURRENT_UPDATES
 from config.constants import (
     MAIN_MENU, SELECTING_MARKET, SELECTING_ANALYSIS_TYPE, SELECTING_TIMEFRAME,
     SELECTING_STRATEGY, WAITING_IMAGES,
@@ -16,7 +16,15 @@ from config.constants import (
     TRADE_COACH_AWAITING_INPUT  # <-- ثابت جدید اضافه شد
 )
 
-from database import init_db, db_manager
+from database import init_db, db_manager, TntRepository
+from database.migration import verify_schema
+from services.user_registry_service import user_registry
+from services.broadcast_service import broadcast_engine
+from services.maintenance_service import maintenance_service
+from services.plan_catalog_service import plan_catalog
+from services.executor_service import executor_service
+from services.ai_scheduler import ai_scheduler
+from utils.update_processor import PerUserUpdateProcessor
 from database.models import User, ApiRequest, TntUsageTracking
 from sqlalchemy import func
 
@@ -44,7 +52,7 @@ from handlers.crypto_handlers import (
     trade_coach_prompt_handler     # <-- هندلر جدید اضافه شد
 )
 
-from admin.commands import admin_activate, admin_user_info, admin_stats, admin_broadcast, admin_referral_stats, admin_health_check
+from admin.commands import admin_activate, admin_user_info, admin_stats, admin_broadcast, admin_broadcast_cancel, admin_referral_stats, admin_health_check
 
 # Configure logging
 logging.basicConfig(
@@ -74,6 +82,35 @@ async def error_handler(update, context):
         except Exception as e:
             logger.error(f"Failed to send error message: {e}")
 
+async def post_init(application):
+    """راه‌اندازی سرویس‌های پس‌زمینه بعد از ساخت اپلیکیشن"""
+    # process pool قبل از ساخت threadهای سرویس‌های دیگر fork می‌شود
+    await executor_service.start()
+    # فقط بررسی schema؛ migrationها در مرحله release اجرا می‌شوند
+    schema = await asyncio.to_thread(verify_schema)
+    if schema.get("ok"):
+        logger.info(f"✅ Database schema at revision {schema['current']}")
+    else:
+        logger.error(
+            f"⚠️ Database schema is not up to date: {schema}. "
+            f"Run `python -m database.migration upgrade`."
+        )
+    await asyncio.to_thread(db_manager.warm_up_pool)
+    # پلن‌ها و تنظیمات رفرال یک بار خوانده می‌شوند
+    await asyncio.to_thread(plan_catalog.start)
+    await user_registry.start()
+    await broadcast_engine.resume_jobs(application.bot)
+    maintenance_service.start()
+
+async def post_shutdown(application):
+    """تخلیه صف‌ها قبل از خروج"""
+    await broadcast_engine.shutdown()
+    await maintenance_service.stop()
+    await user_registry.stop()
+    await asyncio.to_thread(plan_catalog.stop)
+    ai_scheduler.shutdown()
+    executor_service.shutdown()
+
 def safe_migration():
     """Migration ایمن که بر اساس محیط تصمیم می‌گیرد"""
     import os
@@ -150,16 +187,12 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             # شمارش درخواست‌های API (اختیاری)
             today = datetime.now().date()
+            tnt_repo = TntRepository(session)
             # استفاده امروز (مجموع تحلیل‌های امروز)
-            today_count = session.query(func.sum(TntUsageTracking.analysis_count)).filter(
-                TntUsageTracking.user_id == user_id,
-                TntUsageTracking.usage_date == today
-            ).scalar() or 0
+            today_count = tnt_repo.get_usage_since(user_id, today)
 
-            # کل استفاده (مجموع تمام تحلیل‌ها)
-            total_count = session.query(func.sum(TntUsageTracking.analysis_count)).filter(
-                TntUsageTracking.user_id == user_id
-            ).scalar() or 0
+            # کل استفاده (شامل خلاصه‌های روزانه فشرده شده)
+            total_count = tnt_repo.get_usage_since(user_id)
 
             # ساخت پیام نهایی
             message = f"""📊 وضعیت اشتراک شما
@@ -239,7 +272,14 @@ def main():
     # ایجاد اپلیکیشن با تنظیمات بهبود یافته
     print("🤖 Building Telegram application...")
     
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(BOT_CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # اضافه کردن error handler
     app.add_error_handler(error_handler)
@@ -410,15 +450,19 @@ def main():
     app.add_handler(CommandHandler("userinfo", admin_user_info))
     app.add_handler(CommandHandler("stats", admin_stats))
     app.add_handler(CommandHandler("broadcast", admin_broadcast))
+    app.add_handler(CommandHandler("broadcastcancel", admin_broadcast_cancel))
     app.add_handler(CommandHandler("referralstats", admin_referral_stats))
     # دستورات مدیریتی TNT
-    from admin.commands import admin_activate_tnt, admin_tnt_stats, admin_user_tnt_info, admin_clean_database, admin_db_stats, admin_reset_db
+    from admin.commands import admin_activate_tnt, admin_bulk_activate_tnt, admin_tnt_stats, admin_user_tnt_info, admin_clean_database, admin_db_stats, admin_reset_db, admin_retention, admin_reload_plans
     app.add_handler(CommandHandler("activatetnt", admin_activate_tnt))
+    app.add_handler(CommandHandler("bulkactivatetnt", admin_bulk_activate_tnt))
     app.add_handler(CommandHandler("tntstats", admin_tnt_stats))
     app.add_handler(CommandHandler("usertnt", admin_user_tnt_info))
     app.add_handler(CommandHandler("cleandb", admin_clean_database))
     app.add_handler(CommandHandler("dbstats", admin_db_stats))
     app.add_handler(CommandHandler("resetdb", admin_reset_db))
+    app.add_handler(CommandHandler("retention", admin_retention))
+    app.add_handler(CommandHandler("reloadplans", admin_reload_plans))
     app.add_handler(CommandHandler("health", admin_health_check))
 
     print("🤖 ربات نارموون آماده است!")
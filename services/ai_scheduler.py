@@ -0,0 +1,302 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import openai
+
+from config.settings import (
+    AI_MAX_CONCURRENCY, AI_TOKENS_PER_MINUTE, AI_QUEUE_MAX_SIZE,
+    AI_PER_USER_CONCURRENCY, AI_QUEUE_NOTIFY_INTERVAL, AI_RATE_LIMIT_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# اولویت بر اساس پلن (عدد کمتر = زودتر)
+PLAN_PRIORITIES = {"TNT_MAX": 0, "TNT_PLUS": 1, "TNT_MINI": 2}
+FREE_PRIORITY = 3
+
+# کارهای پس‌زمینه (مثل خلاصه‌سازی تاریخچه) با شناسه رزرو شده و کمترین اولویت اجرا
+# می‌شوند تا فقط از ظرفیت و بودجه سراسری استفاده کنند و سهم همزمانی کاربر را نگیرند
+# (شناسه کاربران تلگرام مثبت است)
+MAINTENANCE_USER_ID = 0
+MAINTENANCE_PRIORITY = FREE_PRIORITY + 1
+
+TOKEN_WINDOW_SECONDS = 60.0
+
+# اعلام جایگاه در صف به کاربر؛ صفر یعنی پردازش شروع شده است
+QueueCallback = Callable[[int], Awaitable[None]]
+
+# رزرو توکن درخواست جاری (برای اصلاح با مصرف واقعی)
+_current_reservation: contextvars.ContextVar = contextvars.ContextVar("ai_reservation", default=None)
+
+
+class AIQueueFull(Exception):
+    """صف درخواست‌های هوش مصنوعی پر است"""
+
+
+class _Job:
+    __slots__ = ("user_id", "priority", "tokens", "key", "ready", "reservation")
+
+    def __init__(self, user_id: int, priority: int, tokens: int, key: tuple, ready: asyncio.Future):
+        self.user_id = user_id
+        self.priority = priority
+        self.tokens = tokens
+        self.key = key
+        self.ready = ready
+        self.reservation = None
+
+
+class AIScheduler:
+    """
+    صف اولویت‌دار برای فراخوانی‌های OpenAI
+
+    - سقف سراسری درخواست‌های همزمان (AI_MAX_CONCURRENCY)
+    - اولویت بر اساس پلن: TNT_MAX قبل از TNT_PLUS و TNT_MINI و کاربران رایگان
+    - عدالت بین کاربران: در هر سطح اولویت، درخواست دوم یک کاربر بعد از
+      درخواست اول بقیه اجرا می‌شود و هر کاربر حداکثر AI_PER_USER_CONCURRENCY
+      درخواست در حال اجرا دارد
+    - بودجه توکن در دقیقه (پنجره لغزان ۶۰ ثانیه‌ای)؛ رزرو هر درخواست بعد از
+      پاسخ با مصرف واقعی اصلاح می‌شود
+    - با RateLimitError دریافت درخواست‌ها موقتاً متوقف و درخواست دوباره در
+      صف قرار می‌گیرد، به جای اینکه خطا به کاربر برسد
+    """
+
+    def __init__(self, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 tokens_per_minute: int = AI_TOKENS_PER_MINUTE,
+                 max_queue: int = AI_QUEUE_MAX_SIZE,
+                 per_user_limit: int = AI_PER_USER_CONCURRENCY,
+                 notify_interval: float = AI_QUEUE_NOTIFY_INTERVAL,
+                 rate_limit_retries: int = AI_RATE_LIMIT_RETRIES):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max_queue
+        self.per_user_limit = max(1, per_user_limit)
+        self.notify_interval = notify_interval
+        self.rate_limit_retries = rate_limit_retries
+
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._running_per_user: Dict[int, int] = {}
+        self._queued_per_user: Dict[int, int] = {}
+        # [زمان، توکن] هر درخواست در یک دقیقه اخیر
+        self._window: deque = deque()
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {"completed": 0, "failed": 0, "rejected": 0, "rate_limited": 0, "max_wait": 0.0}
+
+    # === Public API ===
+    @staticmethod
+    def priority_for_plan(plan_type: Optional[str], plan_active: bool = True) -> int:
+        if not plan_active:
+            return FREE_PRIORITY
+        return PLAN_PRIORITIES.get(plan_type or "FREE", FREE_PRIORITY)
+
+    async def run(self, user_id: int, call: Callable[[], Awaitable[Any]], priority: int = FREE_PRIORITY,
+                  tokens: int = 0, on_queue: Optional[QueueCallback] = None) -> Any:
+        """
+        اجرای call در نوبت خودش. tokens تخمین مصرف درخواست است؛ on_queue
+        هنگام انتظار با جایگاه کاربر در صف (و با صفر هنگام شروع) صدا زده می‌شود.
+        """
+        enqueued_at = time.monotonic()
+        for attempt in range(self.rate_limit_retries + 1):
+            job = self._enqueue(user_id, priority, tokens, retry=attempt > 0)
+            await self._wait_turn(job, on_queue)
+            self._stats["max_wait"] = max(self._stats["max_wait"], time.monotonic() - enqueued_at)
+
+            token = _current_reservation.set(job.reservation)
+            try:
+                result = await call()
+            except openai.RateLimitError as e:
+                self._stats["rate_limited"] += 1
+                if attempt == self.rate_limit_retries or getattr(e, "code", None) == "insufficient_quota":
+                    self._stats["failed"] += 1
+                    raise
+                self.pause(self._retry_after(e, attempt))
+                continue
+            except BaseException:
+                self._stats["failed"] += 1
+                raise
+            finally:
+                _current_reservation.reset(token)
+                self._release(job)
+            self._stats["completed"] += 1
+            return result
+
+    def report_usage(self, total_tokens: Optional[int]):
+        """جایگزینی تخمین درخواست جاری با توکن مصرف شده واقعی"""
+        reservation = _current_reservation.get()
+        if reservation is not None and total_tokens:
+            reservation[1] = total_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "queued": len(self._queue),
+            "tokens_last_minute": self._tokens_in_window(),
+            "tokens_per_minute": self.tokens_per_minute,
+            "paused_for": round(max(self._paused_until - time.monotonic(), 0.0), 1),
+            **self._stats
+        }
+
+    def shutdown(self):
+        """رد کردن درخواست‌های در صف هنگام خاموش شدن"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for _, _, _, job in self._queue:
+            if not job.ready.done():
+                job.ready.set_exception(AIQueueFull("scheduler is shutting down"))
+        self._queue.clear()
+        self._queued_per_user.clear()
+
+    # === Queue ===
+    def _enqueue(self, user_id: int, priority: int, tokens: int, retry: bool) -> _Job:
+        if not retry and len(self._queue) >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise AIQueueFull(f"AI queue is full ({len(self._queue)} waiting)")
+
+        # تعداد درخواست‌های قبلی همین کاربر: نوبت دوم او بعد از نوبت اول بقیه است
+        user_round = -1 if retry else (
+            self._running_per_user.get(user_id, 0) + self._queued_per_user.get(user_id, 0)
+        )
+        key = (priority, user_round, next(self._sequence))
+        job = _Job(user_id, priority, tokens, key, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (*key, job))
+        self._queued_per_user[user_id] = self._queued_per_user.get(user_id, 0) + 1
+        self._dispatch()
+        return job
+
+    async def _wait_turn(self, job: _Job, on_queue: Optional[QueueCallback]):
+        last_position = None
+        try:
+            while not job.ready.done():
+                position = self._position(job)
+                if on_queue and position != last_position:
+                    last_position = position
+                    await self._notify(on_queue, position)
+                try:
+                    await asyncio.wait_for(asyncio.shield(job.ready), timeout=self.notify_interval)
+                except asyncio.TimeoutError:
+                    pass
+            job.ready.result()
+            if on_queue and last_position:
+                await self._notify(on_queue, 0)
+        except BaseException:
+            # لغو شده یا shutdown: خارج کردن از صف یا آزاد کردن جایگاه گرفته شده
+            if job.ready.done() and not job.ready.cancelled() and job.ready.exception() is None:
+                self._release(job)
+            else:
+                self._remove(job)
+            raise
+
+    def _position(self, job: _Job) -> int:
+        return 1 + sum(1 for entry in self._queue if entry[:3] < job.key)
+
+    @staticmethod
+    async def _notify(on_queue: QueueCallback, position: int):
+        try:
+            await on_queue(position)
+        except Exception as e:
+            logger.debug(f"Queue position callback failed: {e}")
+
+    def _remove(self, job: _Job):
+        for index, entry in enumerate(self._queue):
+            if entry[3] is job:
+                self._queue.pop(index)
+                heapq.heapify(self._queue)
+                self._decrement(self._queued_per_user, job.user_id)
+                self._dispatch()
+                return
+
+    # === Dispatching ===
+    def _dispatch(self):
+        """شروع درخواست‌های در صف تا جایی که ظرفیت و بودجه توکن اجازه می‌دهد"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._schedule_dispatch(self._paused_until - now)
+            return
+
+        skipped = []
+        while self._queue and self._running < self.max_concurrency:
+            entry = heapq.heappop(self._queue)
+            job = entry[3]
+            if self._running_per_user.get(job.user_id, 0) >= self.per_user_limit:
+                skipped.append(entry)
+                continue
+            if not self._fits_budget(job.tokens):
+                heapq.heappush(self._queue, entry)
+                self._schedule_dispatch(self._window[0][0] + TOKEN_WINDOW_SECONDS - now)
+                break
+            self._decrement(self._queued_per_user, job.user_id)
+            self._running += 1
+            self._running_per_user[job.user_id] = self._running_per_user.get(job.user_id, 0) + 1
+            # رزرو همین‌جا تا درخواست بعدی این دور بودجه باقی‌مانده را ببیند
+            job.reservation = self._reserve(job.tokens)
+            job.ready.set_result(None)
+
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+    def _release(self, job: _Job):
+        self._running -= 1
+        self._decrement(self._running_per_user, job.user_id)
+        self._dispatch()
+
+    def _schedule_dispatch(self, delay: float):
+        if self._timer is not None:
+            return
+
+        def fire():
+            self._timer = None
+            self._dispatch()
+
+        self._timer = asyncio.get_running_loop().call_later(max(delay, 0.05), fire)
+
+    def pause(self, seconds: float):
+        """توقف شروع درخواست‌های جدید بعد از RateLimitError"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logger.warning(f"OpenAI rate limit hit, pausing AI queue for {seconds:.1f}s")
+
+    @staticmethod
+    def _retry_after(error: openai.RateLimitError, attempt: int) -> float:
+        try:
+            return min(float(error.response.headers.get("retry-after")), 60.0)
+        except (AttributeError, TypeError, ValueError):
+            return min(2.0 * (2 ** attempt), 30.0)
+
+    # === Token budget ===
+    def _tokens_in_window(self) -> int:
+        cutoff = time.monotonic() - TOKEN_WINDOW_SECONDS
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+        return sum(tokens for _, tokens in self._window)
+
+    def _fits_budget(self, tokens: int) -> bool:
+        if not self.tokens_per_minute:
+            return True
+        used = self._tokens_in_window()
+        # درخواست بزرگ‌تر از کل بودجه، وقتی پنجره خالی است اجرا می‌شود
+        return used == 0 or used + tokens <= self.tokens_per_minute
+
+    def _reserve(self, tokens: int) -> list:
+        reservation = [time.monotonic(), tokens]
+        self._window.append(reservation)
+        return reservation
+
+    @staticmethod
+    def _decrement(counter: Dict[int, int], user_id: int):
+        count = counter.get(user_id, 0) - 1
+        if count > 0:
+            counter[user_id] = count
+        else:
+            counter.pop(user_id, None)
+
+
+# نمونه global
+ai_scheduler = AIScheduler()
@@ -1,39 +1,172 @@
+import asyncio
 import base64
 import logging
 from datetime import date
+from typing import List, Optional, Sequence
 import openai
 
-from config.settings import OPENAI_API_KEY
+from config.settings import VISION_MAX_TILES_MODERN
 from database import db_manager
 from database.repository import TntRepository
 from database.repository import AdminRepository  # فعلاً فقط این repository داریم
 from resources.prompts.strategies import STRATEGY_PROMPTS
+from services.ai_scheduler import AIQueueFull, FREE_PRIORITY, QueueCallback, ai_scheduler
+from services.analysis_cache_service import analysis_cache
+from services.coach_memory_service import coach_memory
+from services.executor_service import executor_service
+from services.openai_client import Completion, DeltaCallback, completion_client, estimate_text_tokens
+from services.image_service import BASE_TOKENS, TILE_TOKENS, ImageData, detect_image_mime, image_preprocessor
 
 # راه‌اندازی لاگر
 logger = logging.getLogger(__name__)
 
-# ایجاد کلاینت Async OpenAI
-client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+# کلاینت Async OpenAI (با timeout و بدون retry داخلی SDK؛ retry در completion_client)
+client = completion_client.client
 
-def encode_image_to_base64(image_path: str) -> str:
-    """یک فایل تصویری را به رشته base64 تبدیل می‌کند."""
+
+def image_to_data_url(image: ImageData, mime_type: Optional[str] = None) -> str:
+    """تبدیل بایت‌های تصویر در حافظه به data URL برای OpenAI (بدون فایل موقت)"""
+    encoded = base64.b64encode(image).decode("ascii")
+    return f"data:{mime_type or detect_image_mime(image)};base64,{encoded}"
+
+
+def _read_image_file(image_path: str) -> Optional[bytes]:
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        logger.error(f"Image file not found: {image_path}")
-        return None
-    except PermissionError:
-        logger.error(f"Permission denied accessing image: {image_path}")
-        return None
+            return image_file.read()
     except Exception as e:
-        logger.error(f"Error encoding image {image_path}: {e}")
+        logger.error(f"Error reading image {image_path}: {e}")
         return None
 
-async def generate_tnt_analaysis(user_id: int, prompt_key: str, photo_path: str = None) -> dict:
+
+async def _load_image(image: Optional[ImageData], photo_path: Optional[str]) -> Optional[ImageData]:
+    """بایت‌های تصویر؛ مسیر فایل فقط برای سازگاری با فراخوانی‌های قدیمی"""
+    if image is not None:
+        return image
+    if photo_path:
+        return await executor_service.run_io(_read_image_file, photo_path)
+    return None
+
+
+async def _image_content(image: ImageData, analysis_type: str, mime_type: Optional[str] = None) -> dict:
+    """
+    کوچک‌سازی/فشرده‌سازی تصویر (در process pool) و انتخاب detail بر اساس نوع تحلیل؛
+    کدگذاری base64 چند صد کیلوبایت هم در thread pool انجام می‌شود تا event loop آزاد بماند
+    """
+    prepared = await image_preprocessor.prepare(image, analysis_type, mime_type)
+    logger.info(
+        f"Vision image ({analysis_type}): {prepared.original_size:,} -> {len(prepared.data):,} bytes, "
+        f"{prepared.width}x{prepared.height}, detail={prepared.detail}, ~{prepared.estimated_tokens} tokens"
+    )
+    data_url = await executor_service.run_io(image_to_data_url, prepared.data, prepared.mime_type)
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": data_url,
+            "detail": prepared.detail
+        }
+    }
+
+
+# توکن تصویر وقتی ابعاد نهایی مشخص نیست (سقف پروفایل‌های high و low)
+IMAGE_TOKEN_ESTIMATE = {"low": BASE_TOKENS, "high": BASE_TOKENS + TILE_TOKENS * VISION_MAX_TILES_MODERN}
+
+
+def _estimate_tokens(messages: list, max_tokens: int) -> int:
+    """تخمین محافظه‌کارانه توکن یک درخواست برای بودجه صف"""
+    tokens = max_tokens
+    for message in messages:
+        content = message["content"]
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+        for part in parts:
+            if part["type"] == "text":
+                tokens += estimate_text_tokens(part["text"])
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE.get(part["image_url"].get("detail"), IMAGE_TOKEN_ESTIMATE["high"])
+    return tokens
+
+
+def _build_messages(prompt_key: str, system_prompt: str, user_content: list,
+                    history: Optional[list] = None) -> tuple:
+    """
+    پیام‌ها با پیشوند ثابت برای prompt caching: پرامپت استراتژی بدون هیچ
+    بخش متغیری اول می‌آید، سپس تاریخچه گفتگو (فقط اضافه شونده) و در آخر
+    محتوای همین درخواست (متن، تصاویر، تایم‌فریم‌ها). (messages, cache_key) برمی‌گرداند.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *(history or []),
+        {"role": "user", "content": user_content}
+    ]
+    return messages, f"narmoon:{prompt_key}"
+
+
+async def _complete(messages: list, max_tokens: int, temperature: float,
+                    on_delta: Optional[DeltaCallback] = None, user_id: int = 0,
+                    priority: int = FREE_PRIORITY, on_queue: Optional[QueueCallback] = None,
+                    cache_key: Optional[str] = None) -> Completion:
+    """
+    فراخوانی chat completion از طریق صف ai_scheduler و completion_client
+    (timeout، تلاش دوباره و مدل جایگزین)؛ اگر on_delta داده شود پاسخ به صورت
+    stream خوانده می‌شود و هر تکه بلافاصله به on_delta داده می‌شود.
+    """
+    async def call() -> Completion:
+        completion = await completion_client.complete(messages, max_tokens, temperature, on_delta, cache_key)
+        ai_scheduler.report_usage(completion.total_tokens)
+        logger.debug(f"Prompt tokens for {cache_key}: {completion.prompt_tokens} ({completion.cached_tokens} cached)")
+        if completion.attempts > 1 or completion.model != completion_client.models[0]:
+            logger.info(f"AI response for user {user_id} from {completion.model} after {completion.attempts} attempts")
+        return completion
+
+    return await ai_scheduler.run(
+        user_id, call, priority=priority,
+        tokens=_estimate_tokens(messages, max_tokens), on_queue=on_queue
+    )
+
+
+async def _chart_content(images: Sequence, timeframes: Optional[List[str]], analysis_type: str) -> list:
+    """
+    محتوای پیام کاربر برای یک یا چند نمودار: هر تصویر با برچسب تایم‌فریم خودش
+    images: لیست ImageData یا (ImageData, mime_type)
+    """
+    items = [item if isinstance(item, tuple) else (item, None) for item in images]
+    # پیش‌پردازش همه تصاویر به صورت همزمان
+    parts = await asyncio.gather(*(
+        _image_content(data, analysis_type, mime_type) for data, mime_type in items
+    ))
+
+    labels = list(timeframes or [])[:len(parts)]
+    if len(parts) > 1:
+        intro = f"لطفاً این {len(parts)} نمودار را با هم و بر اساس استراتژی ارائه شده تحلیل کنید"
+        if labels:
+            intro += f" (تایم‌فریم‌ها: {'، '.join(labels)})"
+        content = [{"type": "text", "text": intro + "."}]
+    else:
+        content = [{"type": "text", "text": "لطفاً نمودار را بر اساس استراتژی ارائه شده تحلیل کنید."}]
+
+    for index, part in enumerate(parts):
+        if len(parts) > 1 or index < len(labels):
+            label = labels[index] if index < len(labels) else "نامشخص"
+            content.append({"type": "text", "text": f"نمودار {index + 1} - تایم‌فریم: {label}"})
+        content.append(part)
+    return content
+
+
+async def generate_tnt_analaysis(user_id: int, prompt_key: str, photo_path: str = None,
+                                 image: Optional[ImageData] = None, image_mime: Optional[str] = None,
+                                 analysis_type: str = "classic", images: Optional[Sequence] = None,
+                                 timeframes: Optional[List[str]] = None,
+                                 on_delta: Optional[DeltaCallback] = None,
+                                 on_queue: Optional[QueueCallback] = None) -> dict:
     """
     تحلیل تصویر چارت با استفاده از پرامپت‌های TNT.
     این تابع بازنویسی شده تا با ساختار جدید هماهنگ باشد.
+    چند نمودار (images) با برچسب تایم‌فریم‌ها (timeframes) در یک درخواست ارسال می‌شوند؛
+    image و photo_path برای فراخوانی‌های تک‌تصویری قدیمی باقی مانده‌اند.
+    analysis_type (classic/modern) اندازه تصویر و سطح detail را تعیین می‌کند.
+    با on_delta پاسخ به صورت stream و تکه به تکه تحویل داده می‌شود.
+    درخواست در صف ai_scheduler با اولویت پلن کاربر اجرا می‌شود و on_queue جایگاه صف را اعلام می‌کند.
+    نمودارهای تکراری (و در صورت فعال بودن، نمودارهای تقریباً یکسان همان کاربر) از analysis_cache پاسخ داده می‌شوند.
     """
     logger.info(f"Generating TNT analysis for user {user_id} with prompt key '{prompt_key}'")
     try:
@@ -54,26 +187,43 @@ async def generate_tnt_analaysis(user_id: int, prompt_key: str, photo_path: str
             return {"success": False, "error": "PROMPT_NOT_FOUND"}
         
         # ۳. آماده‌سازی محتوای پیام
-        user_content = [{"type": "text", "text": "لطفاً نمودار را بر اساس استراتژی ارائه شده تحلیل کنید."}]
-        if photo_path:
-            base64_image = encode_image_to_base64(photo_path)
-            if base64_image:
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                })
+        if not images:
+            image = await _load_image(image, photo_path)
+            images = [(image, image_mime)] if image else []
+        images = [item if isinstance(item, tuple) else (item, None) for item in images]
+
+        # نمودار تکراری: پاسخ قبلی بدون فراخوانی جدید
+        fingerprints = await asyncio.gather(*(image_preprocessor.fingerprint(data) for data, _ in images))
+        cache_namespace = analysis_cache.namespace(
+            prompt_key, system_prompt, completion_client.models[0], analysis_type, timeframes, len(images)
+        )
+        cached_response = await executor_service.run_io(analysis_cache.get, cache_namespace, fingerprints, user_id)
+        if cached_response:
+            logger.info(f"Serving cached TNT analysis for user {user_id}")
+            return {"success": True, "response": cached_response, "cached": True}
+
+        user_content = await _chart_content(images, timeframes, analysis_type)
         
         # ۴. فراخوانی صحیح OpenAI API
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
+        messages, cache_key = _build_messages(prompt_key, system_prompt, user_content)
+        completion = await _complete(
+            messages,
             max_tokens=1500,
-            temperature=0.2
+            temperature=0.2,
+            on_delta=on_delta,
+            user_id=user_id,
+            priority=ai_scheduler.priority_for_plan(tnt_plan.get("plan_type")),
+            on_queue=on_queue,
+            cache_key=cache_key
         )
-        ai_response = response.choices[0].message.content
+        ai_response = completion.text
+
+        # پاسخ مدل جایگزین کش نمی‌شود
+        if completion.model == completion_client.models[0]:
+            await executor_service.run_io(
+                analysis_cache.put, cache_namespace, fingerprints, ai_response, analysis_cache.ttl_for(timeframes),
+                user_id
+            )
         
         # TODO: منطق به‌روزرسانی شمارنده TNT در اینجا پیاده‌سازی شود
         # await repository.update_tnt_usage(...)
@@ -86,15 +236,23 @@ async def generate_tnt_analaysis(user_id: int, prompt_key: str, photo_path: str
     except openai.RateLimitError:
         logger.error(f"OpenAI API rate limit exceeded for user {user_id}")
         return {"success": False, "error": "RATE_LIMIT_ERROR"}
+    except AIQueueFull as e:
+        logger.warning(f"AI queue full, rejecting request of user {user_id}: {e}")
+        return {"success": False, "error": "QUEUE_FULL"}
     except Exception as e:
         logger.error(f"Error in generate_tnt_analaysis for user {user_id}: {e}", exc_info=True)
         return {"success": False, "error": "GENERAL_AI_ERROR"}
 
 
-async def get_trade_coach_response(user_id: int, text_prompt: str, photo_path: str = None) -> dict:
+async def get_trade_coach_response(user_id: int, text_prompt: str, photo_path: str = None,
+                                   image: Optional[ImageData] = None, image_mime: Optional[str] = None,
+                                   on_delta: Optional[DeltaCallback] = None,
+                                   on_queue: Optional[QueueCallback] = None) -> dict:
     """
     منطق دریافت پاسخ از مربی ترید را مدیریت می‌کند.
     محدودیت استفاده برای کاربران رایگان را بررسی کرده و OpenAI API را به درستی فراخوانی می‌کند.
+    عکس (در صورت وجود) مستقیم از حافظه ارسال می‌شود.
+    نوبت‌های قبلی گفتگو از coach_memory (با سقف توکن) به درخواست اضافه می‌شوند.
     """
     logger.info(f"Getting trade coach response for user_id: {user_id}")
     try:
@@ -122,25 +280,31 @@ async def get_trade_coach_response(user_id: int, text_prompt: str, photo_path: s
             return {"success": False, "error": "PROMPT_NOT_FOUND"}
 
         user_content = [{"type": "text", "text": text_prompt}]
-        if photo_path:
-            base64_image = encode_image_to_base64(photo_path)
-            if base64_image:
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                })
+        image = await _load_image(image, photo_path)
+        if image:
+            user_content.append(await _image_content(image, "coach", image_mime))
         
-        # ۴. فراخوانی صحیح OpenAI API با نقش‌های مجزای system و user
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
+        # ۴. فراخوانی صحیح OpenAI API با نقش‌های مجزای system و user (همراه تاریخچه گفتگو)
+        history = await executor_service.run_io(coach_memory.context_messages, user_id)
+        messages, cache_key = _build_messages('trade_coach', system_prompt, user_content, history)
+        completion = await _complete(
+            messages,
             max_tokens=1200,
-            temperature=0.3
+            temperature=0.3,
+            on_delta=on_delta,
+            user_id=user_id,
+            priority=ai_scheduler.priority_for_plan(tnt_plan.get("plan_type") if has_plan else None),
+            on_queue=on_queue,
+            cache_key=cache_key
+        )
+        ai_response = completion.text
+
+        # ذخیره این نوبت برای سوال‌های بعدی
+        over_budget = await executor_service.run_io(
+            coach_memory.append_exchange, user_id, text_prompt, bool(image), ai_response
         )
-        ai_response = response.choices[0].message.content
+        if over_budget:
+            coach_memory.schedule_compaction(user_id)
 
         # ۵. به‌روزرسانی شمارنده برای کاربران رایگان
         if not has_plan:
@@ -157,6 +321,9 @@ async def get_trade_coach_response(user_id: int, text_prompt: str, photo_path: s
     except openai.RateLimitError:
         logger.error(f"OpenAI API rate limit exceeded for user {user_id}")
         return {"success": False, "error": "RATE_LIMIT_ERROR"}
+    except AIQueueFull as e:
+        logger.warning(f"AI queue full, rejecting request of user {user_id}: {e}")
+        return {"success": False, "error": "QUEUE_FULL"}
     except Exception as e:
         logger.error(f"Error in get_trade_coach_response for user {user_id}: {e}", exc_info=True)
         return {"success": False, "error": "GENERAL_AI_ERROR"}
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+from config.settings import (
+    ANALYSIS_CACHE_ENABLED, ANALYSIS_CACHE_MAX_DISTANCE, ANALYSIS_CACHE_DEFAULT_TTL, ANALYSIS_CACHE_VERSION
+)
+from services.image_service import ImageFingerprint
+from services.redis_cache_service import redis_cache
+
+logger = logging.getLogger(__name__)
+
+# عمر کش بر اساس کوچک‌ترین تایم‌فریم نمودارها (ثانیه)
+TIMEFRAME_CACHE_TTL = {
+    "۱ دقیقه": 120,
+    "۵ دقیقه": 300,
+    "۱۵ دقیقه": 900,
+    "۱ ساعته": 3600,
+    "۴ ساعته": 4 * 3600,
+    "روزانه": 12 * 3600,
+    "هفتگی": 24 * 3600,
+    "ماهانه": 24 * 3600,
+    "سالانه": 24 * 3600,
+}
+
+# dHash ۲۵۶ بیتی به ۱۶ باند ۱۶ بیتی: دو هش با فاصله کمتر از ۱۶ حداقل در یک باند یکسان‌اند
+HASH_BANDS = 16
+BAND_BITS = 16
+MAX_BAND_CANDIDATES = 32
+
+
+class AnalysisCache:
+    """
+    کش پاسخ تحلیل نمودار بر اساس محتوای تصویر
+
+    کلید: sha256 تصاویر + کلید استراتژی، نسخه پرامپت (هش متن پرامپت و
+    ANALYSIS_CACHE_VERSION)، مدل، نوع تحلیل و برچسب تایم‌فریم‌ها. پیش‌فرض فقط
+    بایت‌های دقیقاً یکسان مطابقت دارند.
+
+    با max_distance > 0 تصاویر تقریباً یکسان (فشرده‌سازی یا اندازه متفاوت) با
+    dHash ۲۵۶ بیتی پیدا می‌شوند: باندهای هش تصویر اول برای هر کاربر جدا در
+    Redis ایندکس می‌شوند، پس تطبیق تقریبی هیچ‌وقت تحلیل نمودار کاربر دیگری را
+    برنمی‌گرداند. مصرف سهمیه تغییری نمی‌کند: استفاده قبل از تحلیل ثبت می‌شود و
+    پاسخ کش شده هم یک تحلیل حساب می‌شود.
+    """
+
+    KEY_PREFIX = "analysis_cache"
+
+    def __init__(self, enabled: bool = ANALYSIS_CACHE_ENABLED, max_distance: int = ANALYSIS_CACHE_MAX_DISTANCE,
+                 default_ttl: int = ANALYSIS_CACHE_DEFAULT_TTL, version: str = ANALYSIS_CACHE_VERSION):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.default_ttl = default_ttl
+        self.version = version
+        self._stats = {"exact_hits": 0, "near_hits": 0, "misses": 0, "stores": 0}
+
+    # === Keys ===
+    def namespace(self, prompt_key: str, system_prompt: str, model: str, analysis_type: str,
+                  timeframes: Optional[Sequence[str]], image_count: int) -> str:
+        """همه چیزی که به جز خود تصاویر روی پاسخ اثر دارد"""
+        prompt_version = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+        raw = "|".join([
+            self.version, prompt_key, prompt_version, model, analysis_type,
+            ",".join(timeframes or []), str(image_count)
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:20]
+
+    def _entry_key(self, namespace: str, fingerprints: Sequence[ImageFingerprint]) -> str:
+        digest = hashlib.sha256("|".join(fp.sha256 for fp in fingerprints).encode("ascii")).hexdigest()
+        return f"{self.KEY_PREFIX}:{namespace}:{digest}"
+
+    def _band_keys(self, namespace: str, user_id: int, value: int) -> List[str]:
+        mask = (1 << BAND_BITS) - 1
+        return [
+            f"{self.KEY_PREFIX}:{namespace}:user:{user_id}:band:{band}:{(value >> (band * BAND_BITS)) & mask}"
+            for band in range(HASH_BANDS)
+        ]
+
+    def ttl_for(self, timeframes: Optional[Sequence[str]]) -> int:
+        ttls = [TIMEFRAME_CACHE_TTL[label] for label in timeframes or [] if label in TIMEFRAME_CACHE_TTL]
+        return min(ttls) if ttls else self.default_ttl
+
+    # === Lookup ===
+    def get(self, namespace: str, fingerprints: Sequence[ImageFingerprint], user_id: int) -> Optional[str]:
+        """پاسخ کش شده برای همین تصاویر یا تصاویر تقریباً یکسانی که همین کاربر فرستاده"""
+        if not self.enabled or not fingerprints:
+            return None
+
+        entry = redis_cache.get(self._entry_key(namespace, fingerprints))
+        if entry:
+            self._stats["exact_hits"] += 1
+            return entry["response"]
+
+        hashes = [fp.dhash for fp in fingerprints]
+        if self.max_distance > 0 and None not in hashes:
+            for key in self._candidates(namespace, user_id, hashes[0]):
+                entry = redis_cache.get(key)
+                if entry and self._is_near(hashes, entry.get("dhashes") or []):
+                    self._stats["near_hits"] += 1
+                    return entry["response"]
+
+        self._stats["misses"] += 1
+        return None
+
+    def _candidates(self, namespace: str, user_id: int, value: int) -> List[str]:
+        seen = []
+        for band_key in self._band_keys(namespace, user_id, value):
+            for key in redis_cache.get(band_key) or []:
+                if key not in seen:
+                    seen.append(key)
+        return seen
+
+    def _is_near(self, hashes: Sequence[int], cached: Sequence[Optional[int]]) -> bool:
+        if len(hashes) != len(cached) or None in cached:
+            return False
+        return all(bin(a ^ b).count("1") <= self.max_distance for a, b in zip(hashes, cached))
+
+    # === Store ===
+    def put(self, namespace: str, fingerprints: Sequence[ImageFingerprint], response: str, ttl: int,
+            user_id: int):
+        if not self.enabled or not fingerprints or not response:
+            return
+        key = self._entry_key(namespace, fingerprints)
+        hashes = [fp.dhash for fp in fingerprints]
+        redis_cache.set(key, {"response": response, "dhashes": hashes}, ttl)
+        if self.max_distance > 0 and hashes[0] is not None:
+            for band_key in self._band_keys(namespace, user_id, hashes[0]):
+                keys = [k for k in (redis_cache.get(band_key) or []) if k != key]
+                keys.append(key)
+                redis_cache.set(band_key, keys[-MAX_BAND_CANDIDATES:], ttl)
+        self._stats["stores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["exact_hits"] + self._stats["near_hits"] + self._stats["misses"]
+        hits = self._stats["exact_hits"] + self._stats["near_hits"]
+        return {
+            "enabled": self.enabled,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            **self._stats
+        }
+
+
+# نمونه global
+analysis_cache = AnalysisCache()
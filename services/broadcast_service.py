@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError, TimedOut
+
+from config.settings import (
+    BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE, BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_RATE_PER_SECOND
+)
+from database import db_manager
+from database.repository import BroadcastRepository
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    محدودکننده نرخ سراسری با کاهش خودکار نرخ هنگام دریافت RetryAfter
+    و بازگشت تدریجی به نرخ هدف پس از ارسال‌های موفق
+    """
+
+    def __init__(self, rate: float, min_rate: float = 5.0, recovery_every: int = 200):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.recovery_every = recovery_every
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+        delay = slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_retry_after(self, seconds: float):
+        """توقف سراسری به اندازه retry_after و کاهش نرخ"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.rate = max(self.min_rate, self.rate * 0.7)
+        self._successes = 0
+        logger.warning(f"Broadcast throttled for {seconds:.1f}s, rate lowered to {self.rate:.1f}/s")
+
+    def on_success(self):
+        self._successes += 1
+        if self.rate < self.max_rate and self._successes >= self.recovery_every:
+            self.rate = min(self.max_rate, self.rate + 1)
+            self._successes = 0
+
+
+class BroadcastEngine:
+    """
+    موتور ارسال پیام همگانی به صورت job پس‌زمینه
+
+    - گیرندگان صفحه به صفحه (keyset روی user_id) از دیتابیس خوانده می‌شوند
+    - ارسال با همزمانی محدود و نرخ سراسری قابل تنظیم انجام می‌شود
+    - پیشرفت بعد از هر دسته ارسال ذخیره می‌شود تا پس از ری‌استارت ادامه یابد
+    - گزارش پیشرفت با ویرایش یک پیام در چت ادمین ارسال می‌شود
+    """
+
+    MAX_ATTEMPTS = 3
+    CHECKPOINT_EVERY = 100
+
+    def __init__(self, rate: float = BROADCAST_RATE_PER_SECOND,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 page_size: int = BROADCAST_PAGE_SIZE,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    # === Public API ===
+    async def start_job(self, bot: Bot, message: str, admin_chat_id: int) -> int:
+        """ایجاد و شروع یک job جدید؛ شناسه job را برمی‌گرداند"""
+        job_id = await asyncio.to_thread(self._create_job, message, admin_chat_id)
+
+        status_message = await bot.send_message(
+            chat_id=admin_chat_id,
+            text=f"📢 ارسال همگانی #{job_id} در صف قرار گرفت..."
+        )
+        await asyncio.to_thread(
+            self._save, job_id, status_message_id=status_message.message_id
+        )
+
+        self._spawn(bot, job_id)
+        return job_id
+
+    async def resume_jobs(self, bot: Bot) -> int:
+        """ادامه jobهای نیمه‌کاره بعد از ری‌استارت"""
+        job_ids = await asyncio.to_thread(self._unfinished_job_ids)
+        for job_id in job_ids:
+            logger.info(f"🔄 Resuming broadcast job #{job_id}")
+            self._spawn(bot, job_id)
+        return len(job_ids)
+
+    async def cancel_job(self, job_id: int) -> bool:
+        """لغو یک job در حال اجرا"""
+        task = self._tasks.get(job_id)
+        if not task:
+            return False
+        task.cancel()
+        await asyncio.to_thread(
+            self._save, job_id, status='cancelled', finished_at=datetime.now()
+        )
+        return True
+
+    def running_jobs(self) -> list:
+        return list(self._tasks)
+
+    async def shutdown(self):
+        """توقف jobها بدون تغییر وضعیت تا پس از ری‌استارت ادامه یابند"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    # === Job execution ===
+    def _spawn(self, bot: Bot, job_id: int):
+        if job_id in self._tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._run_job(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run_job(self, bot: Bot, job_id: int):
+        job = await asyncio.to_thread(self._load_job, job_id)
+        if not job:
+            return
+
+        counters = {
+            "sent_count": job["sent_count"],
+            "failed_count": job["failed_count"],
+            "blocked_count": job["blocked_count"],
+        }
+        last_user_id = job["last_user_id"]
+        text = f"📢 اطلاعیه:\n\n{job['message']}"
+        limiter = AdaptiveRateLimiter(self.rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_report = 0.0
+
+        await asyncio.to_thread(self._save, job_id, status='running')
+
+        try:
+            while True:
+                user_ids = await asyncio.to_thread(self._next_page, last_user_id)
+                if not user_ids:
+                    break
+
+                async def send(user_id: int):
+                    async with semaphore:
+                        outcome = await self._send_one(bot, limiter, user_id, text)
+                    counters[outcome] += 1
+
+                # ذخیره checkpoint بعد از هر دسته کوچک تا بعد از ری‌استارت
+                # فقط تعداد کمی پیام دوباره ارسال شود
+                for i in range(0, len(user_ids), self.CHECKPOINT_EVERY):
+                    chunk = user_ids[i:i + self.CHECKPOINT_EVERY]
+                    await asyncio.gather(*(send(user_id) for user_id in chunk))
+                    last_user_id = chunk[-1]
+                    await asyncio.to_thread(
+                        self._save, job_id, last_user_id=last_user_id, **counters
+                    )
+
+                    if time.monotonic() - last_report >= self.progress_interval:
+                        last_report = time.monotonic()
+                        await self._report(bot, job, counters, limiter, done=False)
+
+            await asyncio.to_thread(
+                self._save, job_id, status='completed', finished_at=datetime.now(), **counters
+            )
+            await self._report(bot, job, counters, limiter, done=True)
+            logger.info(f"✅ Broadcast job #{job_id} completed: {counters}")
+
+        except asyncio.CancelledError:
+            logger.info(f"⏹️ Broadcast job #{job_id} stopped at user {last_user_id}")
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast job #{job_id} failed: {e}", exc_info=True)
+            await asyncio.to_thread(self._save, job_id, status='failed', **counters)
+            try:
+                await bot.send_message(
+                    chat_id=job["admin_chat_id"],
+                    text=f"❌ ارسال همگانی #{job_id} با خطا متوقف شد: {e}\n"
+                         f"آخرین کاربر ارسال شده: {last_user_id}"
+                )
+            except TelegramError:
+                pass
+
+    async def _send_one(self, bot: Bot, limiter: AdaptiveRateLimiter, user_id: int, text: str) -> str:
+        """ارسال به یک کاربر؛ نام شمارنده نتیجه را برمی‌گرداند"""
+        for attempt in range(self.MAX_ATTEMPTS):
+            await limiter.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                limiter.on_success()
+                return "sent_count"
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                limiter.on_retry_after(seconds + 0.5)
+            except Forbidden:
+                return "blocked_count"
+            except BadRequest as e:
+                logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+                return "failed_count"
+            except TimedOut:
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                logger.warning(f"Failed to send broadcast to {user_id}: {e}")
+                return "failed_count"
+        return "failed_count"
+
+    async def _report(self, bot: Bot, job: dict, counters: dict, limiter: AdaptiveRateLimiter, done: bool):
+        """ویرایش پیام وضعیت در چت ادمین"""
+        header = "✅ ارسال پیام کامل شد!" if done else "⏳ در حال ارسال پیام همگانی..."
+        text = (
+            f"{header} (#{job['id']})\n"
+            f"موفق: {counters['sent_count']:,}\n"
+            f"ناموفق: {counters['failed_count']:,}\n"
+            f"ربات را بلاک کرده‌اند: {counters['blocked_count']:,}"
+        )
+        if not done:
+            text += f"\nنرخ فعلی: {limiter.rate:.0f} پیام در ثانیه"
+
+        try:
+            if job.get("status_message_id"):
+                await bot.edit_message_text(
+                    chat_id=job["admin_chat_id"],
+                    message_id=job["status_message_id"],
+                    text=text
+                )
+            else:
+                await bot.send_message(chat_id=job["admin_chat_id"], text=text)
+        except BadRequest as e:
+            # پیام تغییری نکرده یا حذف شده است
+            logger.debug(f"Could not update broadcast progress: {e}")
+        except TelegramError as e:
+            logger.warning(f"Could not report broadcast progress: {e}")
+
+    # === Database helpers (run in worker threads) ===
+    @staticmethod
+    def _create_job(message: str, admin_chat_id: int) -> int:
+        with db_manager.get_session() as session:
+            return BroadcastRepository(session).create_job(message, admin_chat_id).id
+
+    @staticmethod
+    def _load_job(job_id: int) -> Optional[dict]:
+        with db_manager.get_session() as session:
+            job = BroadcastRepository(session).get_job(job_id)
+            if not job:
+                return None
+            return {
+                "id": job.id,
+                "message": job.message,
+                "admin_chat_id": job.admin_chat_id,
+                "status_message_id": job.status_message_id,
+                "last_user_id": job.last_user_id or 0,
+                "sent_count": job.sent_count or 0,
+                "failed_count": job.failed_count or 0,
+                "blocked_count": job.blocked_count or 0,
+            }
+
+    @staticmethod
+    def _unfinished_job_ids() -> list:
+        with db_manager.get_session() as session:
+            return [job.id for job in BroadcastRepository(session).get_unfinished_jobs()]
+
+    def _next_page(self, after_user_id: int) -> list:
+        with db_manager.get_session() as session:
+            return BroadcastRepository(session).get_active_user_ids_page(after_user_id, self.page_size)
+
+    @staticmethod
+    def _save(job_id: int, **fields):
+        with db_manager.get_session() as session:
+            BroadcastRepository(session).save_progress(job_id, **fields)
+
+
+# نمونه global
+broadcast_engine = BroadcastEngine()
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from config.settings import (
+    COACH_HISTORY_TTL, COACH_HISTORY_MAX_TOKENS, COACH_TURN_MAX_TOKENS,
+    COACH_SUMMARY_MODEL, COACH_SUMMARY_MAX_TOKENS
+)
+from services.ai_scheduler import MAINTENANCE_PRIORITY, MAINTENANCE_USER_ID, ai_scheduler
+from services.executor_service import executor_service
+from services.openai_client import completion_client, estimate_text_tokens
+from services.redis_cache_service import redis_cache
+
+logger = logging.getLogger(__name__)
+
+IMAGE_NOTE = "[کاربر یک تصویر نمودار فرستاد]"
+
+SUMMARY_PROMPT = (
+    "تو خلاصه‌ساز گفتگوی یک مربی ترید با شاگردش هستی. خلاصه قبلی و پیام‌های جدید را "
+    "در یک خلاصه کوتاه فارسی ادغام کن: سطح تجربه کاربر، بازار و نمادها، برنامه معاملاتی، "
+    "حد ضرر و اهدافی که گفته، سوال‌های باز و نکاتی که مربی آموزش داده. فقط خلاصه را بنویس."
+)
+
+
+class CoachMemory:
+    """
+    حافظه گفتگوی مربی ترید برای هر کاربر (Redis با TTL)
+
+    نوبت‌های اخیر (بدون تصویر؛ فقط یادداشت ارسال تصویر) ذخیره می‌شوند و
+    در هر درخواست فقط تا سقف COACH_HISTORY_MAX_TOKENS به پیام‌ها اضافه
+    می‌شوند تا حجم درخواست قابل پیش‌بینی بماند. وقتی تاریخچه از سقف بیشتر
+    شود، نوبت‌های قدیمی در پس‌زمینه با COACH_SUMMARY_MODEL در یک خلاصه
+    ادغام می‌شوند (بدون مدل خلاصه‌ساز فقط حذف می‌شوند).
+    """
+
+    KEY_PREFIX = "coach_history"
+
+    def __init__(self, ttl: int = COACH_HISTORY_TTL, max_tokens: int = COACH_HISTORY_MAX_TOKENS,
+                 turn_max_tokens: int = COACH_TURN_MAX_TOKENS, summary_model: str = COACH_SUMMARY_MODEL,
+                 summary_max_tokens: int = COACH_SUMMARY_MAX_TOKENS):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.turn_max_tokens = turn_max_tokens
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+        # user_id -> تسک فشرده‌سازی در حال اجرا (ارجاع نگه داشته می‌شود تا garbage collect نشود)
+        self._compactions: Dict[int, asyncio.Task] = {}
+        self._stats = {"turns": 0, "summaries": 0, "dropped_turns": 0, "summary_errors": 0}
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    # === Storage ===
+    def load(self, user_id: int) -> Dict[str, Any]:
+        state = redis_cache.get(self._key(user_id))
+        if not isinstance(state, dict):
+            return {"summary": "", "turns": []}
+        return state
+
+    def _save(self, user_id: int, state: Dict[str, Any]):
+        state["updated_at"] = time.time()
+        redis_cache.set(self._key(user_id), state, self.ttl)
+
+    def clear(self, user_id: int):
+        """شروع گفتگوی جدید"""
+        redis_cache.delete(self._key(user_id))
+
+    # === Context ===
+    @staticmethod
+    def _turn_tokens(turn: Dict[str, str]) -> int:
+        return estimate_text_tokens(turn["content"])
+
+    def _truncate(self, text: str) -> str:
+        max_chars = self.turn_max_tokens * 3
+        return text if len(text) <= max_chars else text[:max_chars].rstrip() + " …"
+
+    def context_messages(self, user_id: int) -> List[Dict[str, str]]:
+        """خلاصه و جدیدترین نوبت‌هایی که در بودجه توکن جا می‌شوند (به ترتیب زمانی)"""
+        state = self.load(user_id)
+        budget = self.max_tokens
+        messages: List[Dict[str, str]] = []
+
+        summary = state.get("summary")
+        if summary:
+            budget -= estimate_text_tokens(summary)
+
+        for turn in reversed(state.get("turns", [])):
+            tokens = self._turn_tokens(turn)
+            if tokens > budget:
+                break
+            budget -= tokens
+            messages.append({"role": turn["role"], "content": turn["content"]})
+        messages.reverse()
+
+        # گفتگو همیشه با پیام کاربر شروع شود
+        while messages and messages[0]["role"] != "user":
+            messages.pop(0)
+        if summary:
+            messages.insert(0, {"role": "system", "content": f"خلاصه گفتگوی قبلی با این کاربر:\n{summary}"})
+        return messages
+
+    def append_exchange(self, user_id: int, user_text: str, has_image: bool, assistant_text: str) -> bool:
+        """ذخیره یک پرسش و پاسخ؛ True اگر تاریخچه از بودجه بیشتر شده و باید فشرده شود"""
+        question = user_text.strip()
+        if has_image:
+            question = f"{IMAGE_NOTE}\n{question}" if question else IMAGE_NOTE
+
+        state = self.load(user_id)
+        turns = state.setdefault("turns", [])
+        turns.append({"role": "user", "content": self._truncate(question)})
+        turns.append({"role": "assistant", "content": self._truncate(assistant_text)})
+        self._save(user_id, state)
+        self._stats["turns"] += 1
+        return sum(self._turn_tokens(turn) for turn in turns) > self.max_tokens
+
+    # === Compaction ===
+    def schedule_compaction(self, user_id: int):
+        """فشرده‌سازی در پس‌زمینه تا پاسخ کاربر معطل خلاصه‌سازی نشود"""
+        if user_id in self._compactions:
+            return
+        task = asyncio.get_running_loop().create_task(self.compact(user_id))
+        self._compactions[user_id] = task
+        task.add_done_callback(lambda _: self._compactions.pop(user_id, None))
+
+    def _split_overflow(self, turns: List[Dict[str, str]]) -> int:
+        """تعداد نوبت‌های قدیمی که باید خلاصه شوند (نصف بودجه برای نوبت‌های اخیر می‌ماند)"""
+        keep_budget = self.max_tokens // 2
+        kept = 0
+        index = len(turns)
+        while index > 0 and kept + self._turn_tokens(turns[index - 1]) <= keep_budget:
+            index -= 1
+            kept += self._turn_tokens(turns[index])
+        # برش روی مرز پرسش و پاسخ
+        if index % 2:
+            index += 1
+        return min(index, len(turns))
+
+    async def compact(self, user_id: int):
+        state = await executor_service.run_io(self.load, user_id)
+        turns = state.get("turns", [])
+        overflow = self._split_overflow(turns)
+        if not overflow:
+            return
+        old_turns = turns[:overflow]
+
+        summary = state.get("summary", "")
+        if self.summary_model:
+            try:
+                summary = await self._summarize(summary, old_turns)
+                self._stats["summaries"] += 1
+            except Exception as e:
+                # نوبت‌ها حذف نمی‌شوند تا نوبت بعدی بالای بودجه دوباره تلاش کند
+                self._stats["summary_errors"] += 1
+                logger.warning(f"Coach history summary failed for user {user_id}: {e}")
+                return
+
+        # در این فاصله ممکن است نوبت جدیدی اضافه شده باشد؛ فقط نوبت‌های خلاصه شده حذف می‌شوند
+        current = await executor_service.run_io(self.load, user_id)
+        if current.get("turns", [])[:overflow] != old_turns:
+            return
+        current["summary"] = summary
+        current["turns"] = current["turns"][overflow:]
+        self._stats["dropped_turns"] += len(old_turns)
+        await executor_service.run_io(self._save, user_id, current)
+
+    async def _summarize(self, summary: str, turns: List[Dict[str, str]]) -> str:
+        labels = {"user": "کاربر", "assistant": "مربی"}
+        transcript = "\n".join(f"{labels[turn['role']]}: {turn['content']}" for turn in turns)
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"خلاصه قبلی:\n{summary or '-'}\n\nپیام‌های جدید:\n{transcript}"}
+        ]
+        tokens = sum(estimate_text_tokens(m["content"]) for m in messages) + self.summary_max_tokens
+
+        async def call():
+            return await completion_client.complete(
+                messages, self.summary_max_tokens, 0.2, models=[self.summary_model]
+            )
+
+        # نه زیر شناسه خود کاربر: سوال بعدی او نباید پشت این کار پس‌زمینه منتظر بماند
+        completion = await ai_scheduler.run(MAINTENANCE_USER_ID, call, priority=MAINTENANCE_PRIORITY, tokens=tokens)
+        return completion.text.strip()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+
+# نمونه global
+coach_memory = CoachMemory()
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+from config.settings import EXECUTOR_IO_WORKERS, EXECUTOR_CPU_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def _noop() -> None:
+    return None
+
+
+class _PoolMetrics:
+    """عمق صف و زمان اجرای کارهای یک pool"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.in_flight = 0
+        self.peak_queue_depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """کارهایی که منتظر worker آزاد هستند"""
+        return max(self.in_flight - self.workers, 0)
+
+    def started(self):
+        self.submitted += 1
+        self.in_flight += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+
+    def finished(self, elapsed: float, failed: bool):
+        self.in_flight -= 1
+        self.completed += 1
+        self.errors += failed
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "submitted": self.submitted,
+            "errors": self.errors,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 1) if self.completed else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 1),
+        }
+
+
+class ExecutorService:
+    """
+    executor مشترک برای کارهای مسدودکننده خارج از event loop
+
+    - run_io: thread pool برای فایل، Redis و کدگذاری base64 (GIL آزاد می‌شود
+      یا کار کوتاه است و کپی داده به پروسه دیگر نمی‌ارزد)
+    - run_cpu: process pool برای پردازش سنگین تصویر؛ تابع و آرگومان‌ها باید
+      قابل pickle باشند (memoryview را به bytes تبدیل کنید). با
+      EXECUTOR_CPU_WORKERS=0 کار در thread pool انجام می‌شود.
+
+    اگر پروسه‌ای وسط کار بمیرد (مثلاً کمبود حافظه روی تصویر مخرب)، همان کار
+    با BrokenProcessPool شکست می‌خورد و دوباره اجرا نمی‌شود تا پروسه اصلی را
+    هم از کار نیندازد؛ pool در درخواست بعدی از نو ساخته می‌شود و بعد از
+    MAX_POOL_RESTARTS بار، کارهای CPU به thread pool منتقل می‌شوند.
+
+    process pool با fork ساخته می‌شود و start() آن را قبل از شروع threadهای
+    سرویس‌های دیگر گرم می‌کند تا fork در حضور قفل‌های thread انجام نشود.
+    """
+
+    MAX_POOL_RESTARTS = 3
+
+    def __init__(self, io_workers: int = EXECUTOR_IO_WORKERS, cpu_workers: int = EXECUTOR_CPU_WORKERS):
+        self.io_workers = max(1, io_workers)
+        self.cpu_workers = max(0, cpu_workers)
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._cpu_disabled = self.cpu_workers == 0
+        self._pool_restarts = 0
+        self._io_metrics = _PoolMetrics(self.io_workers)
+        self._cpu_metrics = _PoolMetrics(self.cpu_workers or self.io_workers)
+
+    # === Pools ===
+    @property
+    def io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="narmoon-io")
+        return self._io_pool
+
+    def _cpu_executor(self) -> Executor:
+        if self._cpu_disabled:
+            return self.io_pool
+        if self._cpu_pool is None:
+            try:
+                self._cpu_pool = ProcessPoolExecutor(
+                    max_workers=self.cpu_workers, mp_context=multiprocessing.get_context("fork")
+                )
+            except (OSError, ValueError) as e:
+                logger.warning(f"Process pool unavailable, CPU work runs in threads: {e}")
+                self._disable_cpu_pool()
+                return self.io_pool
+        return self._cpu_pool
+
+    def _disable_cpu_pool(self):
+        self._cpu_disabled = True
+        self._cpu_metrics.workers = self.io_workers
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+            self._cpu_pool = None
+
+    async def start(self):
+        """ساخت poolها و اجرای یک کار خالی در process pool"""
+        self.io_pool
+        if not self._cpu_disabled:
+            await self.run_cpu(_noop)
+
+    # === Submitting ===
+    async def _run(self, executor: Executor, metrics: _PoolMetrics, fn: Callable, *args, **kwargs) -> Any:
+        call = functools.partial(fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+        metrics.started()
+        started_at = time.monotonic()
+        failed = True
+        try:
+            result = await loop.run_in_executor(executor, call)
+            failed = False
+            return result
+        finally:
+            metrics.finished(time.monotonic() - started_at, failed)
+
+    async def run_io(self, fn: Callable, *args, **kwargs) -> Any:
+        """اجرای تابع مسدودکننده I/O در thread pool"""
+        return await self._run(self.io_pool, self._io_metrics, fn, *args, **kwargs)
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs) -> Any:
+        """اجرای کار سنگین CPU در process pool (تابع سطح ماژول و آرگومان‌های قابل pickle)"""
+        executor = self._cpu_executor()
+        try:
+            return await self._run(executor, self._cpu_metrics, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._handle_broken_pool(executor)
+            raise
+
+    def _handle_broken_pool(self, executor: Executor):
+        if executor is not self._cpu_pool:
+            return  # کار دیگری قبلاً همین pool را کنار گذاشته
+        self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+        self._cpu_pool = None
+        self._pool_restarts += 1
+        if self._pool_restarts >= self.MAX_POOL_RESTARTS:
+            logger.error(f"Process pool broke {self._pool_restarts} times, CPU work moves to threads")
+            self._disable_cpu_pool()
+        else:
+            logger.error(f"Process pool broke, it is recreated on next use ({self._pool_restarts})")
+
+    # === Lifecycle ===
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "io": self._io_metrics.snapshot(),
+            "cpu": {**self._cpu_metrics.snapshot(), "processes": not self._cpu_disabled,
+                    "pool_restarts": self._pool_restarts},
+        }
+
+    def shutdown(self):
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=False, cancel_futures=True)
+            self._cpu_pool = None
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=False, cancel_futures=True)
+            self._io_pool = None
+
+
+# نمونه global
+executor_service = ExecutorService()
@@ -0,0 +1,284 @@
+import hashlib
+import io
+import logging
+import math
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, NamedTuple, Optional, Union
+
+from config.settings import (
+    VISION_JPEG_QUALITY,
+    VISION_DETAIL_CLASSIC, VISION_DETAIL_MODERN, VISION_DETAIL_COACH,
+    VISION_MAX_TILES_CLASSIC, VISION_MAX_TILES_MODERN
+)
+from services.executor_service import executor_service
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow اختیاری است؛ بدون آن تصویر بدون تغییر ارسال می‌شود
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# تصویر خام: bytes دانلود شده از تلگرام یا memoryview روی آن (بدون کپی)
+ImageData = Union[bytes, bytearray, memoryview]
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# محاسبه توکن تصویر در gpt-4o: detail=high تصویر را در کادر 2048 جا می‌دهد،
+# ضلع کوچک را به 768 می‌رساند و هر کاشی 512 پیکسلی 170 توکن (+85 پایه) است.
+# detail=low همیشه 85 توکن است و در 512x512 دیده می‌شود.
+HIGH_DETAIL_BOX = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+LOW_DETAIL_BOX = 512
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+# سقف پیکسل برای جلوگیری از decompression bomb (حدود 50 مگاپیکسل)
+MAX_IMAGE_PIXELS = 50_000_000
+
+# پروفایل هر نوع تحلیل: سطح detail و سقف کاشی‌ها
+ANALYSIS_PROFILES = {
+    "classic": {"detail": VISION_DETAIL_CLASSIC, "max_tiles": VISION_MAX_TILES_CLASSIC},
+    "modern": {"detail": VISION_DETAIL_MODERN, "max_tiles": VISION_MAX_TILES_MODERN},
+    "coach": {"detail": VISION_DETAIL_COACH, "max_tiles": VISION_MAX_TILES_CLASSIC},
+}
+
+
+class PreparedImage(NamedTuple):
+    data: ImageData
+    mime_type: str
+    detail: str
+    width: int
+    height: int
+    original_size: int
+    estimated_tokens: int
+
+
+def detect_image_mime(image: ImageData, default: str = "image/jpeg") -> str:
+    """تشخیص نوع تصویر از روی چند بایت اول"""
+    head = bytes(image[:12])
+    for signature, mime in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+
+def estimate_tokens(width: int, height: int, detail: str) -> int:
+    """توکن ورودی تصویری با این ابعاد (بعد از تغییر اندازه سمت سرور)"""
+    if detail == "low":
+        return BASE_TOKENS
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def target_size(width: int, height: int, detail: str, max_tiles: Optional[int] = None) -> tuple:
+    """
+    ابعادی که مدل واقعاً می‌بیند؛ ارسال تصویر بزرگ‌تر فقط حجم آپلود را زیاد می‌کند.
+    با max_tiles تصویر تا جایی کوچک می‌شود که تعداد کاشی‌ها از سقف بیشتر نشود.
+    """
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_BOX / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    scale = min(1.0, HIGH_DETAIL_BOX / max(width, height))
+    short_side = min(width, height) * scale
+    if short_side > HIGH_DETAIL_SHORT_SIDE:
+        scale *= HIGH_DETAIL_SHORT_SIDE / short_side
+    new_width, new_height = width * scale, height * scale
+
+    if max_tiles:
+        while math.ceil(new_width / TILE_SIZE) * math.ceil(new_height / TILE_SIZE) > max_tiles:
+            # کوچک کردن ضلع بزرگ‌تر تا مرز کاشی قبلی
+            long_side = max(new_width, new_height)
+            tiles_long = math.ceil(long_side / TILE_SIZE) - 1
+            if tiles_long < 1:
+                break
+            shrink = (tiles_long * TILE_SIZE) / long_side
+            new_width, new_height = new_width * shrink, new_height * shrink
+
+    return max(1, round(new_width)), max(1, round(new_height))
+
+
+# اندازه dHash اثر انگشت (۱۶ یعنی ۲۵۶ بیت)؛ dHash ۶۴ بیتی روی نمودارهای با
+# پس‌زمینه تیره بیشتر پس‌زمینه را می‌بیند و نمودارهای متفاوت را نزدیک نشان می‌دهد
+FINGERPRINT_HASH_SIZE = 16
+
+
+def dhash(image: ImageData, size: int = 8) -> Optional[int]:
+    """
+    هش ادراکی (difference hash) با size*size بیت؛ تصاویر تقریباً یکسان (فشرده‌سازی
+    دوباره، تغییر اندازه، فوروارد در تلگرام) فاصله همینگ کمی دارند.
+    بدون Pillow یا برای تصویر نامعتبر None برمی‌گرداند.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image)) as source:
+            source.draft("L", (size * 4, size * 4))
+            pixels = list(source.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    except Exception:
+        return None
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class ImageFingerprint(NamedTuple):
+    sha256: str
+    dhash: Optional[int]
+
+
+def fingerprint_image(image: ImageData) -> ImageFingerprint:
+    """sha256 بایت‌ها و dHash تصویر"""
+    return ImageFingerprint(hashlib.sha256(image).hexdigest(), dhash(image, FINGERPRINT_HASH_SIZE))
+
+
+def prepare_image(image: bytes, detail: str = "high", max_tiles: Optional[int] = None,
+                  mime_type: Optional[str] = None, quality: int = VISION_JPEG_QUALITY) -> tuple:
+    """
+    کوچک‌سازی و فشرده‌سازی تصویر؛ در پروسه جداگانه اجرا می‌شود پس state
+    ندارد و (PreparedImage، نتیجه) برمی‌گرداند: processed، passthrough یا error.
+    در حالت passthrough فیلد data برابر None است تا بایت‌ها دوباره بین
+    پروسه‌ها کپی نشوند؛ فراخواننده تصویر اصلی را جایگزین می‌کند.
+    """
+    original_size = len(image)
+    if Image is None:
+        return _passthrough(image, detail, mime_type), "passthrough"
+
+    try:
+        with Image.open(io.BytesIO(image)) as source:
+            if source.width * source.height > MAX_IMAGE_PIXELS:
+                raise ValueError(f"image too large: {source.width}x{source.height}")
+
+            # ابعاد بعد از اعمال چرخش EXIF
+            oriented = source.size
+            if source.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                oriented = (source.height, source.width)
+            width, height = target_size(oriented[0], oriented[1], detail, max_tiles)
+            needs_resize = (width, height) != oriented
+            # JPEG را مستقیم با مقیاس کوچک‌تر decode می‌کند (سریع‌تر و کم‌حافظه‌تر)
+            box = max(width, height)
+            source.draft("RGB", (box, box))
+            has_metadata = bool(source.info.get("exif") or source.info.get("icc_profile"))
+
+            if not needs_resize and not has_metadata and source.format == "JPEG":
+                # تصویر از قبل در اندازه مناسب است؛ فشرده‌سازی دوباره فقط کیفیت را کم می‌کند
+                return PreparedImage(None, "image/jpeg", detail, width, height, original_size,
+                                     estimate_tokens(width, height, detail)), "passthrough"
+
+            frame = ImageOps.exif_transpose(source)
+            if frame.mode in ("RGBA", "LA", "P"):
+                # پس‌زمینه سفید برای تصاویر شفاف (JPEG کانال آلفا ندارد)
+                frame = frame.convert("RGBA")
+                background = Image.new("RGB", frame.size, (255, 255, 255))
+                background.paste(frame, mask=frame.getchannel("A"))
+                frame = background
+            elif frame.mode != "RGB":
+                frame = frame.convert("RGB")
+
+            if frame.size != (width, height):
+                frame = frame.resize((width, height), Image.LANCZOS)
+
+            output = io.BytesIO()
+            # بدون exif/icc: metadata حذف می‌شود
+            frame.save(output, format="JPEG", quality=quality, optimize=True)
+            data = output.getvalue()
+
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, sending original: {e}")
+        return _passthrough(image, detail, mime_type), "error"
+
+    return PreparedImage(data, "image/jpeg", detail, width, height, original_size,
+                         estimate_tokens(width, height, detail)), "processed"
+
+
+def _passthrough(image: ImageData, detail: str, mime_type: Optional[str]) -> PreparedImage:
+    return PreparedImage(None, mime_type or detect_image_mime(image), detail, 0, 0, len(image), 0)
+
+
+class ImagePreprocessor:
+    """
+    آماده‌سازی تصاویر چارت برای مدل بینایی
+
+    تصویر به اندازه‌ای که مدل واقعاً پردازش می‌کند کوچک می‌شود، metadata
+    (EXIF و ...) حذف و دوباره با JPEG فشرده می‌شود. decode، encode و dHash
+    در process pool مشترک executor_service انجام می‌شوند تا نه event loop
+    و نه GIL پردازش بقیه درخواست‌ها را معطل کند.
+    """
+
+    def __init__(self, quality: int = VISION_JPEG_QUALITY):
+        self.quality = quality
+        self._stats = {"processed": 0, "passthrough": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+        if Image is None:
+            logger.warning("Pillow is not installed, images are sent to the vision model unchanged")
+
+    @staticmethod
+    def profile(analysis_type: str) -> Dict[str, Any]:
+        return ANALYSIS_PROFILES.get(analysis_type, ANALYSIS_PROFILES["classic"])
+
+    async def prepare(self, image: ImageData, analysis_type: str = "classic",
+                      mime_type: Optional[str] = None) -> PreparedImage:
+        """کوچک‌سازی و فشرده‌سازی تصویر در process pool"""
+        profile = self.profile(analysis_type)
+        if Image is None:
+            prepared, outcome = _passthrough(image, profile["detail"], mime_type), "passthrough"
+        else:
+            try:
+                # memoryview قابل pickle نیست
+                prepared, outcome = await executor_service.run_cpu(
+                    prepare_image, bytes(image), profile["detail"], profile["max_tiles"], mime_type, self.quality
+                )
+            except BrokenProcessPool as e:
+                logger.warning(f"Image preprocessing worker died, sending original: {e}")
+                prepared, outcome = _passthrough(image, profile["detail"], mime_type), "error"
+        if prepared.data is None:
+            prepared = prepared._replace(data=image)
+        self._record(prepared, outcome)
+        return prepared
+
+    def _record(self, prepared: PreparedImage, outcome: str):
+        self._stats["bytes_in"] += prepared.original_size
+        self._stats["bytes_out"] += len(prepared.data)
+        if outcome == "error":
+            self._stats["errors"] += 1
+            outcome = "passthrough"
+        self._stats[outcome] += 1
+        if outcome == "processed":
+            logger.debug(
+                f"Image prepared: {prepared.original_size:,} -> {len(prepared.data):,} bytes, "
+                f"{prepared.width}x{prepared.height}, detail={prepared.detail}"
+            )
+
+    async def fingerprint(self, image: ImageData) -> ImageFingerprint:
+        """sha256 بایت‌ها و dHash تصویر (در process pool)"""
+        if Image is None:
+            # فقط sha256 (hashlib روی داده بزرگ GIL را آزاد می‌کند)
+            return await executor_service.run_io(fingerprint_image, image)
+        try:
+            return await executor_service.run_cpu(fingerprint_image, bytes(image))
+        except BrokenProcessPool:
+            # بدون dHash فقط تصاویر دقیقاً یکسان از کش خوانده می‌شوند
+            digest = await executor_service.run_io(lambda: hashlib.sha256(image).hexdigest())
+            return ImageFingerprint(digest, None)
+
+    def stats(self) -> Dict[str, Any]:
+        data = dict(self._stats)
+        data["pillow"] = Image is not None
+        data["saved_ratio"] = round(1 - data["bytes_out"] / data["bytes_in"], 3) if data["bytes_in"] else 0.0
+        return data
+
+
+# نمونه global
+image_preprocessor = ImagePreprocessor()
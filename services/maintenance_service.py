@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, TelegramError
+
+from config.settings import CLEANUP_BATCH_SIZE, RETENTION_INTERVAL_HOURS
+from database import db_manager
+from database.repository import AdminRepository
+from database.retention import RetentionManager
+from services.stats_service import stats_service
+from services.user_cache_service import user_profile_cache
+from services.user_registry_service import user_registry
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceService:
+    """
+    اجرای عملیات سنگین نگهداری دیتابیس به صورت job پس‌زمینه
+
+    کار دیتابیس در thread جداگانه اجرا می‌شود و پیشرفت با ویرایش یک پیام
+    در چت ادمین گزارش می‌شود تا هندلر ادمین و event loop مسدود نشوند.
+    """
+
+    PROGRESS_INTERVAL = 5.0
+
+    def __init__(self, batch_size: int = CLEANUP_BATCH_SIZE,
+                 retention_interval: float = RETENTION_INTERVAL_HOURS * 3600):
+        self.batch_size = batch_size
+        self.retention_interval = retention_interval
+        self._task: Optional[asyncio.Task] = None
+        self._retention_task: Optional[asyncio.Task] = None
+        self._retention_lock: Optional[asyncio.Lock] = None
+        self.last_retention_report: Optional[Dict[str, Any]] = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start_cleanup(self, bot: Bot, chat_id: int, status_message_id: int,
+                      use_truncate: Optional[bool] = None) -> bool:
+        """شروع پاک‌سازی در پس‌زمینه؛ اگر job دیگری در حال اجرا باشد False برمی‌گرداند"""
+        if self.is_running():
+            return False
+        self._task = asyncio.get_running_loop().create_task(
+            self._run_cleanup(bot, chat_id, status_message_id, use_truncate)
+        )
+        return True
+
+    async def _run_cleanup(self, bot: Bot, chat_id: int, status_message_id: int,
+                           use_truncate: Optional[bool]):
+        loop = asyncio.get_running_loop()
+        progress: Dict[str, Any] = {}
+        last_report = [0.0]
+
+        def on_progress(table_name: str, deleted: Optional[int], finished: bool):
+            # از thread پاک‌سازی فراخوانی می‌شود
+            progress[table_name] = {"deleted": deleted, "finished": finished}
+            now = time.monotonic()
+            if finished or now - last_report[0] >= self.PROGRESS_INTERVAL:
+                last_report[0] = now
+                asyncio.run_coroutine_threadsafe(
+                    self._edit(bot, chat_id, status_message_id, self._format_progress(progress)),
+                    loop
+                )
+
+        try:
+            users_before, cleanup_results, sequences_reset = await asyncio.to_thread(
+                self._cleanup, use_truncate, on_progress
+            )
+        except Exception as e:
+            logger.error(f"Database cleanup failed: {e}", exc_info=True)
+            await self._edit(
+                bot, chat_id, status_message_id,
+                f"❌ خطا در پاک‌سازی دیتابیس: {e}\n\n{self._format_progress(progress)}"
+            )
+            return
+
+        # پروفایل‌ها، کاربران و آمار کش شده دیگر معتبر نیستند
+        user_profile_cache.clear()
+        user_registry.clear()
+        stats_service.invalidate()
+
+        result_message = f"🧹 **پاک‌سازی دیتابیس کامل شد**\n\n"
+        result_message += f"📊 **آمار کلی:**\n"
+        result_message += f"• کاربران قبل: {users_before:,}\n"
+        result_message += f"• Sequences Reset: {'✅' if sequences_reset else '❌'}\n\n"
+        result_message += f"📋 **جزئیات جداول:**\n"
+        for table_name, results in cleanup_results.items():
+            if results['method'] == 'truncate':
+                result_message += f"• **{table_name}:** TRUNCATE شد\n"
+            else:
+                result_message += f"• **{table_name}:** {results['deleted']:,} حذف شده\n"
+        result_message += f"\n✨ **دیتابیس آماده تست‌های جدید است!**"
+
+        await self._edit(bot, chat_id, status_message_id, result_message)
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="🔄 دیتابیس بازنشانی شد. همه کاربران حالا می‌توانند با حساب تمیز شروع کنند."
+            )
+        except TelegramError:
+            pass
+
+    def _cleanup(self, use_truncate: Optional[bool], on_progress):
+        with db_manager.get_session() as session:
+            repo = AdminRepository(session)
+            users_before = repo.get_user_statistics()['total_users']
+            cleanup_results = repo.cleanup_database(
+                batch_size=self.batch_size,
+                use_truncate=use_truncate,
+                progress_callback=on_progress
+            )
+            # TRUNCATE ... RESTART IDENTITY خودش sequenceها را ریست می‌کند
+            truncated = any(r['method'] == 'truncate' for r in cleanup_results.values())
+            sequences_reset = True if truncated else repo.reset_sequences()
+        return users_before, cleanup_results, sequences_reset
+
+    # === Retention ===
+    async def run_retention(self) -> Dict[str, Any]:
+        """یک دور فشرده‌سازی و حذف داده‌های منقضی (در thread جداگانه)"""
+        if self._retention_lock is None:
+            self._retention_lock = asyncio.Lock()
+        async with self._retention_lock:
+            report = await asyncio.to_thread(self._retention_pass)
+        self.last_retention_report = report
+        return report
+
+    def _retention_pass(self) -> Dict[str, Any]:
+        with db_manager.get_session() as session:
+            return RetentionManager(session, self.batch_size).run()
+
+    async def partition_table(self, table_name: str) -> bool:
+        """تبدیل یک جدول به جدول پارتیشن‌بندی شده ماهانه (فقط PostgreSQL)"""
+        def convert():
+            with db_manager.get_session() as session:
+                return RetentionManager(session, self.batch_size).convert_to_partitioned(table_name)
+
+        if self._retention_lock is None:
+            self._retention_lock = asyncio.Lock()
+        async with self._retention_lock:
+            return await asyncio.to_thread(convert)
+
+    async def _retention_loop(self):
+        while True:
+            try:
+                await self.run_retention()
+            except Exception as e:
+                logger.error(f"Retention pass failed: {e}", exc_info=True)
+            await asyncio.sleep(self.retention_interval)
+
+    def start(self):
+        """شروع اجرای دوره‌ای retention"""
+        if self._retention_task is None and self.retention_interval > 0:
+            self._retention_task = asyncio.get_running_loop().create_task(self._retention_loop())
+
+    async def stop(self):
+        for task in (self._retention_task, self._task):
+            if task and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._retention_task = None
+
+    @staticmethod
+    def _format_progress(progress: Dict[str, Any]) -> str:
+        lines = ["🧹 در حال پاک‌سازی دیتابیس..."]
+        for table_name, info in progress.items():
+            mark = "✅" if info["finished"] else "⏳"
+            deleted = "TRUNCATE" if info["deleted"] is None else f"{info['deleted']:,}"
+            lines.append(f"{mark} {table_name}: {deleted}")
+        return "\n".join(lines)
+
+    @staticmethod
+    async def _edit(bot: Bot, chat_id: int, message_id: int, text: str):
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except BadRequest as e:
+            logger.debug(f"Could not update cleanup progress: {e}")
+        except TelegramError as e:
+            logger.warning(f"Could not report cleanup progress: {e}")
+
+
+# نمونه global
+maintenance_service = MaintenanceService()
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+import openai
+
+from config.settings import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_FALLBACK_MODELS, OPENAI_TIMEOUT, OPENAI_CONNECT_TIMEOUT,
+    OPENAI_MAX_RETRIES, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY,
+    OPENAI_PROMPT_CACHE_KEY, OPENAI_INPUT_PRICE_PER_1M, OPENAI_CACHED_INPUT_PRICE_PER_1M
+)
+from services.ai_scheduler import ai_scheduler
+
+logger = logging.getLogger(__name__)
+
+# دریافت کننده تکه‌های متن در حالت stream (مثلاً TelegramStreamWriter.append)
+DeltaCallback = Callable[[str], Awaitable[None]]
+
+# خطاهای موقتی که ارزش تلاش دوباره دارند
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+    openai.ConflictError,
+)
+
+
+def estimate_text_tokens(text: str) -> int:
+    """تخمین محافظه‌کارانه توکن متن (حدود ۳ کاراکتر فارسی/انگلیسی در هر توکن)"""
+    return len(text) // 3 + 4
+
+
+class Completion(NamedTuple):
+    text: str
+    model: str
+    total_tokens: Optional[int]
+    attempts: int
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+
+def _usage_counts(usage) -> tuple:
+    """(total, prompt, cached) از فیلد usage؛ cached_tokens در prompt_tokens_details است"""
+    if not usage:
+        return None, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens") or 0
+    else:
+        cached = getattr(details, "cached_tokens", 0) or 0
+    return usage.total_tokens, usage.prompt_tokens or 0, cached
+
+
+class PromptCacheStats:
+    """
+    آمار prompt caching سمت OpenAI به تفکیک کلید پرامپت
+
+    OpenAI پیشوند ثابت درخواست (از حدود ۱۰۲۴ توکن به بالا) را کش می‌کند و
+    توکن‌های کش شده را با تخفیف حساب می‌کند؛ صرفه‌جویی با قیمت‌های تنظیمات
+    برآورد می‌شود.
+    """
+
+    def __init__(self, input_price: float = OPENAI_INPUT_PRICE_PER_1M,
+                 cached_price: float = OPENAI_CACHED_INPUT_PRICE_PER_1M):
+        self.input_price = input_price
+        self.cached_price = cached_price
+        self._by_key: Dict[str, Dict[str, int]] = {}
+
+    def record(self, cache_key: Optional[str], prompt_tokens: int, cached_tokens: int):
+        entry = self._by_key.setdefault(cache_key or "-", {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0})
+        entry["requests"] += 1
+        entry["prompt_tokens"] += prompt_tokens
+        entry["cached_tokens"] += cached_tokens
+
+    def _saved_usd(self, cached_tokens: int) -> float:
+        return cached_tokens * (self.input_price - self.cached_price) / 1_000_000
+
+    def report(self) -> Dict[str, Any]:
+        keys = {}
+        for key, entry in self._by_key.items():
+            keys[key] = {
+                **entry,
+                "cached_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 3) if entry["prompt_tokens"] else 0.0,
+                "saved_usd": round(self._saved_usd(entry["cached_tokens"]), 4),
+            }
+        prompt_tokens = sum(entry["prompt_tokens"] for entry in self._by_key.values())
+        cached_tokens = sum(entry["cached_tokens"] for entry in self._by_key.values())
+        return {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else 0.0,
+            "saved_usd": round(self._saved_usd(cached_tokens), 4),
+            "keys": keys,
+        }
+
+
+class ResilientCompletionClient:
+    """
+    کلاینت chat completion با timeout، تلاش دوباره و مدل جایگزین
+
+    - خطاهای موقتی (429، 5xx، timeout، قطع اتصال) با backoff نمایی و jitter
+      دوباره تلاش می‌شوند و هدر retry-after سرور رعایت می‌شود
+    - اگر مدل اصلی بعد از همه تلاش‌ها (یا به خاطر در دسترس نبودن مدل)
+      جواب ندهد، مدل بعدی زنجیره OPENAI_FALLBACK_MODELS امتحان می‌شود
+    - در حالت stream فقط تا قبل از رسیدن اولین تکه متن تلاش دوباره انجام
+      می‌شود؛ بعد از آن کاربر بخشی از پاسخ را دیده و خطا بالا می‌رود
+    - retryهای داخلی SDK خاموش است تا زمان‌بندی فقط در یک جا باشد
+    - با cache_key درخواست‌های یک پرامپت با prompt_cache_key به سرورهای
+      یکسان هدایت می‌شوند تا پیشوند ثابت (پرامپت سیستم) از کش خوانده شود
+    """
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, model: str = OPENAI_MODEL,
+                 fallback_models: Optional[List[str]] = None, timeout: float = OPENAI_TIMEOUT,
+                 connect_timeout: float = OPENAI_CONNECT_TIMEOUT, max_retries: int = OPENAI_MAX_RETRIES,
+                 base_delay: float = OPENAI_RETRY_BASE_DELAY, max_delay: float = OPENAI_RETRY_MAX_DELAY,
+                 on_rate_limit: Optional[Callable[[float], None]] = None):
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            max_retries=0
+        )
+        self.models = [model] + [m for m in (OPENAI_FALLBACK_MODELS if fallback_models is None else fallback_models)
+                                 if m != model]
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # اطلاع به صف درخواست‌ها تا بقیه درخواست‌ها هم مکث کنند
+        self.on_rate_limit = on_rate_limit
+        self._stats = {"requests": 0, "retries": 0, "fallbacks": 0, "failures": 0}
+        self.prompt_cache = PromptCacheStats()
+
+    async def complete(self, messages: list, max_tokens: int, temperature: float,
+                       on_delta: Optional[DeltaCallback] = None, cache_key: Optional[str] = None,
+                       models: Optional[List[str]] = None) -> Completion:
+        """
+        فراخوانی با زنجیره مدل‌ها (پیش‌فرض self.models)؛ متن کامل، مدل استفاده
+        شده و مصرف توکن را برمی‌گرداند
+        """
+        self._stats["requests"] += 1
+        attempts = 0
+        last_error: Optional[Exception] = None
+        streamed = [False]
+
+        for index, model in enumerate(models or self.models):
+            if index:
+                self._stats["fallbacks"] += 1
+                logger.warning(f"Falling back to model {model} after: {last_error}")
+
+            for retry in range(self.max_retries + 1):
+                attempts += 1
+                try:
+                    text, usage = await self._create(model, messages, max_tokens, temperature,
+                                                     on_delta, streamed, cache_key)
+                    total_tokens, prompt_tokens, cached_tokens = _usage_counts(usage)
+                    self.prompt_cache.record(cache_key, prompt_tokens, cached_tokens)
+                    return Completion(text, model, total_tokens, attempts, prompt_tokens, cached_tokens)
+                except (openai.NotFoundError, openai.PermissionDeniedError) as e:
+                    # مدل برای این حساب در دسترس نیست؛ مستقیم سراغ مدل بعدی
+                    last_error = e
+                    break
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    if streamed[0] or self._is_quota_error(e):
+                        self._stats["failures"] += 1
+                        raise
+                    if retry == self.max_retries:
+                        break
+                    delay = self._retry_delay(e, retry)
+                    if isinstance(e, openai.RateLimitError) and self.on_rate_limit:
+                        self.on_rate_limit(delay)
+                    self._stats["retries"] += 1
+                    logger.warning(
+                        f"OpenAI {model} attempt {retry + 1} failed ({type(e).__name__}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+
+        self._stats["failures"] += 1
+        raise last_error
+
+    async def _create(self, model: str, messages: list, max_tokens: int, temperature: float,
+                      on_delta: Optional[DeltaCallback], streamed: list, cache_key: Optional[str]) -> tuple:
+        """(متن پاسخ، usage)"""
+        # prompt_cache_key در این نسخه SDK پارامتر مستقل ندارد
+        extra_body = {"prompt_cache_key": cache_key} if cache_key and OPENAI_PROMPT_CACHE_KEY else None
+        if on_delta is None:
+            response = await self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                extra_body=extra_body
+            )
+            return response.choices[0].message.content, getattr(response, "usage", None)
+
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            extra_body=extra_body
+        )
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                streamed[0] = True
+                await on_delta(delta)
+        return "".join(parts), usage
+
+    def _retry_delay(self, error: Exception, retry: int) -> float:
+        """retry-after سرور در صورت وجود، وگرنه backoff نمایی با full jitter"""
+        server_delay = self._retry_after(error)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            return None
+        return None
+
+    @staticmethod
+    def _is_quota_error(error: Exception) -> bool:
+        """429 به خاطر تمام شدن اعتبار حساب با تلاش دوباره درست نمی‌شود"""
+        return isinstance(error, openai.RateLimitError) and getattr(error, "code", None) == "insufficient_quota"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"models": list(self.models), **self._stats, "prompt_cache": self.prompt_cache.report()}
+
+
+# نمونه global
+completion_client = ResilientCompletionClient(on_rate_limit=ai_scheduler.pause)
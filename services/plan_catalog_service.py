@@ -0,0 +1,231 @@
+import logging
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, NamedTuple, Optional
+
+from services.redis_cache_service import redis_cache
+
+logger = logging.getLogger(__name__)
+
+# نرخ پیش‌فرض کمیسیون (درصد) وقتی referral_settings کلید پلن را ندارد
+DEFAULT_PLAN_COMMISSION_RATES = {
+    "TNT_MINI": Decimal("20.00"),
+    "TNT_PLUS": Decimal("25.00"),
+    "TNT_MAX": Decimal("30.00"),
+}
+# خرید با پلن ناشناخته: ۲۰٪ از ۶ دلار در ماه
+FALLBACK_COMMISSION = (Decimal("20.00"), Decimal("6.00"))
+
+
+class PlanInfo(NamedTuple):
+    plan_name: str
+    display_name: str
+    price_usd: Decimal
+    monthly_limit: int
+    hourly_limit: int
+    vip_access: bool
+    is_active: bool
+
+
+class CatalogSnapshot(NamedTuple):
+    plans: Mapping[str, PlanInfo]
+    settings: Mapping[str, str]
+    loaded_at: float
+
+
+class PlanCatalog:
+    """
+    کاتالوگ پلن‌های TNT و تنظیمات رفرال در حافظه
+
+    جداول tnt_plans و referral_settings یک بار هنگام راه‌اندازی خوانده
+    می‌شوند و به صورت snapshot تغییرناپذیر نگه داشته می‌شوند؛ بارگذاری مجدد
+    یک snapshot جدید می‌سازد و فقط ارجاع را جایگزین می‌کند، پس خواننده‌ها
+    نیازی به قفل ندارند. بعد از تغییر پلن‌ها، reload_and_publish پیام
+    pub/sub می‌فرستد تا بقیه پروسه‌ها هم دوباره بارگذاری کنند.
+    """
+
+    CHANNEL = "narmoon:plan_catalog"
+    COMMISSION_KEY_PREFIX = "commission_rate_"
+    POLL_TIMEOUT = 5.0
+
+    def __init__(self):
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._load_lock = threading.Lock()
+        self._pubsub = None
+        self._listener: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._stats = {"reloads": 0, "remote_reloads": 0, "errors": 0}
+
+    # === Loading ===
+    def reload(self) -> CatalogSnapshot:
+        """خواندن پلن‌ها و تنظیمات از دیتابیس و جایگزینی snapshot"""
+        # ایمپورت داخل تابع: لایه database خودش از این سرویس استفاده می‌کند
+        from database import db_manager
+        from database.models import TntPlan, ReferralSetting
+
+        with self._load_lock:
+            try:
+                with db_manager.get_session() as session:
+                    plans = {
+                        plan.plan_name: PlanInfo(
+                            plan_name=plan.plan_name,
+                            display_name=plan.plan_display_name,
+                            price_usd=Decimal(str(plan.price_usd or 0)),
+                            monthly_limit=plan.monthly_limit or 0,
+                            hourly_limit=plan.hourly_limit or 0,
+                            vip_access=bool(plan.vip_access),
+                            is_active=bool(plan.is_active),
+                        )
+                        for plan in session.query(TntPlan).all()
+                    }
+                    settings = {
+                        setting.setting_key: setting.setting_value
+                        for setting in session.query(ReferralSetting).all()
+                    }
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Error loading plan catalog: {e}")
+                if self._snapshot is None:
+                    raise
+                return self._snapshot
+
+            self._snapshot = CatalogSnapshot(
+                plans=MappingProxyType(plans),
+                settings=MappingProxyType(settings),
+                loaded_at=time.time()
+            )
+            self._stats["reloads"] += 1
+
+        logger.info(f"📋 Plan catalog loaded: {len(plans)} plans, {len(settings)} settings")
+        return self._snapshot
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            # اسکریپت‌ها و CLI بدون start() هم کار کنند
+            snapshot = self.reload()
+        return snapshot
+
+    # === Plans ===
+    def get_plan(self, plan_name: str, include_inactive: bool = False) -> Optional[PlanInfo]:
+        plan = self.snapshot.plans.get(plan_name)
+        if plan is None or (not plan.is_active and not include_inactive):
+            return None
+        return plan
+
+    def active_plans(self) -> Dict[str, PlanInfo]:
+        return {name: plan for name, plan in self.snapshot.plans.items() if plan.is_active}
+
+    # === Referral settings ===
+    def get_setting(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.snapshot.settings.get(key, default)
+
+    def get_decimal_setting(self, key: str, default: Decimal) -> Decimal:
+        value = self.get_setting(key)
+        if value is None:
+            return default
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            logger.warning(f"Invalid decimal referral setting {key}={value!r}")
+            return default
+
+    def commission_terms(self, plan_name: str) -> tuple:
+        """(نرخ کمیسیون به درصد، قیمت ماهانه پلن به دلار)"""
+        plan = self.snapshot.plans.get(plan_name)
+        if plan is None or plan.price_usd <= 0:
+            return FALLBACK_COMMISSION
+        default_rate = DEFAULT_PLAN_COMMISSION_RATES.get(plan_name, FALLBACK_COMMISSION[0])
+        rate = self.get_decimal_setting(f"{self.COMMISSION_KEY_PREFIX}{plan_name}", default_rate)
+        return rate, plan.price_usd
+
+    def compute_commission(self, plan_name: str, duration: int) -> Dict[str, float]:
+        """مبلغ کمیسیون یک خرید: قیمت ماهانه * تعداد ماه * نرخ پلن"""
+        rate, base_price = self.commission_terms(plan_name)
+        base_amount = float(base_price) * (duration / 30)
+        commission_amount = base_amount * float(rate) / 100
+        bonus_amount = 0  # در آینده می‌تونیم بونوس اضافه کنیم
+        return {
+            "commission_amount": commission_amount,
+            "bonus_amount": bonus_amount,
+            "total_amount": commission_amount + bonus_amount
+        }
+
+    # === Pub/Sub ===
+    def reload_and_publish(self) -> CatalogSnapshot:
+        """بارگذاری مجدد محلی و اطلاع به بقیه پروسه‌ها"""
+        snapshot = self.reload()
+        client = redis_cache.redis_client
+        if client is not None:
+            try:
+                client.publish(self.CHANNEL, str(snapshot.loaded_at))
+            except Exception as e:
+                logger.warning(f"Could not publish plan catalog reload: {e}")
+        return snapshot
+
+    def _listen(self):
+        # get_message با timeout به جای listen(): کلاینت Redis socket_timeout دارد
+        while not self._stop_event.is_set():
+            try:
+                message = self._pubsub.get_message(timeout=self.POLL_TIMEOUT)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                logger.warning(f"Plan catalog pub/sub error: {e}")
+                self._stop_event.wait(self.POLL_TIMEOUT)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+            try:
+                self.reload()
+                self._stats["remote_reloads"] += 1
+            except Exception as e:
+                logger.error(f"Plan catalog reload from pub/sub failed: {e}")
+
+    # === Lifecycle ===
+    def start(self):
+        """بارگذاری اولیه و گوش دادن به کانال reload"""
+        self.reload()
+        client = redis_cache.redis_client
+        if client is None or self._listener is not None:
+            return
+        try:
+            self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(self.CHANNEL)
+        except Exception as e:
+            logger.warning(f"Plan catalog pub/sub unavailable: {e}")
+            self._pubsub = None
+            return
+        self._stop_event.clear()
+        self._listener = threading.Thread(target=self._listen, name="plan-catalog-pubsub", daemon=True)
+        self._listener.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._listener is not None:
+            self._listener.join(timeout=self.POLL_TIMEOUT + 1)
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+        self._pubsub = None
+        self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "plans": len(snapshot.plans) if snapshot else 0,
+            "settings": len(snapshot.settings) if snapshot else 0,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "pubsub": self._listener is not None,
+            **self._stats
+        }
+
+
+# نمونه global
+plan_catalog = PlanCatalog()
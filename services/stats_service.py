@@ -0,0 +1,66 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from config.settings import STATS_CACHE_TTL, STATS_ESTIMATE_THRESHOLD, STATS_USE_ESTIMATES
+from database import db_manager
+from database.repository import StatsRepository
+
+logger = logging.getLogger(__name__)
+
+
+class StatsService:
+    """سرویس آمار داشبوردهای ادمین با کش کوتاه‌مدت"""
+
+    def __init__(self, ttl: int = STATS_CACHE_TTL):
+        self.ttl = ttl
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, name: str, loader: Callable[[StatsRepository], Any], force_refresh: bool = False) -> Any:
+        now = time.monotonic()
+        if not force_refresh:
+            with self._lock:
+                entry = self._cache.get(name)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        # آمار فقط خواندنی است و در صورت وجود از read replica خوانده می‌شود
+        with db_manager.session_for(StatsRepository) as session:
+            result = loader(StatsRepository(session))
+
+        # نتایج ناموفق کش نمی‌شوند
+        if not (isinstance(result, dict) and result.get("success") is False):
+            with self._lock:
+                self._cache[name] = (now + self.ttl, result)
+        return result
+
+    def user_statistics(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """آمار کاربران و درآمد ماه جاری"""
+        return self._cached("user_statistics", lambda repo: repo.get_user_statistics(), force_refresh)
+
+    def tnt_statistics(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """آمار پلن‌ها و استفاده امروز TNT"""
+        return self._cached("tnt_statistics", lambda repo: repo.get_tnt_subscription_stats(), force_refresh)
+
+    def referral_overview(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """نمای کلی سیستم رفرال"""
+        return self._cached("referral_overview", lambda repo: repo.get_referral_overview(), force_refresh)
+
+    def table_counts(self, force_refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+        """تعداد ردیف جداول (تخمینی برای جداول بزرگ در PostgreSQL)"""
+        return self._cached(
+            "table_counts",
+            lambda repo: repo.get_table_counts(STATS_USE_ESTIMATES, STATS_ESTIMATE_THRESHOLD),
+            force_refresh
+        )
+
+    def invalidate(self):
+        """پاک کردن کش آمار (مثلاً بعد از پاک‌سازی دیتابیس)"""
+        with self._lock:
+            self._cache.clear()
+
+
+# نمونه global
+stats_service = StatsService()
@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from config.settings import USER_CACHE_LOCAL_TTL, USER_CACHE_MAX_SIZE, USER_CACHE_TTL
+from services.redis_cache_service import redis_cache
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfileCache:
+    """
+    کش دو لایه پروفایل/پلن کاربر (LRU داخل پروسه + Redis)
+
+    فقط داده خام ردیف users نگه داشته می‌شود؛ فعال بودن پلن هنگام خواندن
+    از روی plan_end محاسبه می‌شود تا انقضا نیازی به invalidate نداشته باشد.
+    """
+
+    KEY_PREFIX = "user_profile"
+
+    def __init__(self, max_size: int = USER_CACHE_MAX_SIZE,
+                 local_ttl: int = USER_CACHE_LOCAL_TTL, redis_ttl: int = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self._local: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _redis_key(self, user_id: int) -> str:
+        return f"{self.KEY_PREFIX}:{user_id}"
+
+    @staticmethod
+    def _to_cache(profile: Dict[str, Any]) -> Dict[str, Any]:
+        data = dict(profile)
+        for field in ("tnt_plan_end", "tnt_plan_start"):
+            if isinstance(data.get(field), datetime):
+                data[field] = data[field].isoformat()
+        return data
+
+    @staticmethod
+    def _from_cache(data: Dict[str, Any]) -> Dict[str, Any]:
+        profile = dict(data)
+        for field in ("tnt_plan_end", "tnt_plan_start"):
+            if isinstance(profile.get(field), str):
+                profile[field] = datetime.fromisoformat(profile[field])
+        return profile
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """دریافت پروفایل از LRU و سپس Redis"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(user_id)
+            if entry is not None:
+                expires_at, profile = entry
+                if expires_at > now:
+                    self._local.move_to_end(user_id)
+                    self._stats["local_hits"] += 1
+                    return profile
+                del self._local[user_id]
+
+        data = redis_cache.get(self._redis_key(user_id))
+        if data:
+            profile = self._from_cache(data)
+            self._set_local(user_id, profile)
+            self._stats["redis_hits"] += 1
+            return profile
+
+        self._stats["misses"] += 1
+        return None
+
+    def set(self, user_id: int, profile: Dict[str, Any]):
+        """ذخیره پروفایل در هر دو لایه"""
+        self._set_local(user_id, profile)
+        redis_cache.set(self._redis_key(user_id), self._to_cache(profile), self.redis_ttl)
+
+    def _set_local(self, user_id: int, profile: Dict[str, Any]):
+        with self._lock:
+            self._local[user_id] = (time.monotonic() + self.local_ttl, profile)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """حذف پروفایل کاربر بعد از تغییر پلن"""
+        with self._lock:
+            self._local.pop(user_id, None)
+        redis_cache.delete(self._redis_key(user_id))
+        self._stats["invalidations"] += 1
+        logger.debug(f"Invalidated cached profile for user {user_id}")
+
+    def clear(self):
+        """پاک کردن کامل کش (مثلاً بعد از پاک‌سازی دیتابیس)"""
+        with self._lock:
+            self._local.clear()
+        redis_cache.clear_pattern(f"{self.KEY_PREFIX}:*")
+        logger.info("🗑️ User profile cache cleared")
+
+    def stats(self) -> Dict[str, Any]:
+        """آمار کش پروفایل"""
+        with self._lock:
+            size = len(self._local)
+        return {"local_size": size, "max_size": self.max_size, **self._stats}
+
+
+# نمونه global
+user_profile_cache = UserProfileCache()
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from config.settings import (
+    USER_REGISTRY_BATCH_SIZE, USER_REGISTRY_FLUSH_INTERVAL, USER_REGISTRY_MAX_KNOWN
+)
+from database import db_manager
+from database.repository import UserRepository
+
+logger = logging.getLogger(__name__)
+
+
+class UserRegistry:
+    """
+    ثبت‌نام کاربران با کش عضویت و صف write-behind
+
+    کاربران شناخته شده (مجموعه محدود LRU که هنگام راه‌اندازی گرم می‌شود)
+    هیچ کوئری‌ای به دیتابیس نمی‌زنند. کاربران ناشناس در صف قرار می‌گیرند و
+    به صورت دسته‌ای با ON CONFLICT DO NOTHING درج می‌شوند؛ بنابراین اگر کاربری
+    از مجموعه بیرون رانده شده باشد، درج دوباره او بی‌ضرر است.
+    """
+
+    def __init__(self, max_known: int = USER_REGISTRY_MAX_KNOWN,
+                 batch_size: int = USER_REGISTRY_BATCH_SIZE,
+                 flush_interval: float = USER_REGISTRY_FLUSH_INTERVAL):
+        self.max_known = max_known
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._known: "OrderedDict[int, None]" = OrderedDict()
+        self._pending: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        # flushهای فوری (صف پر)؛ ارجاع نگه داشته می‌شود تا garbage collect نشوند
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self._stats = {"hits": 0, "queued": 0, "inserted": 0, "flushes": 0, "errors": 0}
+
+    # === Membership ===
+    def is_known(self, user_id: int) -> bool:
+        """آیا کاربر قبلاً ثبت شده (یا در صف ثبت) است؟"""
+        with self._lock:
+            if user_id in self._known:
+                self._known.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return True
+            return user_id in self._pending
+
+    def mark_known(self, user_id: int):
+        with self._lock:
+            self._mark_known_locked(user_id)
+
+    def _mark_known_locked(self, user_id: int):
+        self._known[user_id] = None
+        self._known.move_to_end(user_id)
+        while len(self._known) > self.max_known:
+            self._known.popitem(last=False)
+
+    def is_pending(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._pending
+
+    def register(self, user_id: int, username: Optional[str] = None) -> bool:
+        """
+        ثبت کاربر در صورت ناشناس بودن
+        True یعنی کاربر به صف درج اضافه شد.
+        """
+        if self.is_known(user_id):
+            return False
+
+        with self._lock:
+            self._pending[user_id] = {
+                "user_id": user_id,
+                "username": username,
+                "created_at": datetime.now(),
+            }
+            self._stats["queued"] += 1
+            pending_count = len(self._pending)
+
+        if pending_count >= self.batch_size and self._task:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._on_flush_done)
+        return True
+
+    def _on_flush_done(self, task: asyncio.Task):
+        self._flush_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"User registry flush failed: {task.exception()}")
+
+    async def ensure_registered(self, user_id: int, username: Optional[str] = None):
+        """ثبت فوری کاربر (برای مسیرهایی که بلافاصله به ردیف users نیاز دارند)"""
+        self.register(user_id, username)
+        if self.is_pending(user_id):
+            await self.flush()
+
+    # === Write-behind ===
+    async def flush(self) -> int:
+        """درج دسته‌ای کاربران در صف"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        inserted = 0
+        async with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    batch_ids = list(self._pending)[:self.batch_size]
+                    batch = [self._pending.pop(user_id) for user_id in batch_ids]
+
+                try:
+                    count = await asyncio.to_thread(self._insert_batch, batch)
+                except Exception as e:
+                    # بازگرداندن به صف برای تلاش بعدی
+                    with self._lock:
+                        for user in batch:
+                            self._pending.setdefault(user["user_id"], user)
+                    self._stats["errors"] += 1
+                    logger.error(f"Error flushing user registrations: {e}")
+                    break
+
+                with self._lock:
+                    for user in batch:
+                        self._mark_known_locked(user["user_id"])
+                inserted += count
+                self._stats["flushes"] += 1
+                self._stats["inserted"] += count
+                if count:
+                    logger.info(f"New users registered: {count} (batch of {len(batch)})")
+
+        return inserted
+
+    @staticmethod
+    def _insert_batch(batch) -> int:
+        with db_manager.get_session() as session:
+            return UserRepository(session).bulk_register_users(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"User registry flush loop error: {e}")
+
+    # === Lifecycle ===
+    def warm_up(self) -> int:
+        """بارگذاری شناسه کاربران موجود در مجموعه عضویت"""
+        with db_manager.get_session() as session:
+            user_ids = UserRepository(session).get_user_ids(limit=self.max_known)
+
+        with self._lock:
+            # جدیدترین کاربران باید در انتهای LRU باشند
+            for user_id in reversed(user_ids):
+                self._mark_known_locked(user_id)
+        logger.info(f"✅ Known-users cache warmed with {len(user_ids):,} ids")
+        return len(user_ids)
+
+    async def start(self):
+        """گرم کردن کش و شروع flush دوره‌ای"""
+        try:
+            await asyncio.to_thread(self.warm_up)
+        except Exception as e:
+            logger.error(f"Could not warm known-users cache: {e}")
+
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        """توقف flush دوره‌ای و درج باقی‌مانده صف"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def clear(self):
+        """
+        پاک کردن مجموعه عضویت (بعد از پاک‌سازی دیتابیس)؛ صف درج دست نمی‌خورد
+        تا کاربرانی که حین پاک‌سازی ثبت‌نام کرده‌اند از دست نروند
+        """
+        with self._lock:
+            self._known.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "known": len(self._known),
+                "pending": len(self._pending),
+                **self._stats,
+            }
+
+
+# نمونه global
+user_registry = UserRegistry()
@@ -5,6 +5,9 @@ from telegram import Update, InlineKeyboardMarkup, InputMediaPhoto, InputMediaAn
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 
+from services.executor_service import executor_service
+
+
 class MediaHandler:
    def __init__(self):
        self.media_path = "resources/media/"
@@ -23,18 +26,29 @@ class MediaHandler:
    def file_exists(self, file_path):
        """بررسی وجود فایل"""
        return os.path.exists(file_path) and os.path.getsize(file_path) > 0
+
+   @staticmethod
+   def _read_file(file_path):
+       with open(file_path, 'rb') as media_file:
+           return media_file.read()
+
+   async def read_media(self, file_path):
+       """خواندن فایل رسانه در thread pool تا event loop مسدود نشود"""
+       return await executor_service.run_io(self._read_file, file_path)
    
    async def send_welcome_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE, 
                               reply_markup: InlineKeyboardMarkup = None):
        """ارسال رسانه خوشامدگویی"""
        print(f"🔍 DEBUG: Looking for GIF at: {self.gifs_path}welcome.gif")
        welcome_gif = os.path.join(self.gifs_path, "welcome.gif")
-       print(f"🔍 DEBUG: File exists: {self.file_exists(welcome_gif)}")
+       exists = await executor_service.run_io(self.file_exists, welcome_gif)
+       print(f"🔍 DEBUG: File exists: {exists}")
        
-       if self.file_exists(welcome_gif):
+       if exists:
            try:
                print(f"🔍 DEBUG: Attempting to send GIF...")
-               with open(welcome_gif, 'rb') as gif:
+               gif = await self.read_media(welcome_gif)
+               if gif:
                    user_name = update.effective_user.first_name or "کاربر"
                    caption = (
                        f"سلام {user_name} عزیز! 👋✨\n\n"
@@ -45,6 +59,7 @@ class MediaHandler:
                    await context.bot.send_animation(
                        chat_id=update.effective_chat.id,
                        animation=gif,
+                       filename="welcome.gif",
                        caption=caption,
                        reply_markup=reply_markup,
                        parse_mode=ParseMode.MARKDOWN
@@ -63,12 +78,14 @@ class MediaHandler:
        """ارسال رسانه برای منوی کریپتو"""
        crypto_gif = os.path.join(self.gifs_path, "crypto_market.gif")
        
-       if self.file_exists(crypto_gif):
+       if await executor_service.run_io(self.file_exists, crypto_gif):
            try:
-               with open(crypto_gif, 'rb') as gif:
+               gif = await self.read_media(crypto_gif)
+               if gif:
                    await context.bot.send_animation(
                        chat_id=update.effective_chat.id,
                        animation=gif,
+                       filename="crypto_market.gif",
                        caption=message_text,
                        reply_markup=reply_markup,
                        parse_mode=ParseMode.MARKDOWN
@@ -83,10 +100,24 @@ class MediaHandler:
 media_handler = MediaHandler()
 
 
+async def download_photo_bytes(file_id: str, context: ContextTypes.DEFAULT_TYPE) -> bytearray | None:
+    """
+    عکس را مستقیم در حافظه دانلود می‌کند (بدون فایل موقت)
+    خروجی را می‌توان به صورت memoryview به ai_service داد.
+    """
+    try:
+        bot_file = await context.bot.get_file(file_id)
+        return await bot_file.download_as_bytearray()
+    except Exception as e:
+        print(f"❌ Error downloading photo: {e}")
+        return None
+
+
 async def download_photo(file_id: str, context: ContextTypes.DEFAULT_TYPE) -> str | None:
     """
     عکس را در یک فایل موقت امن دانلود کرده و مسیر آن را برمی‌گرداند.
     فایل پس از استفاده باید به صورت دستی پاک شود.
+    برای ارسال به هوش مصنوعی از download_photo_bytes استفاده کنید.
     """
     try:
         bot_file = await context.bot.get_file(file_id)
@@ -0,0 +1,184 @@
+# utils/telegram_stream.py
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from telegram import Bot, Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from config.settings import STREAM_EDIT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+STREAM_CURSOR = " ▌"
+
+
+def split_pages(text: str, max_length: int) -> List[str]:
+    """
+    تقسیم متن به صفحات حداکثر max_length کاراکتری، ترجیحاً روی مرز خط.
+    مرز هر صفحه فقط به متن قبل از آن بستگی دارد، پس با رسیدن متن جدید
+    صفحات قبلی تغییر نمی‌کنند.
+    """
+    pages = []
+    while len(text) > max_length:
+        cut = text.rfind("\n", 0, max_length)
+        if cut < max_length // 2:
+            cut = max_length
+        pages.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    pages.append(text)
+    return pages
+
+
+def _retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class TelegramStreamWriter:
+    """
+    نمایش تدریجی پاسخ هوش مصنوعی با ویرایش پیام تلگرام
+
+    متن دریافتی از stream فقط در حافظه جمع می‌شود؛ یک task پس‌زمینه حداکثر
+    هر STREAM_EDIT_INTERVAL ثانیه یک بار پیام را ویرایش می‌کند (محدودیت ویرایش
+    تلگرام) و با رسیدن به سقف طول پیام، ادامه متن در پیام جدید نوشته می‌شود.
+    در پایان، هر صفحه یک بار با parse_mode نهایی ویرایش می‌شود.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, prefix: str = "", message_id: Optional[int] = None,
+                 interval: float = STREAM_EDIT_INTERVAL, max_length: int = TELEGRAM_MAX_MESSAGE_LENGTH - 96,
+                 parse_mode: Optional[str] = "Markdown"):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.prefix = prefix
+        self.interval = interval
+        self.max_length = max_length
+        self.parse_mode = parse_mode
+        self._text = ""
+        self._message_ids: List[int] = [message_id] if message_id else []
+        self._shown: List[str] = []
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._not_before = 0.0
+        self.edits = 0
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def started(self) -> bool:
+        """آیا تا الان متنی از پاسخ به کاربر نشان داده شده است؟"""
+        return bool(self._shown)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def append(self, delta: str):
+        """افزودن تکه جدید متن (بدون انتظار برای تلگرام)"""
+        if not delta:
+            return
+        self._text += delta
+        self._dirty.set()
+        self.start()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            wait = max(self._not_before - time.monotonic(), 0.0)
+            if wait:
+                await asyncio.sleep(wait)
+            self._dirty.clear()
+            await self._render(final=False)
+            self._not_before = time.monotonic() + self.interval
+
+    async def finish(self, text: Optional[str] = None) -> List[int]:
+        """توقف ویرایش‌های میانی و نمایش متن کامل؛ شناسه پیام‌ها را برمی‌گرداند"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if text is not None:
+            self._text = text
+        wait = max(self._not_before - time.monotonic(), 0.0)
+        if wait and self._shown:
+            await asyncio.sleep(wait)
+        await self._render(final=True)
+        return list(self._message_ids)
+
+    async def _render(self, final: bool):
+        pages = split_pages(self.prefix + self._text, self.max_length)
+        for index, page in enumerate(pages):
+            is_last = index == len(pages) - 1
+            display = page if final or not is_last else page + STREAM_CURSOR
+            if not final and index < len(self._shown) and self._shown[index] == display:
+                continue
+            if not display.strip():
+                continue
+            await self._show(index, display, final)
+
+    async def _show(self, index: int, text: str, final: bool, attempts: int = 3):
+        parse_mode = self.parse_mode if final else None
+        for attempt in range(attempts):
+            try:
+                if index < len(self._message_ids):
+                    await self.bot.edit_message_text(
+                        chat_id=self.chat_id, message_id=self._message_ids[index],
+                        text=text, parse_mode=parse_mode
+                    )
+                else:
+                    message = await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
+                    self._message_ids.append(message.message_id)
+                self.edits += 1
+                break
+            except RetryAfter as e:
+                seconds = _retry_seconds(e)
+                self._not_before = time.monotonic() + seconds
+                self.interval = min(self.interval * 2, 5.0)
+                if not final:
+                    # ویرایش میانی؛ دفعه بعد با متن جدیدتر انجام می‌شود
+                    return
+                await asyncio.sleep(seconds)
+            except BadRequest as e:
+                message = str(e).lower()
+                if "not modified" in message:
+                    break
+                if parse_mode is not None and "parse" in message:
+                    # markdown تولید شده توسط مدل معتبر نیست؛ متن ساده
+                    parse_mode = None
+                    continue
+                logger.warning(f"Could not update streamed message: {e}")
+                return
+            except TelegramError as e:
+                logger.warning(f"Could not update streamed message: {e}")
+                if attempt == attempts - 1:
+                    return
+                await asyncio.sleep(1 + attempt)
+        else:
+            return
+
+        if index < len(self._shown):
+            self._shown[index] = text
+        else:
+            self._shown.append(text)
+
+
+def queue_status_callback(message: Message, working_text: str):
+    """
+    callback اعلام جایگاه صف هوش مصنوعی با ویرایش پیام وضعیت؛
+    با شروع پردازش (جایگاه صفر) متن «در حال تحلیل» برمی‌گردد.
+    """
+    async def on_queue(position: int):
+        if position:
+            text = f"⏳ درخواست شما در صف است (نفر {position})\nبه محض آزاد شدن ظرفیت، پردازش شروع می‌شود."
+        else:
+            text = working_text
+        try:
+            await message.edit_text(text)
+        except TelegramError as e:
+            logger.debug(f"Could not show queue position: {e}")
+
+    return on_queue
@@ -0,0 +1,63 @@
+# utils/update_processor.py
+import asyncio
+import sys
+from typing import Any, Awaitable, Dict, List
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    پردازش همزمان آپدیت‌های کاربران مختلف، ولی آپدیت‌های هر کاربر به ترتیب
+
+    بدون این، یک تحلیل طولانی هوش مصنوعی کل ربات را معطل می‌کند؛ با
+    concurrent_updates معمولی هم چند عکس پشت سر هم یک کاربر (یا
+    ConversationHandler او) همزمان پردازش می‌شوند و user_data به هم می‌ریزد.
+
+    semaphore کلاس پایه قبل از do_process_update گرفته می‌شود، پس آپدیت‌هایی
+    که پشت قفل کاربر منتظرند هم ظرفیت را اشغال می‌کردند و یک کاربر با چند
+    کلیک حین تحلیل می‌توانست کل ربات را متوقف کند. برای همین سقف کلاس پایه
+    عملاً نامحدود است و سقف واقعی بعد از گرفتن قفل کاربر اعمال می‌شود.
+    """
+
+    __slots__ = ("_locks", "_limit", "_running")
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        # کلاس پایه semaphore خود را با همین مقدار می‌سازد
+        self._limit = sys.maxsize
+        super().__init__(sys.maxsize)
+        self._limit = max_concurrent_updates
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user_id -> [قفل، تعداد آپدیت‌های در انتظار]
+        self._locks: Dict[int, List[Any]] = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._limit
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(user.id, None)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass